@@ -0,0 +1,283 @@
+import time
+import asyncio
+from aio_helpers import aio_get_json
+from aio_scrape_helpers import extract_emails_from_websites_async
+from quota_helpers import AsyncSingleFlight, QuotaExceeded
+from metrics_helpers import timed, GOOGLE_REQUESTS, GOOGLE_DURATION
+from google_helpers import GOOGLE_API_KEY, GOOGLE_ENDPOINTS, GOOGLE_QUOTA_WAIT, GOOGLE_QUOTA_BACKOFF
+from google_helpers import DETAILS_PROFILES, DEFAULT_DETAILS_PROFILE, MAX_NEARBY_PAGES
+from google_helpers import PAGE_TOKEN_DELAY, PAGE_TOKEN_RETRY_DELAY, PAGE_TOKEN_RETRIES, PageTokenNotReady
+from google_helpers import InvalidPageToken
+from google_helpers import quota_buckets, details_cache, geocode_cache, autocomplete_cache
+from google_helpers import normalize_query, autocomplete_from_prefix, nearby_params, parse_nearby_page
+from google_helpers import cached_place_details, business_from_details
+
+# google_helpers for the event loop. Caches and quota buckets are the
+# same objects, so sync and async requests in one process share them.
+
+_google_flights = AsyncSingleFlight()
+
+
+async def google_get_async(endpoint, params):
+    # google_get, awaiting instead of blocking a thread
+    key = (endpoint, tuple(sorted(params.items())))
+    return await _google_flights.do(key, lambda: _governed_get_async(endpoint, params))
+
+
+async def _governed_get_async(endpoint, params):
+    bucket = quota_buckets[endpoint]
+    deadline = time.monotonic() + GOOGLE_QUOTA_WAIT
+    while True:
+        with timed("google_quota_wait"):
+            acquired = await bucket.acquire_async(deadline)
+        if not acquired:
+            raise QuotaExceeded(f"Google {endpoint} quota exhausted, try again shortly")
+
+        status = "error"
+        started = time.perf_counter()
+        try:
+            with timed("google"):
+                data = await aio_get_json(GOOGLE_ENDPOINTS[endpoint], params=params)
+            status = data.get("status", "UNKNOWN")
+        finally:
+            GOOGLE_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+            GOOGLE_REQUESTS.inc(endpoint=endpoint, status=status)
+        if data.get("status") != "OVER_QUERY_LIMIT":
+            return data
+        bucket.pause(GOOGLE_QUOTA_BACKOFF)
+
+
+def get_aio_flight_stats():
+    return _google_flights.stats()
+
+
+async def _cached(store, fn, *args):
+    # With CACHE_DB_PATH set, cache reads and writes hit sqlite under a
+    # process-wide lock: run them on a thread so the loop isn't blocked.
+    # Memory-only caches stay on the loop.
+    if store.shared:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def geocode_city_async(city: str):
+    cache_key = normalize_query(city)
+    cached = await _cached(geocode_cache, geocode_cache.get, cache_key)
+    if cached is not None:
+        return tuple(cached)
+
+    data = await google_get_async("geocode", {"address": city, "key": GOOGLE_API_KEY})
+
+    if data.get("status") != "OK":
+        return None
+
+    location = data["results"][0]["geometry"]["location"]
+    await _cached(geocode_cache, geocode_cache.set, cache_key, [location["lat"], location["lng"]])
+    return location["lat"], location["lng"]
+
+
+async def autocomplete_cities_async(query: str):
+    cache_key = normalize_query(query)
+    if not cache_key:
+        return []
+
+    cached = await _cached(autocomplete_cache, autocomplete_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    reused = await _cached(autocomplete_cache, autocomplete_from_prefix, cache_key)
+    if reused is not None:
+        return reused
+
+    data = await google_get_async("autocomplete", {"input": query, "types": "(cities)", "key": GOOGLE_API_KEY})
+
+    suggestions = [p["description"] for p in data.get("predictions", [])]
+
+    if data.get("status") in ["OK", "ZERO_RESULTS"]:
+        await _cached(autocomplete_cache, autocomplete_cache.set, cache_key, suggestions)
+    return suggestions
+
+
+async def nearby_search_async(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None):
+    data = await google_get_async("nearby", nearby_params(lat, lng, place_type, radius, keyword, next_token))
+    return parse_nearby_page(data, next_token)
+
+
+async def next_page_when_ready_async(lat, lng, place_type, radius, keyword, token, delay=None):
+    await asyncio.sleep(PAGE_TOKEN_DELAY if delay is None else delay)
+    for attempt in range(PAGE_TOKEN_RETRIES):
+        try:
+            return await nearby_search_async(lat, lng, place_type, radius, keyword, token)
+        except PageTokenNotReady:
+            await asyncio.sleep(PAGE_TOKEN_RETRY_DELAY)
+    raise InvalidPageToken("next_page_token is invalid or expired")
+
+
+async def first_page_async(lat, lng, place_type, radius, keyword, next_token=None):
+    if not next_token:
+        return await nearby_search_async(lat, lng, place_type, radius, keyword)
+    return await next_page_when_ready_async(lat, lng, place_type, radius, keyword, next_token, delay=0)
+
+
+async def nearby_search_all_async(lat, lng, place_type=None, radius=2000, keyword=None):
+    places, token = await nearby_search_async(lat, lng, place_type, radius, keyword)
+    for _ in range(MAX_NEARBY_PAGES - 1):
+        if not token:
+            break
+        more, token = await next_page_when_ready_async(lat, lng, place_type, radius, keyword, token)
+        places.extend(more)
+    return places
+
+
+async def fetch_place_details_async(place_id, fields=DETAILS_PROFILES["full"]):
+    cached = await _cached(details_cache, cached_place_details, place_id, fields)
+    if cached is not None:
+        return cached
+
+    data = await google_get_async("details", {"place_id": place_id, "fields": fields, "key": GOOGLE_API_KEY})
+    details = data.get("result", {})
+
+    # Don't cache empty/failed lookups
+    if details:
+        await _cached(details_cache, details_cache.set, f"{place_id}|{fields}", details)
+    return details
+
+
+async def _build_business_async(place, profile=DEFAULT_DETAILS_PROFILE):
+    fields = DETAILS_PROFILES[profile]
+    details = {}
+    if fields:
+        try:
+            details = await fetch_place_details_async(place["place_id"], fields)
+        except Exception as e:
+            # Only this entry degrades: keep what Nearby Search gave us
+            print("Place details error:", place["place_id"], e)
+    return business_from_details(place, details, profile)
+
+
+async def resolve_businesses_async(places, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    if with_emails and profile == "list":
+        profile = "contact"
+
+    # Every Details lookup at once; the quota buckets do the pacing
+    final_list = await asyncio.gather(*(_build_business_async(place, profile) for place in places))
+
+    if with_emails:
+        websites = [b["website"] for b in final_list if b["website"]]
+        emails_by_site = await extract_emails_from_websites_async(websites)
+        for b in final_list:
+            if b["website"]:
+                b["emails"] = emails_by_site.get(b["website"], [])
+
+    return list(final_list)
+
+
+async def fetch_businesses_async(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                                 with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    places, next_page_token = await first_page_async(lat, lng, place_type, radius, keyword, next_token)
+
+    return {
+        "businesses": await resolve_businesses_async(places, with_emails, profile),
+        "next_page_token": next_page_token
+    }
+
+
+async def _iter_place_pages_async(lat, lng, place_type, radius, keyword, next_token, max_pages, target_count):
+    # _iter_place_pages: the next page is fetched as a task while the
+    # caller works on the current one
+    seen = set()
+    count = 0
+
+    places, token = await first_page_async(lat, lng, place_type, radius, keyword, next_token)
+
+    prefetch = None
+    try:
+        for page in range(max_pages):
+            more = token and page + 1 < max_pages
+            prefetch = None
+            if more:
+                prefetch = asyncio.ensure_future(
+                    next_page_when_ready_async(lat, lng, place_type, radius, keyword, token)
+                )
+
+            places = [p for p in places if p["place_id"] not in seen]
+            seen.update(p["place_id"] for p in places)
+            if target_count is not None and len(places) > target_count - count:
+                # Google's token would skip the rest of this page
+                places = places[:max(target_count - count, 0)]
+                token = None
+            count += len(places)
+
+            done = not more or (target_count is not None and count >= target_count)
+            if done and prefetch:
+                prefetch.cancel()
+            yield places, token
+
+            if done:
+                return
+            places, token = await prefetch
+    finally:
+        # Client went away mid-stream
+        if prefetch is not None and not prefetch.done():
+            prefetch.cancel()
+
+
+async def iter_business_pages_async(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                                    max_pages=3, target_count=None, with_emails=False,
+                                    profile=DEFAULT_DETAILS_PROFILE):
+    async for places, token in _iter_place_pages_async(lat, lng, place_type, radius, keyword, next_token,
+                                                       max_pages, target_count):
+        yield {"businesses": await resolve_businesses_async(places, with_emails, profile),
+               "next_page_token": token}
+
+
+async def fetch_business_pages_async(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                                     max_pages=3, target_count=None, with_emails=False,
+                                     profile=DEFAULT_DETAILS_PROFILE):
+    merged = []
+    next_page_token = None
+    async for page in iter_business_pages_async(lat, lng, place_type, radius, keyword, next_token,
+                                                max_pages, target_count, with_emails, profile):
+        merged.extend(page["businesses"])
+        next_page_token = page["next_page_token"]
+
+    return {"businesses": merged, "next_page_token": next_page_token}
+
+
+async def iter_business_events_async(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                                     max_pages=1, target_count=None, with_emails=False,
+                                     profile=DEFAULT_DETAILS_PROFILE):
+    # Same events as iter_business_events
+    if with_emails and profile == "list":
+        profile = "contact"
+
+    async def indexed(position, place):
+        return position, await _build_business_async(place, profile)
+
+    index = 0
+    next_page_token = None
+    async for places, token in _iter_place_pages_async(lat, lng, place_type, radius, keyword, next_token,
+                                                       max_pages, target_count):
+        tasks = [asyncio.ensure_future(indexed(index + i, place)) for i, place in enumerate(places)]
+        index += len(places)
+        next_page_token = token
+
+        websites = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                position, business = await next_done
+                if business["website"]:
+                    websites.setdefault(business["website"], []).append(business["place_id"])
+                yield {"event": "business", "index": position, "business": business}
+        finally:
+            # Client went away: don't resolve Details nobody will see
+            for task in tasks:
+                task.cancel()
+
+        if with_emails and websites:
+            emails_by_site = await extract_emails_from_websites_async(list(websites))
+            for website, place_ids in websites.items():
+                for place_id in place_ids:
+                    yield {"event": "emails", "place_id": place_id, "emails": emails_by_site.get(website, [])}
+
+    yield {"event": "done", "count": index, "next_page_token": next_page_token}
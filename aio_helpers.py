@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+from urllib.parse import urlsplit
+from contextlib import asynccontextmanager
+import httpx
+import asyncpg
+from dotenv import load_dotenv
+from http_helpers import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_PER_HOST
+from http_helpers import HTTP_RETRIES, HTTP_BACKOFF, DEFAULT_HEADERS
+from db_extentions import DATABASE_URL, DB_POOL_TIMEOUT
+from metrics_helpers import current_timings
+
+load_dotenv()
+
+# Event-loop counterparts of http_helpers and db_extentions, for asgi.py.
+# Everything here belongs to the serving loop: call aio_startup() on it
+# before use and aio_shutdown() when it stops.
+
+# Sockets open at once across all hosts. An event loop holds hundreds of
+# searches in flight, so this is far above the thread pools' limits.
+AIO_HTTP_MAX_CONNECTIONS = int(os.getenv("AIO_HTTP_MAX_CONNECTIONS", 512))
+AIO_HTTP_KEEPALIVE = int(os.getenv("AIO_HTTP_KEEPALIVE", 128))
+# Requests in flight per API host. Google calls are paced by the quota
+# buckets; business websites keep the politer HTTP_MAX_PER_HOST.
+AIO_API_MAX_PER_HOST = int(os.getenv("AIO_API_MAX_PER_HOST", 256))
+
+AIO_DB_POOL_MIN = int(os.getenv("AIO_DB_POOL_MIN", 2))
+AIO_DB_POOL_MAX = int(os.getenv("AIO_DB_POOL_MAX", 20))
+
+# Same retry policy as the requests sessions
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+_clients = {}
+_host_limits = {}
+_db_pool = None
+
+
+async def _init_connection(conn):
+    # jsonb in and out as Python objects, like psycopg2 does
+    for json_type in ("json", "jsonb"):
+        await conn.set_type_codec(json_type, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def aio_startup():
+    global _db_pool
+    limits = httpx.Limits(max_connections=AIO_HTTP_MAX_CONNECTIONS, max_keepalive_connections=AIO_HTTP_KEEPALIVE)
+    timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    # Separate pools, so slow websites can't take every connection from Google calls
+    for kind in ("api", "scrape"):
+        _clients[kind] = httpx.AsyncClient(limits=limits, timeout=timeout, headers=DEFAULT_HEADERS,
+                                           follow_redirects=True)
+
+    if DATABASE_URL:
+        try:
+            _db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=AIO_DB_POOL_MIN,
+                                                 max_size=AIO_DB_POOL_MAX, init=_init_connection)
+        except Exception as e:
+            # asyncpg errors can echo the DSN, password included
+            print("Database connection error:", str(e).replace(DATABASE_URL, "<DATABASE_URL>"))
+            raise
+
+
+async def aio_shutdown():
+    global _db_pool
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+    _host_limits.clear()
+    if _db_pool is not None:
+        await _db_pool.close()
+        _db_pool = None
+
+
+def _host_semaphore(url, limit):
+    host = urlsplit(url).netloc.lower()
+    sem = _host_limits.get(host)
+    if sem is None:
+        sem = _host_limits[host] = asyncio.Semaphore(limit)
+    return sem
+
+
+def _retry_delay(attempt, retry_after):
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return HTTP_BACKOFF * 2 ** attempt
+
+
+async def aio_get_json(url, params=None):
+    # Parsed JSON of an API GET, retried like the "api" requests session.
+    # Website fetches (aio_get_capped) are never retried.
+    async with _host_semaphore(url, AIO_API_MAX_PER_HOST):
+        for attempt in range(HTTP_RETRIES + 1):
+            retry_after = None
+            try:
+                response = await _clients["api"].get(url, params=params)
+            except httpx.TransportError:
+                if attempt == HTTP_RETRIES:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+            await asyncio.sleep(_retry_delay(attempt, retry_after))
+
+
+async def aio_get_capped(url, max_bytes, timeout):
+    # (body, encoding) of a page, reading at most max_bytes of it
+    async with _host_semaphore(url, HTTP_MAX_PER_HOST):
+        async with _clients["scrape"].stream("GET", url, timeout=timeout) as response:
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes(64*1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes:
+                    break
+            return b"".join(chunks)[:max_bytes], response.encoding
+
+
+def aio_db_enabled():
+    return _db_pool is not None
+
+
+@asynccontextmanager
+async def aio_db_connection():
+    if _db_pool is None:
+        raise RuntimeError("Database is not configured")
+
+    started = time.monotonic()
+    async with _db_pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        # Same phases as db_connection(): waiting for a connection, then holding it
+        held_from = time.monotonic()
+        timings = current_timings()
+        if timings is not None:
+            timings.add("db_wait", held_from - started)
+        try:
+            yield conn
+        finally:
+            if timings is not None:
+                timings.add("db", time.monotonic() - held_from)
+
+
+def get_aio_stats():
+    stats = {"hosts": len(_host_limits), "db_pool_size": 0, "db_pool_idle": 0, "db_pool_max": AIO_DB_POOL_MAX}
+    if _db_pool is not None:
+        stats["db_pool_size"] = _db_pool.get_size()
+        stats["db_pool_idle"] = _db_pool.get_idle_size()
+    return stats
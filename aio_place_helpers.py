@@ -0,0 +1,228 @@
+import asyncio
+from collections import deque
+from aio_helpers import aio_db_connection, aio_db_enabled
+from aio_scrape_helpers import extract_emails_from_websites_async
+from aio_google_helpers import nearby_search_all_async, resolve_businesses_async
+from aio_google_helpers import fetch_businesses_async, fetch_business_pages_async
+from google_helpers import normalize_query, DEFAULT_DETAILS_PROFILE
+from scan_helpers import TILE_RESULT_CAP, NEARBY_PAGE_SIZE
+from place_helpers import PLACE_INDEX_ENABLED, PLACE_INDEX_TTL, PLACE_INDEX_MAX_TILES, PLACE_INDEX_MAX_STALE
+from place_helpers import PLACE_INDEX_MAX_SPLIT_TILES, TILE_PRECISION_MAX
+from place_helpers import PLACE_COLUMNS, PLACE_UPSERT_CONFLICT, covering_cells, tile_precision
+from place_helpers import place_rows, places_in_radius, local_page_slice, decode_local_token, is_local_token
+from place_helpers import tiles_from_results, is_complete_answer, split_cell, split_saturated, stale_parents
+
+# place_helpers over asyncpg, same tables and tokens
+
+_refresh_tasks = set()
+_refreshing = set()   # (geohash, place_type, keyword) queued or being searched
+
+
+async def _get_tiles(cells, place_type, keyword):
+    async with aio_db_connection() as conn:
+        rows = await conn.fetch("""
+            SELECT geohash, place_ids, saturated
+            FROM place_tiles
+            WHERE geohash = ANY($1::text[]) AND place_type = $2 AND keyword = $3
+              AND searched_at > NOW() - make_interval(secs => $4)
+        """, [c[0] for c in cells], place_type, keyword, float(PLACE_INDEX_TTL))
+    return {row["geohash"]: dict(row) for row in rows}
+
+
+async def _resolve_tiles(cells, place_type, keyword, lat, lng, radius):
+    found, stale = [], []
+    while cells:
+        level = split_saturated(cells, await _get_tiles(cells, place_type, keyword), lat, lng, radius)
+        if level is None:
+            return None
+        found += level[0]
+        stale += level[1]
+        cells = level[2]
+        if len(found) + len(stale) + len(cells) > PLACE_INDEX_MAX_SPLIT_TILES:
+            return None
+    return found, stale
+
+
+async def _fresh_place_ids(place_ids):
+    async with aio_db_connection() as conn:
+        rows = await conn.fetch("""
+            SELECT place_id FROM places
+            WHERE place_id = ANY($1::text[]) AND hydrated AND updated_at > NOW() - make_interval(secs => $2)
+        """, list(place_ids), float(PLACE_INDEX_TTL))
+    return {row["place_id"] for row in rows}
+
+
+async def store_places_async(businesses):
+    rows = place_rows(businesses)
+    if not rows:
+        return
+
+    placeholders = ", ".join(f"${i + 1}" for i in range(len(rows[0])))
+    async with aio_db_connection() as conn:
+        await conn.executemany(f"""
+            INSERT INTO places ({", ".join(PLACE_COLUMNS)}, geohash, hydrated)
+            VALUES ({placeholders})
+        """ + PLACE_UPSERT_CONFLICT, rows)
+
+
+async def _store_tile(geohash, place_type, keyword, place_ids, saturated):
+    async with aio_db_connection() as conn:
+        await conn.execute("""
+            INSERT INTO place_tiles (geohash, place_type, keyword, place_ids, saturated, searched_at)
+            VALUES ($1, $2, $3, $4, $5, NOW())
+            ON CONFLICT (geohash, place_type, keyword) DO UPDATE SET
+                place_ids = EXCLUDED.place_ids,
+                saturated = EXCLUDED.saturated,
+                searched_at = NOW()
+        """, geohash, place_type, keyword, place_ids, saturated)
+
+
+async def _refresh_tile(cell, place_type, keyword):
+    geohash, c_lat, c_lng, search_radius = cell
+    places = await nearby_search_all_async(c_lat, c_lng, place_type or None, search_radius, keyword or None)
+
+    place_ids = list(dict.fromkeys(p["place_id"] for p in places))
+    saturated = len(places) >= TILE_RESULT_CAP
+    if not saturated:
+        known = await _fresh_place_ids(place_ids)
+        await store_places_async(await resolve_businesses_async([p for p in places if p["place_id"] not in known]))
+
+    await _store_tile(geohash, place_type, keyword, place_ids, saturated)
+    return {"geohash": geohash, "place_ids": place_ids, "saturated": saturated}
+
+
+def schedule_tile_refresh_async(cells, place_type, keyword, lat, lng, radius):
+    # schedule_tile_refresh as a task on the loop; runs once the response is on its way
+    cells = [c for c in cells if (c[0], place_type, keyword) not in _refreshing]
+    if not cells:
+        return
+    _refreshing.update((c[0], place_type, keyword) for c in cells)
+    task = asyncio.ensure_future(_refresh_tiles(cells, place_type, keyword, lat, lng, radius))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _refresh_tiles(cells, place_type, keyword, lat, lng, radius):
+    try:
+        queue = deque(cells)
+        searched = 0
+        while queue and searched < PLACE_INDEX_MAX_SPLIT_TILES:
+            cell = queue.popleft()
+            searched += 1
+            if not (await _refresh_tile(cell, place_type, keyword))["saturated"]:
+                continue
+            if len(cell[0]) >= TILE_PRECISION_MAX:
+                break
+            queue.extend(split_cell(cell, lat, lng, radius))
+    except Exception as e:
+        print("Place tile refresh error:", e)
+    finally:
+        _refreshing.difference_update((c[0], place_type, keyword) for c in cells)
+
+
+async def _load_places(place_ids, cells, lat, lng, radius):
+    async with aio_db_connection() as conn:
+        rows = await conn.fetch(f"""
+            SELECT {", ".join(PLACE_COLUMNS)}, hydrated FROM places
+            WHERE place_id = ANY($1::text[]) AND geohash LIKE ANY($2::text[])
+            ORDER BY reviews_count DESC NULLS LAST, place_id
+        """, list(place_ids), [c[0] + "%" for c in cells])
+    return places_in_radius([dict(row) for row in rows], lat, lng, radius)
+
+
+async def _local_page(businesses, query, offset, count, with_emails):
+    page, next_page_token = local_page_slice(businesses, query, offset, count)
+
+    if with_emails:
+        websites = [b["website"] for b in page if b["website"]]
+        emails_by_site = await extract_emails_from_websites_async(websites)
+        for b in page:
+            if b["website"]:
+                b["emails"] = emails_by_site.get(b["website"], [])
+
+    return {"businesses": page, "next_page_token": next_page_token}
+
+
+async def search_index_async(lat, lng, place_type=None, radius=2000, keyword=None, count=NEARBY_PAGE_SIZE,
+                             with_emails=False):
+    # search_index: (result, stale cells), result None when the area can't be answered locally
+    place_type = place_type or ""
+    keyword = normalize_query(keyword or "")
+
+    cells = covering_cells(lat, lng, radius, tile_precision(radius))
+    if not cells or len(cells) > PLACE_INDEX_MAX_TILES:
+        return None, []
+
+    resolved = await _resolve_tiles(cells, place_type, keyword, lat, lng, radius)
+    if resolved is None:
+        return None, []
+
+    tiles, stale = resolved
+    if stale:
+        return None, stale
+
+    place_ids = {pid for t in tiles for pid in t["place_ids"]}
+    businesses = await _load_places(place_ids, cells, lat, lng, radius)
+
+    query = {"lat": lat, "lng": lng, "type": place_type, "radius": radius, "keyword": keyword}
+    return await _local_page(businesses, query, 0, count, with_emails), []
+
+
+async def search_index_page_async(token, with_emails=False):
+    query, offset, count = decode_local_token(token)
+
+    cells = covering_cells(query["lat"], query["lng"], query["radius"], tile_precision(query["radius"]))
+    tiles, _ = await _resolve_tiles(cells, query["type"], query["keyword"],
+                                    query["lat"], query["lng"], query["radius"]) or ([], [])
+    place_ids = {pid for t in tiles for pid in t["place_ids"]}
+    businesses = await _load_places(place_ids, cells, query["lat"], query["lng"], query["radius"])
+
+    return await _local_page(businesses, query, offset, count, with_emails)
+
+
+async def fetch_businesses_indexed_async(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                                         pages=1, limit=None, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    # fetch_businesses_indexed on the event loop
+    if is_local_token(next_token):
+        return await search_index_page_async(next_token, with_emails)
+
+    indexed = PLACE_INDEX_ENABLED and aio_db_enabled()
+    stale = []
+    if indexed and not next_token:
+        try:
+            result, stale = await search_index_async(lat, lng, place_type, radius, keyword,
+                                                     limit or pages * NEARBY_PAGE_SIZE, with_emails)
+        except Exception as e:
+            print("Place index error:", e)
+            result = None
+        if result is not None:
+            return result
+
+    if pages > 1:
+        result = await fetch_business_pages_async(lat, lng, place_type, radius, keyword, next_token,
+                                                  pages, limit, with_emails, profile)
+    else:
+        result = await fetch_businesses_async(lat, lng, place_type, radius, keyword, next_token,
+                                              with_emails, profile)
+
+    if indexed:
+        try:
+            await store_places_async(result["businesses"])
+            stale = await _fill_tiles(stale, lat, lng, radius, place_type, keyword, limit, result)
+            if len(stale_parents(stale, radius)) <= PLACE_INDEX_MAX_STALE:
+                schedule_tile_refresh_async(stale, place_type or "", normalize_query(keyword or ""),
+                                            lat, lng, radius)
+        except Exception as e:
+            print("Place index error:", e)
+    return result
+
+
+async def _fill_tiles(stale, lat, lng, radius, place_type, keyword, limit, result):
+    if not stale or not is_complete_answer(result, limit):
+        return stale
+
+    filled = set()
+    for cell, place_ids in tiles_from_results(stale, lat, lng, radius, result["businesses"]):
+        await _store_tile(cell[0], place_type or "", normalize_query(keyword or ""), place_ids, False)
+        filled.add(cell[0])
+    return [c for c in stale if c[0] not in filled]
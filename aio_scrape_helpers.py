@@ -0,0 +1,127 @@
+import time
+import asyncio
+from aio_helpers import aio_get_capped, aio_db_connection, aio_db_enabled
+from common_helpers import ScrapeBatch, emails_in_page, website_cache_key
+from common_helpers import SCRAPE_PAGE_TIMEOUT, SCRAPE_DEADLINE, SCRAPE_MAX_BYTES, SCRAPE_CACHE_TTL
+from metrics_helpers import timed, SCRAPE_PAGES, SCRAPE_DURATION
+
+
+async def _scrape_page_async(page_url):
+    print(f"Scraping page: {page_url}")
+    started = time.perf_counter()
+    result = "error"
+    try:
+        body, encoding = await aio_get_capped(page_url, SCRAPE_MAX_BYTES, SCRAPE_PAGE_TIMEOUT)
+        # Decoding and scanning up to SCRAPE_MAX_BYTES is CPU work: off the loop
+        emails = await asyncio.to_thread(emails_in_page, body, encoding)
+        result = "emails" if emails else "no_emails"
+        return emails
+    except Exception as e:
+        print(f"Error scraping {page_url}: {e}")
+        return None
+    finally:
+        SCRAPE_DURATION.observe(time.perf_counter() - started)
+        SCRAPE_PAGES.inc(result=result)
+
+
+async def extract_emails_from_website_async(url):
+    return (await extract_emails_from_websites_async([url])).get(url, [])
+
+
+async def extract_emails_from_websites_async(urls, deadline=None):
+    # extract_emails_from_websites on the event loop: {url: [emails]}
+    with timed("scrape"):
+        return await _extract_emails_from_websites_async(urls, deadline)
+
+
+async def _extract_emails_from_websites_async(urls, deadline):
+    deadline = SCRAPE_DEADLINE if deadline is None else deadline
+    stop_at = time.monotonic() + deadline
+
+    urls = [url for url in urls if url]
+    batch = ScrapeBatch(urls, await get_cached_scrapes_async(list(dict.fromkeys(urls))))
+    pending = {}                         # task -> (url, is_homepage)
+
+    def submit(pages):
+        for url, page_url, is_homepage in pages:
+            pending[asyncio.ensure_future(_scrape_page_async(page_url))] = (url, is_homepage)
+
+    try:
+        submit(batch.homepages())
+        while pending:
+            timeout = stop_at - time.monotonic()
+            if timeout <= 0:
+                break
+            done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                if task not in pending:
+                    continue
+                url, is_homepage = pending.pop(task)
+                next_pages = batch.page_done(url, is_homepage, task.result())
+                if next_pages is None:
+                    # Site is done: its other pages aren't needed
+                    for other, (site, _) in list(pending.items()):
+                        if site == url:
+                            other.cancel()
+                            del pending[other]
+                else:
+                    submit(next_pages)
+    finally:
+        # Deadline hit, or the caller went away
+        for task in pending:
+            task.cancel()
+    results = batch.finish()
+
+    await store_scrapes_async(batch.scrapes_to_store())
+
+    return results
+
+
+async def get_cached_scrapes_async(urls):
+    # get_cached_scrapes over asyncpg
+    by_key = {}
+    for url in urls:
+        by_key.setdefault(website_cache_key(url), []).append(url)
+    if not by_key or not aio_db_enabled():
+        return {}
+
+    try:
+        async with aio_db_connection() as conn:
+            rows = await conn.fetch("""
+                SELECT domain, emails FROM scrape_cache
+                WHERE domain = ANY($1::text[]) AND expires_at > NOW()
+            """, list(by_key))
+    except Exception as e:
+        print("Scrape cache read error:", e)
+        return {}
+
+    cached = {}
+    for row in rows:
+        for url in by_key[row["domain"]]:
+            cached[url] = row["emails"]
+    return cached
+
+
+async def store_scrapes_async(scrapes):
+    # scrapes: {url: (emails, outcome)}
+    rows = {}
+    for url, (emails, outcome) in scrapes.items():
+        key = website_cache_key(url)
+        rows[key] = (key, emails, outcome, float(SCRAPE_CACHE_TTL[outcome]))
+    if not rows or not aio_db_enabled():
+        return
+
+    try:
+        async with aio_db_connection() as conn:
+            await conn.executemany("""
+                INSERT INTO scrape_cache (domain, emails, outcome, scraped_at, expires_at)
+                VALUES ($1, $2::jsonb, $3, NOW(), NOW() + make_interval(secs => $4))
+                ON CONFLICT (domain) DO UPDATE
+                SET emails = EXCLUDED.emails,
+                    outcome = EXCLUDED.outcome,
+                    scraped_at = EXCLUDED.scraped_at,
+                    expires_at = EXCLUDED.expires_at
+            """, list(rows.values()))
+    except Exception as e:
+        print("Scrape cache write error:", e)
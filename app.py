@@ -1,39 +1,58 @@
 import os
-import io
-import csv
-import requests
+import json
+import time
+import base64
 import jwt
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from common_helpers import extract_emails_from_website, update_user_credits, get_user_by_id
-from google_helpers import geocode_city, GOOGLE_API_KEY, fetch_businesses
-from db_extentions import get_db_connection
-import bcrypt
+from common_helpers import extract_emails_from_website, get_cached_scrapes
+from credit_helpers import reserve_credits
+from auth_helpers import require_auth, optional_user_id, current_user, APP_SECRET, JWT_ALGO
+from auth_helpers import verify_google_id_token, start_google_certs_refresher
+from password_helpers import hash_password, verify_password
+from google_helpers import geocode_city, autocomplete_cities
+from google_helpers import iter_business_pages, iter_business_events, hydrate_businesses
+from google_helpers import MAX_NEARBY_PAGES, DETAILS_PROFILES, InvalidPageToken, get_quota_stats
+from scan_helpers import scan_area, iter_area_scan
+from quota_helpers import QuotaExceeded
+from place_helpers import fetch_businesses_indexed
+from db_extentions import db_cursor, get_pool_stats
+from cache_helpers import all_cache_stats
+from credit_helpers import pending_reservations
+from metrics_helpers import instrument_app, render_metrics, METRICS_TOKEN
+from job_helpers import submit_scrape_job, get_scrape_job, start_scrape_job_sweeper
+from export_helpers import stream_csv, stream_ndjson, stream_xlsx, iter_saved_businesses, EXPORT_FORMATS
 import datetime
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import RealDictCursor
-
-# Google token verify
-from google.oauth2 import id_token
-from google.auth.transport import requests as grequests
+from psycopg2.extras import execute_values
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)  # Needed for React frontend
+instrument_app(app)
 
-bcrypt = Bcrypt(app)
-
-APP_SECRET = os.getenv("APP_SECRET", "change-this-secret")
-JWT_ALGO = "HS256"
 JWT_EXP_DELTA_SECONDS = int(os.getenv("JWT_EXP", 60*60*24*7))  # one week
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")  # same as VITE_GOOGLE_CLIENT_ID
 
+def start_background_threads():
+    # Have Google's signing certs cached before the first sign-in
+    if GOOGLE_CLIENT_ID:
+        start_google_certs_refresher()
+
+    # Keep our scrape jobs alive and finish ones a stopped process left behind
+    start_scrape_job_sweeper()
+
+
+# Under `python app.py` the bcrypt workers ("spawn") re-run this script as
+# __mp_main__; only the serving process should start these
+if __name__ != "__mp_main__":
+    start_background_threads()
+
 # JWT helpers
 def generate_jwt(payload):
     payload_copy = payload.copy()
@@ -44,9 +63,6 @@ def generate_jwt(payload):
         token = token.decode("utf-8")
     return token
 
-def decode_jwt(token):
-    return jwt.decode(token, APP_SECRET, algorithms=[JWT_ALGO])
-
 
 
 
@@ -57,16 +73,110 @@ def api_geocode():
     if not city:
         return jsonify({"error": "City is required"}), 400
 
-    coords = geocode_city(city)
+    try:
+        coords = geocode_city(city)
+    except QuotaExceeded as e:
+        return jsonify({"error": str(e)}), 503
     if not coords:
         return jsonify({"error": "Unable to geocode city"}), 404
 
     return jsonify({"lat": coords[0], "lng": coords[1]})
 
 
+def parse_business_query(args):
+    # /api/businesses query string -> (search args, None) or (None, error)
+    lat = args.get("lat")
+    lng = args.get("lng")
+
+    if not lat or not lng:
+        return None, "lat and lng are required"
+
+    try:
+        lat = float(lat)
+        lng = float(lng)
+    except ValueError:
+        return None, "lat and lng must be numbers"
+
+    business_type = args.get("type")
+    radius = int(args.get("radius", 2000))
+    keyword = args.get("keyword")
+    next_token = args.get("next_page_token")
+    with_emails = args.get("emails") in ("1", "true")
+
+    # "list" skips Place Details; hydrate the rest via /api/places/details
+    profile = args.get("profile", "full")
+    if profile not in DETAILS_PROFILES:
+        return None, f"profile must be one of {', '.join(DETAILS_PROFILES)}"
+
+    # Optional server-side pagination: collect several pages (or N results) in one call
+    try:
+        pages = min(max(int(args.get("pages", 1)), 1), MAX_NEARBY_PAGES)
+        limit = args.get("limit")
+        limit = int(limit) if limit else None
+    except ValueError:
+        return None, "pages and limit must be numbers"
+    if limit:
+        pages = MAX_NEARBY_PAGES
+
+    return (lat, lng, business_type, radius, keyword, next_token, pages, limit, with_emails, profile), None
+
+
 # Fetch nearby businesses
 @app.get("/api/businesses")
 def api_businesses():
+    query, error = parse_business_query(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    lat, lng, business_type, radius, keyword, next_token, pages, limit, with_emails, profile = query
+
+    if request.args.get("stream") == "sse":
+        # One event per business as soon as its Details resolve, then a
+        # "done" event with the next_page_token
+        def business_events():
+            try:
+                for event in iter_business_events(lat, lng, business_type, radius, keyword, next_token,
+                                                  pages, limit, with_emails, profile):
+                    yield f"event: {event.pop('event')}\ndata: {json.dumps(event)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+        return Response(business_events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    if request.args.get("stream") in ("1", "true"):
+        # One NDJSON line per page as soon as its Details are resolved
+        def page_lines():
+            try:
+                for page in iter_business_pages(lat, lng, business_type, radius, keyword, next_token,
+                                                pages, limit, with_emails, profile):
+                    yield json.dumps(page) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return Response(page_lines(), mimetype="application/x-ndjson")
+
+    try:
+        # Served from the local place index when the area was searched recently
+        businesses = fetch_businesses_indexed(lat, lng, business_type, radius, keyword, next_token,
+                                              pages, limit, with_emails, profile)
+    except InvalidPageToken as e:
+        return jsonify({"error": str(e)}), 400
+    except QuotaExceeded as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify(businesses)
+
+
+SCAN_COST = int(os.getenv("SCAN_COST", 10))  # cost per area scan (up to SCAN_MAX_TILES searches)
+
+# Cover a large radius with many smaller searches instead of one capped one
+@app.get("/api/businesses/scan")
+@require_auth
+def api_businesses_scan():
+    user_id = g.user_id
+
     lat = request.args.get("lat")
     lng = request.args.get("lng")
 
@@ -76,114 +186,168 @@ def api_businesses():
     try:
         lat = float(lat)
         lng = float(lng)
+        radius = int(request.args.get("radius", 5000))
+        limit = request.args.get("limit")
+        limit = int(limit) if limit else None
     except ValueError:
-        return jsonify({"error": "lat and lng must be numbers"}), 400
+        return jsonify({"error": "lat, lng, radius and limit must be numbers"}), 400
 
     business_type = request.args.get("type")
-    radius = int(request.args.get("radius", 2000))
     keyword = request.args.get("keyword")
-    next_token = request.args.get("next_page_token")
+    with_emails = request.args.get("emails") in ("1", "true")
+
+    profile = request.args.get("profile", "full")
+    if profile not in DETAILS_PROFILES:
+        return jsonify({"error": f"profile must be one of {', '.join(DETAILS_PROFILES)}"}), 400
+
+    # A scan can run hundreds of billed Google calls: charge before starting,
+    # refund if it fails on our side
+    reservation = reserve_credits(user_id, SCAN_COST, "area_scan")
+    if reservation.balance is None:
+        return jsonify({"error": "User not found"}), 404
+
+    if not reservation.ok:
+        return jsonify({
+            "error": "Not enough credits",
+            "credits_left": reservation.balance,
+            "required": SCAN_COST
+        }), 402  # Payment Required
+
+    if request.args.get("stream") in ("1", "true"):
+        # NDJSON: a progress line per finished tile, then the result line
+        def scan_lines():
+            try:
+                for event in reservation.guard(iter_area_scan(lat, lng, radius, business_type, keyword, limit,
+                                                              with_emails, profile)):
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                yield json.dumps({"event": "error", "error": str(e)}) + "\n"
 
+        response = Response(scan_lines(), mimetype="application/x-ndjson")
+        response.headers["X-Credits-Left"] = str(reservation.balance)
+        return response
 
     try:
-        businesses = fetch_businesses(lat, lng, business_type, radius, keyword, next_token)
+        result = scan_area(lat, lng, radius, business_type, keyword, limit, with_emails, profile)
     except Exception as e:
+        reservation.release()
         return jsonify({"error": str(e)}), 500
+    reservation.commit()
 
-    return jsonify(businesses)
+    response = jsonify(result)
+    response.headers["X-Credits-Left"] = str(reservation.balance)
+    return response
+
+
+HYDRATE_MAX_PLACES = 60
+
+# Details for places a "list" result left out, fetched only when the client needs them
+@app.post("/api/places/details")
+def api_place_details():
+    data = request.json or {}
+    place_ids = list(dict.fromkeys(p for p in data.get("place_ids", []) if p))
+    profile = data.get("profile", "full")
+    with_emails = bool(data.get("emails"))
 
+    if not place_ids:
+        return jsonify({"error": "place_ids is required"}), 400
+    if len(place_ids) > HYDRATE_MAX_PLACES:
+        return jsonify({"error": f"At most {HYDRATE_MAX_PLACES} places per request"}), 400
+    if profile not in DETAILS_PROFILES or DETAILS_PROFILES[profile] is None:
+        return jsonify({"error": "profile must be contact or full"}), 400
 
-def decode_token(token):
     try:
-        data = jwt.decode(token, APP_SECRET, algorithms=["HS256"])
-        print(data)
-        return data.get("id")
-    except Exception:
-        return None
+        businesses = hydrate_businesses(place_ids, profile, with_emails)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({"businesses": businesses})
+
+
+EXPORT_COST = 5  # cost per export
 
 # Export business list as CSV
 @app.post("/api/export-csv")
+@require_auth
 def export_csv_post():
-    # import pdb; pdb.set_trace()
-    # --- 1. AUTHENTICATION ---
-    auth_header = request.headers.get("Authorization")
-    print(auth_header)
-    if not auth_header:
-        return jsonify({"error": "Missing token"}), 401
-
-    token = auth_header.replace("Bearer ", "")
-    user_id = decode_token(token)
-    print(user_id)
-    if not user_id:
-        return jsonify({"error": "Invalid or expired token"}), 401
+    # --- 1. AUTHENTICATION (require_auth) ---
+    user_id = g.user_id
 
-    # Get user
-    user = get_user_by_id(user_id)
-    if not user:
-        return jsonify({"error": "User not found"}), 404
+    # --- 2. VALIDATE REQUEST DATA ---
+    data = request.json.get("businesses", [])
+    if not data:
+        return jsonify({"error": "No business data provided"}), 400
 
-    # --- 2. CREDIT CHECK ---
-    EXPORT_COST = 5  # cost per export
+    # --- 3. CHARGE CREDITS (atomic check + deduct) ---
+    reservation = reserve_credits(user_id, EXPORT_COST, "export_csv")
+    if reservation.balance is None:
+        return jsonify({"error": "User not found"}), 404
 
-    if user["credits"] < EXPORT_COST:
+    if not reservation.ok:
         return jsonify({
             "error": "Not enough credits",
-            "credits_left": user["credits"],
+            "credits_left": reservation.balance,
             "required": EXPORT_COST
         }), 402  # Payment Required
 
-    # --- 3. VALIDATE REQUEST DATA ---
-    data = request.json.get("businesses", [])
-    if not data:
-        return jsonify({"error": "No business data provided"}), 400
-
-    # --- 4. DEDUCT CREDITS ---
-    new_credits = user["credits"] - EXPORT_COST
-    update_user_credits(user_id, new_credits)
-
-    # --- 5. GENERATE CSV ---
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    writer.writerow([
-        "Name",
-        "Address",
-        "Phone",
-        "Rating",
-        "Reviews",
-        "Website",
-        "Google Maps URL",
-        "Emails"
-    ])
-
-    for b in data:
-        emails_str = ", ".join(b.get("emails", []))
-
-        writer.writerow([
-            b.get("name", ""),
-            b.get("address", ""),
-            b.get("phone", ""),
-            b.get("rating", ""),
-            b.get("reviews_count", ""),
-            b.get("website", ""),
-            b.get("maps_url", ""),
-            emails_str
-        ])
-
-    output.seek(0)
-    mem = io.BytesIO(output.getvalue().encode("utf-8"))
-    mem.seek(0)
-
-    # --- 6. RETURN FILE + UPDATED CREDIT INFO ---
-    response = send_file(
-        mem,
+    # --- 4. STREAM CSV + UPDATED CREDIT INFO ---
+    # Credits are already deducted above, so the header is final before the first byte
+    response = Response(
+        reservation.guard(stream_csv(data)),
         mimetype="text/csv",
-        download_name="businesses.csv",
-        as_attachment=True
+        headers={"Content-Disposition": "attachment; filename=businesses.csv"}
     )
 
     # Add headers with updated credits for frontend
-    response.headers["X-Credits-Left"] = str(new_credits)
+    response.headers["X-Credits-Left"] = str(reservation.balance)
+
+    return response
+
+
+# Export the user's saved businesses straight from the DB (no list upload needed)
+@app.get("/api/export-saved")
+@require_auth
+def export_saved():
+    # --- 1. AUTHENTICATION (require_auth) ---
+    user_id = g.user_id
+
+    # --- 2. VALIDATE FORMAT + FILTERS ---
+    export_format = request.args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        # "to" is inclusive of the whole day
+        saved_from = request.args.get("from")
+        saved_from = datetime.date.fromisoformat(saved_from) if saved_from else None
+        saved_to = request.args.get("to")
+        saved_to = datetime.date.fromisoformat(saved_to) + datetime.timedelta(days=1) if saved_to else None
+    except ValueError:
+        return jsonify({"error": "from/to must be dates (YYYY-MM-DD)"}), 400
+
+    # --- 3. CHARGE CREDITS (atomic check + deduct) ---
+    reservation = reserve_credits(user_id, EXPORT_COST, "export_saved")
+    if reservation.balance is None:
+        return jsonify({"error": "User not found"}), 404
+
+    if not reservation.ok:
+        return jsonify({
+            "error": "Not enough credits",
+            "credits_left": reservation.balance,
+            "required": EXPORT_COST
+        }), 402  # Payment Required
+
+    # --- 4. STREAM ROWS ---
+    rows = iter_saved_businesses(user_id, request.args.get("status"), saved_from, saved_to)
+    writers = {"csv": stream_csv, "ndjson": stream_ndjson, "xlsx": stream_xlsx}
+    mimetype, extension = EXPORT_FORMATS[export_format]
+
+    response = Response(
+        reservation.guard(writers[export_format](rows)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=saved_businesses.{extension}"}
+    )
+    response.headers["X-Credits-Left"] = str(reservation.balance)
 
     return response
 
@@ -194,78 +358,56 @@ def autocomplete():
     if not query:
         return jsonify([])
 
-    url = "https://maps.googleapis.com/maps/api/place/autocomplete/json"
-    params = {
-        "input": query,
-        "types": "(cities)",
-        "key": GOOGLE_API_KEY
-    }
-
-    resp = requests.get(url, params=params)
-    data = resp.json()
-
-    predictions = data.get("predictions", [])
-    suggestions = [p["description"] for p in predictions]
+    try:
+        suggestions = autocomplete_cities(query)
+    except QuotaExceeded as e:
+        return jsonify({"error": str(e)}), 503
 
     return jsonify(suggestions)
 
 
 @app.get("/api/profile")
+@require_auth
 def profile():
-    token = request.headers.get("Authorization")
-    if not token:
-        return {"error": "Missing token"}, 401
-
-    try:
-        payload = jwt.decode(token.replace("Bearer ", ""), APP_SECRET, algorithms=["HS256"])
-        user_id = payload["id"]
-    except:
-        return {"error": "Invalid or expired token"}, 401
-
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, email, created_at FROM users WHERE id=%s", (user_id,))
-    user = cur.fetchone()
-    return user
+    user = current_user()
+    if not user:
+        return None
+    return {"id": user["id"], "email": user["email"], "created_at": user["created_at"]}
 
 
 @app.post("/api/save-business")
+@require_auth
 def save_business():
-    token = request.headers.get("Authorization")
-    if not token:
-        return {"error": "Unauthorized"}, 401
-
-    try:
-        payload = jwt.decode(token.replace("Bearer ", ""), APP_SECRET, algorithms=["HS256"])
-        user_id = payload["id"]
-    except:
-        return {"error": "Invalid token"}, 401
+    user_id = g.user_id
 
     data = request.json
 
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
+    # Fill in emails we already scraped for this site
+    emails = data.get("emails") or []
+    if not emails and data.get("website"):
+        emails = get_cached_scrapes([data["website"]]).get(data["website"], [])
+
     try:
-        cur.execute("""
-                INSERT INTO saved_businesses
-                (user_id, name, address, phone, website, rating, reviews_count, maps_url, emails)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (user_id, name, address) DO NOTHING
-                RETURNING id
-            """, (
-                user_id,
-                data["name"],
-                data.get("address"),
-                data.get("phone"),
-                data.get("website"),
-                data.get("rating"),
-                data.get("reviews_count"),
-                data.get("maps_url"),
-                ", ".join(data.get("emails", []))   # ⭐ convert list → string
-            ))
-
-        result = cur.fetchone()
-        conn.commit()
+        with db_cursor(commit=True) as cur:
+            cur.execute("""
+                    INSERT INTO saved_businesses
+                    (user_id, name, address, phone, website, rating, reviews_count, maps_url, emails)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (user_id, name, address) DO NOTHING
+                    RETURNING id
+                """, (
+                    user_id,
+                    data["name"],
+                    data.get("address"),
+                    data.get("phone"),
+                    data.get("website"),
+                    data.get("rating"),
+                    data.get("reviews_count"),
+                    data.get("maps_url"),
+                    emails   # ⭐ stored as TEXT[]
+                ))
+
+            result = cur.fetchone()
 
         if result:
             return {"message": "Saved successfully"}
@@ -277,31 +419,96 @@ def save_business():
         return {"error": "Failed to save business"}, 500
 
 
-@app.get("/api/saved-businesses")
-def get_saved_businesses():
-    token = request.headers.get("Authorization")
-    if not token:
-        return {"error": "Unauthorized"}, 401
+SAVED_BUSINESS_FIELDS = [
+    "id", "user_id", "name", "address", "phone", "website", "emails", "rating",
+    "reviews_count", "maps_url", "status", "notes", "saved_at"
+]
+
 
+def encode_page_cursor(saved_at, business_id):
+    raw = json.dumps([saved_at.isoformat(), business_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_page_cursor(cursor):
     try:
-        payload = jwt.decode(token.replace("Bearer ", ""), APP_SECRET, algorithms=["HS256"])
-        user_id = payload["id"]
-    except:
-        return {"error": "Invalid token"}, 401
-
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM saved_businesses WHERE user_id=%s ORDER BY saved_at DESC", (user_id,))
-    rows = cur.fetchall()
-    # ⭐ Convert stored TEXT to list
-    for row in rows:
-        email_str = row.get("emails")
-        if email_str:
-            row["emails"] = [e.strip() for e in email_str.split(",")]
-        else:
-            row["emails"] = []
+        saved_at, business_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.datetime.fromisoformat(saved_at), int(business_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
 
-    return rows
+
+@app.get("/api/saved-businesses")
+@require_auth
+def get_saved_businesses():
+    user_id = g.user_id
+
+    # Optional column projection (id and saved_at are always returned for the cursor)
+    fields = request.args.get("fields")
+    if fields:
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in SAVED_BUSINESS_FIELDS]
+        if unknown:
+            return {"error": f"Unknown fields: {', '.join(unknown)}"}, 400
+        columns = ["id", "saved_at"] + [f for f in fields if f not in ("id", "saved_at")]
+    else:
+        columns = SAVED_BUSINESS_FIELDS
+
+    conditions = ["user_id = %s"]
+    params = [user_id]
+
+    status = request.args.get("status")
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+
+    search = request.args.get("q")
+    if search:
+        # Same expression as the trigram index in sql.txt
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append("(name || ' ' || coalesce(address, '') || ' ' || coalesce(notes, '')) ILIKE %s")
+        params.append(f"%{escaped}%")
+
+    # Keyset pagination on (saved_at, id); without limit/cursor the full list is returned as before
+    paged = "limit" in request.args or "cursor" in request.args
+    limit = None
+    if paged:
+        try:
+            limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        except ValueError:
+            return {"error": "limit must be a number"}, 400
+
+        cursor = request.args.get("cursor")
+        if cursor:
+            try:
+                saved_at, last_id = decode_page_cursor(cursor)
+            except ValueError:
+                return {"error": "Invalid cursor"}, 400
+            conditions.append("(saved_at, id) < (%s, %s)")
+            params.extend([saved_at, last_id])
+
+    query = f"""
+        SELECT {", ".join(columns)} FROM saved_businesses
+        WHERE {" AND ".join(conditions)}
+        ORDER BY saved_at DESC, id DESC
+    """
+    if paged:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+
+    if not paged:
+        return rows
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(rows[-1]["saved_at"], rows[-1]["id"])
+
+    return {"businesses": rows, "next_cursor": next_cursor}
 
 
 @app.get("/api/scrape-email")
@@ -318,34 +525,94 @@ def scrape_email_api():
         return {"emails": []}
 
 
-@app.post("/api/update-status")
-def update_status():
-    token = request.headers.get("Authorization")
-    if not token:
-        return {"error": "Unauthorized"}, 401
+# Enrich many websites in the background; poll or stream the job for results
+@app.post("/api/scrape-jobs")
+def create_scrape_job():
+    data = request.json or {}
+    websites = data.get("websites", [])
+
+    user_id = optional_user_id()
 
     try:
-        payload = jwt.decode(token.replace("Bearer ", ""), APP_SECRET, algorithms=["HS256"])
-        user_id = payload["id"]
-    except:
-        return {"error": "Invalid token"}, 401
+        job_id = submit_scrape_job(websites, user_id)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    return {"job_id": job_id, "status": "queued"}, 202
+
+
+JOB_STREAM_TIMEOUT = int(os.getenv("SCRAPE_JOB_STREAM_TIMEOUT", 600))  # seconds; clients reconnect after
+
+
+def _visible_scrape_job(job_id):
+    # Jobs created while signed in are only visible to that user
+    job = get_scrape_job(job_id)
+    if not job:
+        return None
+    owner = job.pop("user_id")
+    if owner is not None and owner != optional_user_id():
+        return None
+    return job
+
+
+@app.get("/api/scrape-jobs/<job_id>")
+def scrape_job_status(job_id):
+    job = _visible_scrape_job(job_id)
+    if not job:
+        return {"error": "Job not found"}, 404
+    return job
+
+
+@app.get("/api/scrape-jobs/<job_id>/stream")
+def scrape_job_stream(job_id):
+    if not _visible_scrape_job(job_id):
+        return {"error": "Job not found"}, 404
+
+    def events():
+        sent = set()
+        stop_at = time.monotonic() + JOB_STREAM_TIMEOUT
+        while True:
+            job = get_scrape_job(job_id)
+            if not job:
+                yield "event: error\ndata: " + json.dumps({"error": "Job not found"}) + "\n\n"
+                break
+
+            # Only push sites we haven't sent yet
+            new_results = {k: v for k, v in (job["results"] or {}).items() if k not in sent}
+            sent.update(new_results)
+            yield "data: " + json.dumps({
+                "status": job["status"],
+                "total": job["total"],
+                "completed": job["completed"],
+                "results": new_results,
+            }) + "\n\n"
+
+            if job["status"] in ("done", "failed"):
+                break
+            if time.monotonic() >= stop_at:
+                yield "event: timeout\ndata: {}\n\n"
+                break
+            time.sleep(1)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/update-status")
+@require_auth
+def update_status():
+    user_id = g.user_id
 
     data = request.json
     business_id = data.get("id")
     status = data.get("status")
 
-    print(business_id)
-    print(status)
-    print(user_id)
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
     try:
-        cur.execute("""
-            UPDATE saved_businesses
-            SET status = %s
-            WHERE id = %s AND user_id = %s
-        """, (status, business_id, user_id))
-        conn.commit()
+        with db_cursor(commit=True) as cur:
+            cur.execute("""
+                UPDATE saved_businesses
+                SET status = %s
+                WHERE id = %s AND user_id = %s
+            """, (status, business_id, user_id))
     except Exception as e:
         print(e)
 
@@ -353,33 +620,152 @@ def update_status():
 
 
 @app.post("/api/update-notes")
+@require_auth
 def update_notes():
-    token = request.headers.get("Authorization")
-    if not token:
-        return {"error": "Unauthorized"}, 401
-
-    try:
-        payload = jwt.decode(token.replace("Bearer ", ""), APP_SECRET, algorithms=["HS256"])
-        user_id = payload["id"]
-    except:
-        return {"error": "Invalid token"}, 401
+    user_id = g.user_id
 
     data = request.json
     business_id = data.get("id")
     notes = data.get("notes")
 
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        UPDATE saved_businesses
-        SET notes = %s
-        WHERE id = %s AND user_id = %s
-    """, (notes, business_id, user_id))
-    conn.commit()
+    with db_cursor(commit=True) as cur:
+        cur.execute("""
+            UPDATE saved_businesses
+            SET notes = %s
+            WHERE id = %s AND user_id = %s
+        """, (notes, business_id, user_id))
 
     return {"success": True}
 
 
+BULK_MAX_ITEMS = 500
+
+
+def _bulk_items(data, key):
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items:
+        return None, ({"error": f"{key} must be a non-empty list"}, 400)
+    if len(items) > BULK_MAX_ITEMS:
+        return None, ({"error": f"At most {BULK_MAX_ITEMS} items per request"}, 400)
+    return items, None
+
+
+# Save a whole result page in one statement
+@app.post("/api/save-businesses")
+@require_auth
+def save_businesses_bulk():
+    user_id = g.user_id
+
+    items, error = _bulk_items(request.json, "businesses")
+    if error:
+        return error
+
+    # Fill in emails we already scraped, one lookup for the whole batch
+    missing = [b.get("website") for b in items if not b.get("emails") and b.get("website")]
+    cached_emails = get_cached_scrapes(missing) if missing else {}
+
+    rows = []
+    results = [None] * len(items)
+    for i, b in enumerate(items):
+        if not b.get("name"):
+            results[i] = {"index": i, "result": "invalid", "error": "name is required"}
+            continue
+        rows.append((
+            i,
+            user_id,
+            b["name"],
+            b.get("address"),
+            b.get("phone"),
+            b.get("website"),
+            b.get("rating"),
+            b.get("reviews_count"),
+            b.get("maps_url"),
+            b.get("emails") or cached_emails.get(b.get("website"), [])
+        ))
+
+    # Ids are drawn up front so each inserted row maps back to its input
+    # position; (name, address) can't tell two rows with a NULL address apart
+    saved = {}
+    if rows:
+        try:
+            with db_cursor(commit=True) as cur:
+                returned = execute_values(cur, """
+                    WITH input AS (
+                        SELECT nextval(pg_get_serial_sequence('saved_businesses', 'id')) AS id, v.*
+                        FROM (VALUES %s) AS v (ord, user_id, name, address, phone, website,
+                                               rating, reviews_count, maps_url, emails)
+                    ), inserted AS (
+                        INSERT INTO saved_businesses
+                        (id, user_id, name, address, phone, website, rating, reviews_count, maps_url, emails)
+                        SELECT id, user_id, name, address, phone, website, rating, reviews_count, maps_url, emails
+                        FROM input ORDER BY ord
+                        ON CONFLICT (user_id, name, address) DO NOTHING
+                        RETURNING id
+                    )
+                    SELECT input.ord, input.id FROM input JOIN inserted USING (id)
+                """, rows,
+                    template="(%s::integer, %s::integer, %s::text, %s::text, %s::text, %s::text, "
+                             "%s::real, %s::integer, %s::text, %s::text[])",
+                    page_size=len(rows), fetch=True)
+        except Exception as e:
+            print(e)
+            return {"error": "Failed to save businesses"}, 500
+
+        saved = {r["ord"]: r["id"] for r in returned}
+
+    for i in range(len(items)):
+        if results[i]:
+            continue
+        if i in saved:
+            results[i] = {"index": i, "result": "saved", "id": saved[i]}
+        else:
+            results[i] = {"index": i, "result": "already_saved"}
+
+    return {"results": results}
+
+
+def _bulk_update_column(column):
+    user_id = g.user_id
+
+    items, error = _bulk_items(request.json, "updates")
+    if error:
+        return error
+
+    try:
+        values = [(int(u["id"]), u.get(column), user_id) for u in items]
+    except (KeyError, TypeError, ValueError):
+        return {"error": "Each update needs a numeric id"}, 400
+
+    # column comes from our own callers, never from the request
+    with db_cursor(commit=True) as cur:
+        returned = execute_values(cur, f"""
+            UPDATE saved_businesses AS s
+            SET {column} = v.value
+            FROM (VALUES %s) AS v(id, value, user_id)
+            WHERE s.id = v.id AND s.user_id = v.user_id
+            RETURNING s.id
+        """, values, template="(%s::integer, %s::text, %s::integer)",
+            page_size=len(values), fetch=True)
+
+    updated = {r["id"] for r in returned}
+    return {"results": [
+        {"id": business_id, "result": "updated" if business_id in updated else "not_found"}
+        for business_id, _, _ in values
+    ]}
+
+
+@app.post("/api/update-statuses")
+@require_auth
+def update_statuses_bulk():
+    return _bulk_update_column("status")
+
+
+@app.post("/api/update-notes-bulk")
+@require_auth
+def update_notes_bulk():
+    return _bulk_update_column("notes")
+
+
 
 # REGISTER (email/password)
 @app.route("/api/register", methods=["POST"])
@@ -392,27 +778,29 @@ def register():
     if not name or not email or not password:
         return jsonify({"error": "name, email and password required"}), 400
 
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
     # Check if user exists
-    cur.execute("SELECT id, provider, credits FROM users WHERE email = %s", (email,))
-    existing = cur.fetchone()
+    with db_cursor() as cur:
+        cur.execute("SELECT id, provider, credits FROM users WHERE email = %s", (email,))
+        existing = cur.fetchone()
     if existing:
         # If user exists and provider is google, do not create password user
         if existing.get("provider") == "google":
             return jsonify({"error": "Account exists with Google Sign-in. Use Google login."}), 400
         return jsonify({"error": "User already exists"}), 400
 
-    # Hash password
-    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-
-    # Save user
-    cur.execute(
-        "INSERT INTO users (name, email, password, provider, created_at) VALUES (%s,%s,%s,%s,NOW()) RETURNING id",
-        (name, email, hashed, "password")
-    )
-    user_id = cur.fetchone()
-    conn.commit()
+    # Hash password (slow; don't hold a pooled connection while it runs)
+    hashed = hash_password(password)
+
+    # Save user; someone may have registered the same email meanwhile
+    with db_cursor(commit=True) as cur:
+        cur.execute(
+            "INSERT INTO users (name, email, password, provider, created_at) VALUES (%s,%s,%s,%s,NOW()) "
+            "ON CONFLICT (email) DO NOTHING RETURNING id, credits",
+            (name, email, hashed, "password")
+        )
+        user_id = cur.fetchone()
+    if not user_id:
+        return jsonify({"error": "User already exists"}), 400
 
     token = generate_jwt({"id": user_id["id"], "email": email})
     # DB_CONN.close()
@@ -428,10 +816,9 @@ def login():
     if not email or not password:
         return jsonify({"error": "email and password required"}), 400
 
-    conn = get_db_connection()
-    cur=conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, password, provider, credits FROM users WHERE email = %s", (email,))
-    user = cur.fetchone()
+    with db_cursor() as cur:
+        cur.execute("SELECT id, password, provider, credits FROM users WHERE email = %s", (email,))
+        user = cur.fetchone()
 
     if not user:
         return jsonify({"error": "Invalid credentials"}), 401
@@ -445,13 +832,12 @@ def login():
     if not hashed:
         return jsonify({"error": "No password set for this account"}), 400
 
-    # if not bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8")):
-    #     return jsonify({"error": "Invalid credentials"}), 401
+    if not verify_password(password, hashed):
+        return jsonify({"error": "Invalid credentials"}), 401
 
     token = generate_jwt({"id": user["id"], "email": email})
 
     # DB_CONN.close()
-    print("token at login", token)
     return jsonify({"token": token, "credits": user["credits"]})
 
 # GOOGLE SIGN-IN (credential from frontend)
@@ -463,36 +849,33 @@ def google_auth():
         return jsonify({"error": "Missing credential"}), 400
 
     try:
-        idinfo = id_token.verify_oauth2_token(credential, grequests.Request(), GOOGLE_CLIENT_ID)
+        idinfo = verify_google_id_token(credential, GOOGLE_CLIENT_ID)
         # idinfo contains 'email', 'email_verified', 'name', 'sub' (Google user id), etc.
         email = idinfo.get("email")
         name = idinfo.get("name") or ""
         if not email:
             return jsonify({"error": "Google did not provide email"}), 400
-        conn= get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-
-        cur.execute("SELECT id, provider, credits FROM users WHERE email = %s", (email,))
-        user = cur.fetchone()
-
-        if user:
-            # existing user
-            user_id = user["id"]
-            provider = user.get("provider") or "password"
-            # If existing provider is 'password' we may optionally allow linking; for now we'll allow login
-            # Optionally, if you want to auto-set provider to both, or mark linked, implement here.
-            # We'll keep provider as-is (password) if password exists.
-        else:
-            # create new user with provider=google
-            cur.execute(
-                "INSERT INTO users (name, email, provider, created_at) VALUES (%s,%s,%s,NOW()) RETURNING id",
-                (name, email, "google")
-            )
-            user_id = cur.fetchone()["id"]
-            conn.commit()
+        with db_cursor(commit=True) as cur:
+            cur.execute("SELECT id, provider, credits FROM users WHERE email = %s", (email,))
+            user = cur.fetchone()
+
+            if user:
+                # existing user
+                user_id = user["id"]
+                provider = user.get("provider") or "password"
+                # If existing provider is 'password' we may optionally allow linking; for now we'll allow login
+                # Optionally, if you want to auto-set provider to both, or mark linked, implement here.
+                # We'll keep provider as-is (password) if password exists.
+            else:
+                # create new user with provider=google
+                cur.execute(
+                    "INSERT INTO users (name, email, provider, created_at) VALUES (%s,%s,%s,NOW()) RETURNING id, credits",
+                    (name, email, "google")
+                )
+                user = cur.fetchone()
+                user_id = user["id"]
 
         token = generate_jwt({"id": user_id, "email": email})
-        print("google auth token", token)
         # DB_CONN.close()
         return jsonify({"token": token, "credits": user["credits"]})
 
@@ -505,54 +888,58 @@ def google_auth():
 
 
 @app.route("/api/credits", methods=["GET"])
+@require_auth
 def get_credits():
-  auth = request.headers.get("Authorization", "")
-  if not auth.startswith("Bearer "):
-      return jsonify({"error": "Unauthorized"}), 401
-
-  token = auth.replace("Bearer ", "")
-  try:
-      payload = decode_jwt(token)
-  except Exception:
-      return jsonify({"error": "Invalid token"}), 401
-
-  user_id = payload.get("id")
-  if not user_id:
-      return jsonify({"error": "Invalid token payload"}), 401
-
-  conn = get_db_connection()
-  cur = conn.cursor(cursor_factory=RealDictCursor)
-  cur.execute("SELECT credits FROM users WHERE id = %s", (user_id,))
-  row = cur.fetchone()
-  cur.close()
-  conn.close()
-
-  if not row:
+  user = current_user()
+
+  if not user:
       return jsonify({"error": "User not found"}), 404
 
-  return jsonify({"credits": row["credits"]})
+  return jsonify({"credits": user["credits"]})
 
 # Example protected route
 @app.route("/api/me")
+@require_auth
 def me():
-    auth = request.headers.get("Authorization", "")
-    if not auth.startswith("Bearer "):
-        return jsonify({"error": "Unauthorized"}),
-    token = auth.replace("Bearer ", "")
-    try:
-        payload = decode_jwt(token)
-        user_id = payload.get("id")
-        conn = get_db_connection()
-        cur=conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT id, name, email FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
-        conn.close()
-        # DB_CONN.close()
-        return jsonify(user)
-    except Exception as e:
-        print("JWT error", e)
-        return jsonify({"error": "Invalid token"}), 401
-
+    user = current_user()
+    if not user:
+        return jsonify(None)
+    return jsonify({"id": user["id"], "name": user["name"], "email": user["email"]})
+
+
+
+# Prometheus scrape target. Counters are per process: with several gunicorn
+# workers, scrape each one or aggregate them upstream.
+@app.get("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(render_metrics(metrics_gauges()), mimetype="text/plain; version=0.0.4")
+
+
+def metrics_gauges():
+    pool = get_pool_stats()
+    caches = all_cache_stats()
+    quota = get_quota_stats()
+    flights = quota.pop("single_flight")
+    gauges = [
+        ("db_pool_connections_in_use", "Checked out database connections", [({}, pool["in_use"])]),
+        ("db_pool_connections_max", "Database pool size", [({}, pool["max_size"])]),
+        ("db_pool_checkouts", "Connection checkouts since start", [({}, pool["checkouts"])]),
+        ("db_pool_waits", "Checkouts that had to wait for a free connection", [({}, pool["waits"])]),
+        ("db_pool_timeouts", "Checkouts that gave up waiting", [({}, pool["timeouts"])]),
+        ("cache_hits", "Cache hits since start", [({"cache": n}, c["hits"]) for n, c in caches.items()]),
+        ("cache_misses", "Cache misses since start", [({"cache": n}, c["misses"]) for n, c in caches.items()]),
+        ("cache_evictions", "Entries evicted to stay under the byte cap",
+         [({"cache": n}, c["evictions"]) for n, c in caches.items()]),
+        ("cache_bytes", "Approximate cached bytes", [({"cache": n}, c["bytes"]) for n, c in caches.items()]),
+        ("google_quota_waits", "Calls that queued for quota", [({"endpoint": n}, q["waits"]) for n, q in quota.items()]),
+        ("google_quota_timeouts", "Calls rejected after queueing too long",
+         [({"endpoint": n}, q["timeouts"]) for n, q in quota.items()]),
+        ("google_coalesced_calls", "Calls answered by an identical call in flight", [({}, flights["coalesced"])]),
+        ("credit_reservations_pending", "Credit reservations not yet settled", [({}, pending_reservations())]),
+    ]
+    return gauges
 
 
 if __name__ == "__main__":
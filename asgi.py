@@ -0,0 +1,203 @@
+# Async serving mode.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+#   gunicorn asgi:app -k uvicorn_worker.UvicornWorker -w 4
+#
+# The outbound-heavy endpoints (/api/businesses, /api/autocomplete,
+# /api/geocode, /api/scrape-email) run on the event loop with httpx and
+# asyncpg, so one process holds hundreds of searches in flight instead of
+# one per thread. Every other route is the Flask app, unchanged, run on a
+# thread pool (ASGI_WSGI_THREADS). Query parameters, status codes and
+# response bodies are the same as under gunicorn's sync workers.
+#
+# Metrics work as in app.py; the sampling profiler doesn't, since every
+# async request shares the event loop thread.
+import os
+import json
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route, Mount
+from dotenv import load_dotenv
+from app import app as flask_app, parse_business_query, metrics_gauges
+from aio_helpers import aio_startup, aio_shutdown, get_aio_stats
+from aio_google_helpers import geocode_city_async, autocomplete_cities_async
+from aio_google_helpers import iter_business_pages_async, iter_business_events_async, get_aio_flight_stats
+from aio_place_helpers import fetch_businesses_indexed_async
+from aio_scrape_helpers import extract_emails_from_website_async
+from google_helpers import InvalidPageToken
+from quota_helpers import QuotaExceeded
+from metrics_helpers import start_request_timings, finish_request, server_timing_header
+from metrics_helpers import render_metrics, METRICS_TOKEN
+
+load_dotenv()
+
+# Threads for the Flask routes (auth, saved businesses, exports, jobs, ...)
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 16))
+
+
+class RequestTimingMiddleware:
+    # instrument_app for the async routes: phase timings, Server-Timing,
+    # request metrics and the JSON log line once the body is sent
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = start_request_timings()
+        status = 500
+        finished = False
+
+        async def timed_send(message):
+            nonlocal status, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                # Streamed bodies are still to come; for those the header only covers setup
+                headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = True
+                finish_request(timings, scope["method"], scope["path"], status)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not finished:
+                finish_request(timings, scope["method"], scope["path"], status)
+
+
+def json_response(content, status_code=200):
+    # Serialized like Flask's jsonify (sorted keys, compact), so bodies match byte for byte
+    body = flask_app.json.dumps(content, separators=(",", ":")) + "\n"
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+async def api_geocode(request):
+    city = request.query_params.get("city")
+    if not city:
+        return json_response({"error": "City is required"}, 400)
+
+    try:
+        coords = await geocode_city_async(city)
+    except QuotaExceeded as e:
+        return json_response({"error": str(e)}, 503)
+    if not coords:
+        return json_response({"error": "Unable to geocode city"}, 404)
+
+    return json_response({"lat": coords[0], "lng": coords[1]})
+
+
+async def api_businesses(request):
+    query, error = parse_business_query(request.query_params)
+    if error:
+        return json_response({"error": error}, 400)
+
+    if request.query_params.get("stream") == "sse":
+        async def business_events():
+            try:
+                async for event in iter_business_events_async(*query):
+                    yield f"event: {event.pop('event')}\ndata: {json.dumps(event)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+        return StreamingResponse(business_events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    if request.query_params.get("stream") in ("1", "true"):
+        async def page_lines():
+            try:
+                async for page in iter_business_pages_async(*query):
+                    yield json.dumps(page) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return StreamingResponse(page_lines(), media_type="application/x-ndjson")
+
+    try:
+        businesses = await fetch_businesses_indexed_async(*query)
+    except InvalidPageToken as e:
+        return json_response({"error": str(e)}, 400)
+    except QuotaExceeded as e:
+        return json_response({"error": str(e)}, 503)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+    return json_response(businesses)
+
+
+async def autocomplete(request):
+    query = request.query_params.get("query")
+    if not query:
+        return json_response([])
+
+    try:
+        suggestions = await autocomplete_cities_async(query)
+    except QuotaExceeded as e:
+        return json_response({"error": str(e)}, 503)
+
+    return json_response(suggestions)
+
+
+async def scrape_email_api(request):
+    url = request.query_params.get("url")
+    if not url:
+        return json_response({"emails": []})
+
+    try:
+        return json_response({"emails": await extract_emails_from_website_async(url)})
+    except Exception as e:
+        print("Scrape error:", e)
+        return json_response({"emails": []})
+
+
+async def metrics(request):
+    # app.py's /metrics plus the event loop's own pools
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return json_response({"error": "Unauthorized"}, 401)
+
+    aio = get_aio_stats()
+    gauges = metrics_gauges() + [
+        ("aio_db_pool_connections", "Open asyncpg connections", [({}, aio["db_pool_size"])]),
+        ("aio_db_pool_idle", "Idle asyncpg connections", [({}, aio["db_pool_idle"])]),
+        ("aio_db_pool_max", "asyncpg pool size limit", [({}, aio["db_pool_max"])]),
+        ("aio_google_coalesced_calls", "Async calls answered by an identical call in flight",
+         [({}, get_aio_flight_stats()["coalesced"])]),
+    ]
+    return Response(render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(_):
+    await aio_startup()
+    try:
+        yield
+    finally:
+        await aio_shutdown()
+
+
+# Flask-CORS answers preflights (they fall through to the Flask mount);
+# this covers the actual responses of the async routes
+_route_middleware = [
+    Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    Middleware(RequestTimingMiddleware),
+]
+
+app = Starlette(
+    routes=[
+        Route("/api/geocode", api_geocode, methods=["GET"], middleware=_route_middleware),
+        Route("/api/businesses", api_businesses, methods=["GET"], middleware=_route_middleware),
+        Route("/api/autocomplete", autocomplete, methods=["GET"], middleware=_route_middleware),
+        Route("/api/scrape-email", scrape_email_api, methods=["GET"], middleware=_route_middleware),
+        Route("/metrics", metrics, methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
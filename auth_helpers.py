@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from functools import wraps
+import jwt
+import google.auth.jwt
+from cachetools import TTLCache
+from flask import request, jsonify, g
+from dotenv import load_dotenv
+from db_extentions import db_cursor
+from http_helpers import http_get
+
+load_dotenv()
+
+APP_SECRET = os.getenv("APP_SECRET", "change-this-secret")
+JWT_ALGO = "HS256"
+
+# Verified tokens are trusted for this long (never past their own exp)
+TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+# User rows are cached briefly; credit changes in this process invalidate them
+USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", 30))
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 10000))
+
+_cache_lock = threading.Lock()
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def verify_token(token):
+    # Returns the JWT payload, or None if the token is invalid or expired
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+
+    with _cache_lock:
+        payload = _token_cache.get(key)
+    if payload is not None:
+        if payload.get("exp", float("inf")) > time.time():
+            return payload
+        with _cache_lock:
+            _token_cache.pop(key, None)
+        return None
+
+    try:
+        payload = jwt.decode(token, APP_SECRET, algorithms=[JWT_ALGO])
+    except jwt.PyJWTError:
+        return None
+
+    with _cache_lock:
+        _token_cache[key] = payload
+    return payload
+
+
+def get_user(user_id):
+    with _cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    with db_cursor() as cur:
+        cur.execute(
+            "SELECT id, name, email, provider, credits, created_at FROM users WHERE id = %s",
+            (user_id,)
+        )
+        user = cur.fetchone()
+
+    if user:
+        with _cache_lock:
+            _user_cache[user_id] = user
+    return user
+
+
+def invalidate_user(user_id):
+    with _cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+def _user_id_from_request():
+    auth = request.headers.get("Authorization", "")
+    if not auth:
+        return None, "Unauthorized"
+
+    payload = verify_token(auth.replace("Bearer ", ""))
+    if not payload or not payload.get("id"):
+        return None, "Invalid or expired token"
+    return payload["id"], None
+
+
+def require_auth(f):
+    # Verifies the bearer token once and exposes the caller as g.user_id
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        user_id, error = _user_id_from_request()
+        if error:
+            return jsonify({"error": error}), 401
+        g.user_id = user_id
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def optional_user_id():
+    user_id, _ = _user_id_from_request()
+    return user_id
+
+
+def current_user():
+    # Cached users row for the authenticated caller (None if it was deleted)
+    if "user" not in g:
+        g.user = get_user(g.user_id)
+    return g.user
+
+
+# Google's ID-token signing certs. Fetched once, then refreshed in the
+# background before they expire, so sign-ins never wait on the download.
+# Point GOOGLE_CERTS_URL at a local server or file:// path for offline tests.
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_CERTS_MIN_REFRESH = 60   # seconds between forced refreshes on unknown key ids
+
+_certs_lock = threading.Lock()
+_google_certs = {"certs": None, "expires_at": 0, "fetched_at": 0}
+_refresher_started = False
+
+
+def _max_age(cache_control):
+    for part in (cache_control or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    return 3600
+
+
+def _download_google_certs():
+    if GOOGLE_CERTS_URL.startswith("file://"):
+        with open(GOOGLE_CERTS_URL[len("file://"):]) as f:
+            return json.load(f), 3600
+
+    resp = http_get(GOOGLE_CERTS_URL)
+    resp.raise_for_status()
+    return resp.json(), _max_age(resp.headers.get("Cache-Control"))
+
+
+def refresh_google_certs():
+    certs, max_age = _download_google_certs()
+    with _certs_lock:
+        _google_certs["certs"] = certs
+        _google_certs["expires_at"] = time.time() + max_age
+        _google_certs["fetched_at"] = time.time()
+    return certs
+
+
+def _refresh_loop():
+    while True:
+        try:
+            refresh_google_certs()
+        except Exception as e:
+            print("Google certs refresh error:", e)
+
+        with _certs_lock:
+            # Refresh a bit before expiry
+            wait = max(_google_certs["expires_at"] - time.time() - 300, 30)
+        time.sleep(wait)
+
+
+def start_google_certs_refresher():
+    global _refresher_started
+    with _certs_lock:
+        if _refresher_started:
+            return
+        _refresher_started = True
+
+    threading.Thread(target=_refresh_loop, name="google-certs", daemon=True).start()
+
+
+def get_google_certs():
+    with _certs_lock:
+        certs = _google_certs["certs"]
+    if certs is None:
+        certs = refresh_google_certs()
+    return certs
+
+
+def verify_google_id_token(credential, audience):
+    # Same checks as google.oauth2.id_token.verify_oauth2_token, against cached certs
+    certs = get_google_certs()
+    try:
+        idinfo = google.auth.jwt.decode(credential, certs=certs, audience=audience, clock_skew_in_seconds=10)
+    except ValueError as e:
+        # Google rotated keys since our last refresh; re-fetch (rate limited) and retry once
+        with _certs_lock:
+            recently_fetched = time.time() - _google_certs["fetched_at"] < GOOGLE_CERTS_MIN_REFRESH
+        if "Certificate for key id" not in str(e) or recently_fetched:
+            raise
+        idinfo = google.auth.jwt.decode(
+            credential, certs=refresh_google_certs(), audience=audience, clock_skew_in_seconds=10
+        )
+
+    if idinfo.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {idinfo.get('iss')}")
+    return idinfo
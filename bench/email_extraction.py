@@ -0,0 +1,116 @@
+# Micro-benchmark: email extraction engine vs. the original per-page code.
+#
+#   python -m bench.email_extraction [corpus_dir] [--rounds N]
+#
+# corpus_dir holds saved *.html pages. Without one, a synthetic corpus of
+# typical small-business pages (plus a few very large ones) is used.
+import os
+import re
+import sys
+import glob
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common_helpers import extract_emails, clean_email_list, SCRAPE_MAX_BYTES
+
+
+def legacy_clean_email_list(emails):
+    cleaned = []
+    banned_domains = [
+        "sentry.io",
+        "wixpress.com",
+        "sentry.wixpress.com",
+        "sentry-next.wixpress.com",
+        "oyorooms.com"
+    ]
+    for email in emails:
+        local, _, domain = email.lower().partition("@")
+        if domain in banned_domains:
+            continue
+        if len(local) > 25:
+            continue
+        if local.isdigit():
+            continue
+        if re.fullmatch(r"[a-f0-9]{20,}", local):
+            continue
+        cleaned.append(email)
+    return cleaned
+
+
+def legacy_extract(body):
+    html = body.decode("utf-8", errors="replace")
+    found = re.findall(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", html)
+    return legacy_clean_email_list(list(set(found)))
+
+
+def current_extract(body):
+    html = body[:SCRAPE_MAX_BYTES].decode("utf-8", errors="replace")
+    return clean_email_list(extract_emails(html))
+
+
+def synthetic_corpus(seed=7):
+    rng = random.Random(seed)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "menu", "order", "table",
+             "contact", "hours", "parking", "gallery", "reviews", "booking"]
+    pages = []
+    for i in range(60):
+        paragraphs = " ".join(rng.choice(words) for _ in range(rng.randint(2000, 10000)))
+        script = "var s='" + "a1b2c3d4e5f6" * rng.randint(10, 300) + "';"
+        extra = rng.choice([
+            f'<a href="mailto:info@shop{i}.com">Mail us</a>',
+            f"contact [at] shop{i} [dot] com",
+            f'<img src="logo@2x.png"> sales@shop{i}.co.uk',
+            f"error@sentry.io {'f' * 24}@shop{i}.com",
+            "",
+        ])
+        html = f"<html><head><script>{script}</script></head><body><p>{paragraphs}</p>{extra}</body></html>"
+        pages.append(html.encode("utf-8"))
+    # A handful of huge pages (inline bundles, image data) dominate real crawls
+    for _ in range(5):
+        pages.append(("<p>" + "x " * 1_000_000 + "</p>").encode("utf-8"))
+    return pages
+
+
+def load_corpus(path):
+    pages = []
+    for name in sorted(glob.glob(os.path.join(path, "*.html")) + glob.glob(os.path.join(path, "*.htm"))):
+        with open(name, "rb") as f:
+            pages.append(f.read())
+    return pages
+
+
+def run(fn, pages, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages:
+            fn(page)
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(len(p) for p in pages) * rounds
+    return elapsed, len(pages) * rounds / elapsed, total_bytes / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus_dir", nargs="?")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus_dir) if args.corpus_dir else synthetic_corpus()
+    if not pages:
+        sys.exit("No .html pages found in corpus")
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / 1e6:.1f} MB, {args.rounds} rounds")
+
+    results = {}
+    for name, fn in [("legacy", legacy_extract), ("current", current_extract)]:
+        elapsed, pages_per_s, mb_per_s = run(fn, pages, args.rounds)
+        results[name] = pages_per_s
+        print(f"{name:>8}: {elapsed:7.3f}s  {pages_per_s:9.1f} pages/s  {mb_per_s:8.1f} MB/s of input")
+
+    print(f" speedup: {results['current'] / results['legacy']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
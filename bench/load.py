@@ -0,0 +1,282 @@
+# End-to-end load benchmark: drives the Flask app against bench/standin.py.
+#
+#   python -m bench.load [--scenarios businesses,scrape-email,export-csv,saved-businesses]
+#                        [--concurrency 8] [--duration 15] [--save-baseline] [--tolerance 0.2]
+#
+# By default the stand-in and the app (werkzeug, threaded) both run in this
+# process. With --app-url the requests go to an app you started yourself;
+# start it with GOOGLE_API_BASE pointing at `python -m bench.standin` and
+# pass the stand-in's --sites-port here.
+#
+# export-csv and saved-businesses need DATABASE_URL (the same database the
+# app uses): a bench user is registered, topped up with credits and given a
+# few hundred saved businesses. Without it those scenarios are skipped.
+#
+# Results are compared with the stored baseline (bench/baselines.json).
+# A p95 or throughput more than --tolerance worse counts as a regression
+# and the exit status is 1. --save-baseline records this run instead.
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+import requests
+
+from bench.standin import StandinConfig, start_standin, site_url
+
+SCENARIOS = ["businesses", "scrape-email", "export-csv", "saved-businesses"]
+AUTH_SCENARIOS = {"export-csv", "saved-businesses"}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+
+# A fixed pool of search spots, so repeat-area caching shows up as it does in production
+LOCATIONS = [(52.40 + i * 0.013, 13.20 + (i * 7 % 23) * 0.017) for i in range(40)]
+PLACE_TYPES = ["cafe", "restaurant", "dentist", "bakery"]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def export_payload(rng, count=50):
+    return {"businesses": [{
+        "name": f"Bench Business {rng.randrange(10**6)}",
+        "address": f"{i} Example Street",
+        "phone": "+1 555 0100",
+        "rating": 4.5,
+        "reviews_count": 10 + i,
+        "website": f"http://shop{i}.example/",
+        "maps_url": "https://maps.google.com/?cid=1",
+        "emails": [f"info@shop{i}.example"],
+    } for i in range(count)]}
+
+
+def build_request(scenario, rng, ctx):
+    # (method, path, requests kwargs) for one call of the scenario
+    if scenario == "businesses":
+        lat, lng = rng.choice(LOCATIONS)
+        return "GET", "/api/businesses", {"params": {
+            "lat": lat, "lng": lng, "radius": 1500, "type": rng.choice(PLACE_TYPES)
+        }}
+    if scenario == "scrape-email":
+        return "GET", "/api/scrape-email", {"params": {
+            "url": site_url(f"bench-site-{rng.randrange(2000)}", ctx["standin"])
+        }}
+    if scenario == "export-csv":
+        return "POST", "/api/export-csv", {"json": export_payload(rng), "headers": ctx["auth"]}
+    if scenario == "saved-businesses":
+        return "GET", "/api/saved-businesses", {"params": {"limit": 50}, "headers": ctx["auth"]}
+    raise ValueError(scenario)
+
+
+def run_scenario(app_url, scenario, ctx, concurrency, duration):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.monotonic() < stop_at:
+            method, path, kwargs = build_request(scenario, rng, ctx)
+            started = time.perf_counter()
+            try:
+                resp = session.request(method, app_url + path, timeout=60, **kwargs)
+                resp.content   # include the (possibly streamed) body
+                ok = resp.status_code < 400
+                error = f"HTTP {resp.status_code}"
+            except requests.RequestException as e:
+                ok = False
+                error = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors.append(error)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_kinds": sorted(set(errors)),
+        "throughput": len(latencies) / wall,
+        "p50": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95": percentile(latencies, 95) * 1000 if latencies else None,
+        "p99": percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def start_app(google_base):
+    # The app reads its config at import time
+    os.environ["GOOGLE_API_BASE"] = google_base
+    os.environ.setdefault("GOOGLE_MAPS_API_KEY", "bench")
+    os.environ.setdefault("PAGE_TOKEN_DELAY", "0.05")
+    if not os.getenv("DATABASE_URL"):
+        os.environ["PLACE_INDEX_ENABLED"] = "0"
+
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def setup_bench_user(app_url):
+    # Returns auth headers for a bench user with plenty of credits and saved businesses
+    from credit_helpers import add_credits
+
+    requests.post(app_url + "/api/register", json={
+        "name": "Bench", "email": BENCH_EMAIL, "password": BENCH_PASSWORD
+    }, timeout=30)
+    resp = requests.post(app_url + "/api/login", json={
+        "email": BENCH_EMAIL, "password": BENCH_PASSWORD
+    }, timeout=30)
+    resp.raise_for_status()
+    token = resp.json()["token"]
+    user_id = jwt.decode(token, options={"verify_signature": False})["id"]
+    add_credits(user_id, 1_000_000, "bench_topup")
+
+    auth = {"Authorization": f"Bearer {token}"}
+    rng = random.Random(1)
+    for _ in range(3):
+        payload = export_payload(rng, 100)
+        requests.post(app_url + "/api/save-businesses", json=payload, headers=auth, timeout=60)
+    return auth
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base or result["p95"] is None:
+            continue
+        if result["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {base['p95']:.0f}ms -> {result['p95']:.0f}ms")
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{scenario}: throughput {base['throughput']:.1f} -> {result['throughput']:.1f} req/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds per scenario, not measured")
+    parser.add_argument("--app-url", help="benchmark an already running app instead")
+    parser.add_argument("--sites-port", type=int, default=8766, help="stand-in sites port (with --app-url)")
+    parser.add_argument("--latency-ms", type=float, default=80, help="stand-in Google latency")
+    parser.add_argument("--site-latency-ms", type=float, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--site-error-rate", type=float, default=0.05)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own log output")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    standin = StandinConfig(latency_ms=args.latency_ms, error_rate=args.error_rate,
+                            site_latency_ms=args.site_latency_ms, site_error_rate=args.site_error_rate,
+                            sites_port=args.sites_port if args.app_url else 0)
+    if not args.verbose:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    if args.app_url:
+        app_url = args.app_url.rstrip("/")
+    else:
+        google_base, _ = start_standin(standin)
+        app_url = start_app(google_base)
+
+    ctx = {"standin": standin}
+    if AUTH_SCENARIOS & set(scenarios):
+        if os.getenv("DATABASE_URL"):
+            ctx["auth"] = setup_bench_user(app_url)
+        else:
+            print("DATABASE_URL not set, skipping:", ", ".join(sorted(AUTH_SCENARIOS & set(scenarios))))
+            scenarios = [s for s in scenarios if s not in AUTH_SCENARIOS]
+
+    print(f"{app_url}  concurrency={args.concurrency}  duration={args.duration}s  "
+          f"google latency={args.latency_ms}ms  site latency={args.site_latency_ms}ms")
+
+    results = {}
+    devnull = open(os.devnull, "w")
+    for scenario in scenarios:
+        # The app logs every scrape; keep the report readable
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with quiet:
+            run_scenario(app_url, scenario, ctx, args.concurrency, args.warmup)
+            results[scenario] = run_scenario(app_url, scenario, ctx, args.concurrency, args.duration)
+
+    print(f"{'scenario':<18}{'reqs':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for scenario, r in results.items():
+        if not r["requests"]:
+            print(f"{scenario:<18}{0:>7}")
+            continue
+        print(f"{scenario:<18}{r['requests']:>7}{r['errors']:>8}{r['throughput']:>9.1f}"
+              f"{r['p50']:>9.0f}{r['p95']:>9.0f}{r['p99']:>9.0f}"
+              + (f"   {', '.join(r['error_kinds'])}" if r["errors"] else ""))
+
+    settings = {k: getattr(args, k) for k in ("concurrency", "duration", "latency_ms", "site_latency_ms",
+                                              "error_rate", "site_error_rate")}
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline["settings"] = settings
+        baseline.setdefault("scenarios", {}).update(
+            {s: {k: r[k] for k in ("throughput", "p50", "p95", "p99")} for s, r in results.items()}
+        )
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Baseline saved to", args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --save-baseline to record one")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != settings:
+        print("Note: baseline was recorded with different settings:", baseline.get("settings"))
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
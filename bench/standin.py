@@ -0,0 +1,318 @@
+# Local stand-in for the Google Maps APIs and for business websites.
+#
+#   python -m bench.standin [--port 8765] [--sites-port 8766] [--latency-ms 80]
+#                           [--error-rate 0.01] [--recordings FILE] [--record-from URL]
+#
+# Then run the app with GOOGLE_API_BASE=http://127.0.0.1:8765.
+#
+# Geocode, Autocomplete, Nearby Search and Place Details requests are
+# answered from a recordings file when it has the request, otherwise with
+# deterministic synthetic data (the same query always gets the same
+# places). With --record-from, misses are fetched from that upstream (with
+# GOOGLE_MAPS_API_KEY) and written back to the recordings file.
+#
+# Business websites live on the sites port. Each place gets its own
+# loopback address (127.0.x.y), so per-domain caching and per-host limits
+# behave as they would against real sites; this needs Linux, where all of
+# 127.0.0.0/8 reaches the loopback interface.
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+
+GOOGLE_PATHS = {
+    "/maps/api/geocode/json": "geocode",
+    "/maps/api/place/autocomplete/json": "autocomplete",
+    "/maps/api/place/nearbysearch/json": "nearby",
+    "/maps/api/place/details/json": "details",
+}
+
+WORDS = ["Blue", "Corner", "Golden", "Royal", "Green", "Urban", "Little", "Grand",
+         "Cafe", "Bakery", "Dental", "Studio", "Garage", "Bistro", "Market", "Salon"]
+
+
+def _seed(*parts):
+    return int(hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).hexdigest()[:12], 16)
+
+
+class StandinConfig:
+    def __init__(self, latency_ms=80, jitter_ms=40, error_rate=0.0, over_quota_rate=0.0,
+                 token_delay_ms=0, site_latency_ms=150, site_error_rate=0.05, sites_port=8766,
+                 recordings=None, record_from=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.over_quota_rate = over_quota_rate
+        self.token_delay_ms = token_delay_ms
+        self.site_latency_ms = site_latency_ms
+        self.site_error_rate = site_error_rate
+        self.sites_port = sites_port
+        self.recordings_path = recordings
+        self.record_from = record_from.rstrip("/") if record_from else None
+        self.recordings = {}
+        self.lock = threading.Lock()
+        self.counts = {}
+        if recordings and os.path.exists(recordings):
+            with open(recordings) as f:
+                self.recordings = json.load(f)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def sleep(self, base_ms):
+        time.sleep(max(base_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0) / 1000)
+
+
+# ---------------------------------------------------------------- synthetic
+
+def site_url(place_id, config):
+    n = _seed("site", place_id) % 60000
+    return f"http://127.0.{n // 250 + 1}.{n % 250 + 1}:{config.sites_port}/"
+
+
+def synthetic_geocode(params):
+    s = _seed("geocode", params.get("address", "").lower())
+    return {"status": "OK", "results": [{"geometry": {"location": {
+        "lat": round(-50 + (s % 10000) / 100, 6),
+        "lng": round(-150 + (s // 10000 % 30000) / 100, 6),
+    }}}]}
+
+
+def synthetic_autocomplete(params):
+    text = params.get("input", "").strip().title()
+    if not text:
+        return {"status": "ZERO_RESULTS", "predictions": []}
+    count = _seed("autocomplete", text) % 6
+    return {"status": "OK" if count else "ZERO_RESULTS",
+            "predictions": [{"description": f"{text}{suffix}, Country"}
+                            for suffix in ["", "ville", " City", "burg", " Heights"][:count]]}
+
+
+def _nearby_places(params):
+    lat, lng = (float(x) for x in params["location"].split(","))
+    radius = float(params.get("radius", 2000))
+    # A ~500m grid of "neighbourhoods"; overlapping searches see the same places
+    cell_lat, cell_lng = round(lat * 200), round(lng * 200)
+    total = 10 + _seed("density", cell_lat, cell_lng, params.get("type"), params.get("keyword")) % 51
+    places = []
+    for i in range(total):
+        s = _seed("place", cell_lat, cell_lng, params.get("type"), params.get("keyword"), i)
+        d_lat = ((s % 2001) / 1000 - 1) * radius / 111320
+        d_lng = ((s // 2001 % 2001) / 1000 - 1) * radius / 111320
+        name = f"{WORDS[s % 8]} {WORDS[8 + s // 8 % 8]} {i}"
+        places.append({
+            "place_id": f"SI{cell_lat}x{cell_lng}x{params.get('type') or ''}x{i}",
+            "name": name,
+            "vicinity": f"{s % 300} Example Street",
+            "rating": round(3 + (s % 21) / 10, 1),
+            "user_ratings_total": s % 900,
+            "types": [params.get("type") or "establishment", "point_of_interest"],
+            "geometry": {"location": {"lat": lat + d_lat, "lng": lng + d_lng}},
+        })
+    return places
+
+
+def _encode_token(params, page):
+    raw = json.dumps({"params": params, "page": page, "issued": time.time()})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def synthetic_nearby(params, config):
+    page = 0
+    if params.get("pagetoken"):
+        try:
+            token = json.loads(base64.urlsafe_b64decode(params["pagetoken"]))
+        except ValueError:
+            return {"status": "INVALID_REQUEST"}
+        if (time.time() - token["issued"]) * 1000 < config.token_delay_ms:
+            return {"status": "INVALID_REQUEST"}
+        params, page = token["params"], token["page"]
+
+    places = _nearby_places(params)
+    results = places[page * 20:(page + 1) * 20]
+    data = {"status": "OK" if results else "ZERO_RESULTS", "results": results}
+    if (page + 1) * 20 < len(places) and page < 2:
+        data["next_page_token"] = _encode_token(params, page + 1)
+    return data
+
+
+def synthetic_details(params, config):
+    place_id = params.get("place_id", "")
+    s = _seed("details", place_id)
+    details = {
+        "name": f"{WORDS[s % 8]} {WORDS[8 + s // 8 % 8]}",
+        "formatted_address": f"{s % 300} Example Street, Bench City",
+        "formatted_phone_number": f"+1 555 {s % 10000:04d}",
+        "rating": round(3 + (s % 21) / 10, 1),
+        "user_ratings_total": s % 900,
+        "url": f"https://maps.google.com/?cid={s}",
+        "types": ["establishment", "point_of_interest"],
+    }
+    if s % 10 < 7:
+        details["website"] = site_url(place_id, config)
+
+    fields = params.get("fields")
+    if fields:
+        details = {k: v for k, v in details.items() if k in fields.split(",")}
+    return {"status": "OK", "result": details}
+
+
+def site_page(host, path):
+    # Half the sites show an email on the homepage, a quarter only on /contact
+    s = _seed("page", host)
+    kind = s % 4
+    filler = "<p>" + " ".join(WORDS[(s + i) % len(WORDS)].lower() for i in range(2000 + s % 6000)) + "</p>"
+    script = "<script>var cfg='" + "a1b2c3d4" * (100 + s % 2000) + "';</script>"
+
+    if path in ("", "/"):
+        email = f'<a href="mailto:hello@shop{s % 100000}.example">Email us</a>' if kind < 2 else ""
+        return 200, f"<html><head>{script}</head><body>{filler}{email}</body></html>"
+    if path == "/contact" and kind == 2:
+        return 200, f"<html><body>{filler} info [at] shop{s % 100000} [dot] example</body></html>"
+    return 404, "<html><body>Not found</body></html>"
+
+
+# ---------------------------------------------------------------- handlers
+
+class GoogleHandler(BaseHTTPRequestHandler):
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = GOOGLE_PATHS.get(url.path)
+        if endpoint is None:
+            return self._send(404, {"error": "unknown endpoint"})
+
+        config = self.config
+        config.count(endpoint)
+        config.sleep(config.latency_ms)
+
+        roll = random.random()
+        if roll < config.error_rate:
+            return self._send(500, {"error": "stand-in injected error"})
+        if roll < config.error_rate + config.over_quota_rate:
+            return self._send(200, {"status": "OVER_QUERY_LIMIT", "results": []})
+
+        params = dict(parse_qsl(url.query))
+        params.pop("key", None)
+        self._send(200, self._answer(endpoint, url.path, params))
+
+    def _answer(self, endpoint, path, params):
+        config = self.config
+        record_key = endpoint + "?" + urlencode(sorted(params.items()))
+        with config.lock:
+            recorded = config.recordings.get(record_key)
+        if recorded is not None:
+            return recorded
+
+        if config.record_from:
+            upstream = dict(params, key=os.environ["GOOGLE_MAPS_API_KEY"])
+            data = requests.get(config.record_from + path, params=upstream, timeout=10).json()
+            with config.lock:
+                config.recordings[record_key] = data
+                with open(config.recordings_path, "w") as f:
+                    json.dump(config.recordings, f)
+            return data
+
+        if endpoint == "geocode":
+            return synthetic_geocode(params)
+        if endpoint == "autocomplete":
+            return synthetic_autocomplete(params)
+        if endpoint == "nearby":
+            return synthetic_nearby(params, config)
+        return synthetic_details(params, config)
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        config = self.config
+        config.count("site")
+        config.sleep(config.site_latency_ms)
+        if random.random() < config.site_error_rate:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        host = self.headers.get("Host", "").split(":")[0]
+        status, html = site_page(host, urlsplit(self.path).path.rstrip("/"))
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_standin(config, port=0, host="127.0.0.1"):
+    # Starts both servers in background threads; returns (google_base_url, servers)
+    site_server = ThreadingHTTPServer(("", config.sites_port), type("Sites", (SiteHandler,), {"config": config}))
+    config.sites_port = site_server.server_address[1]
+    google_server = ThreadingHTTPServer((host, port), type("Google", (GoogleHandler,), {"config": config}))
+
+    for server in (google_server, site_server):
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://{host}:{google_server.server_address[1]}", (google_server, site_server)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sites-port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Google calls answered 500")
+    parser.add_argument("--over-quota-rate", type=float, default=0.0, help="share answered OVER_QUERY_LIMIT")
+    parser.add_argument("--token-delay-ms", type=float, default=0,
+                        help="next_page_token is INVALID_REQUEST for this long after being issued")
+    parser.add_argument("--site-latency-ms", type=float, default=150)
+    parser.add_argument("--site-error-rate", type=float, default=0.05)
+    parser.add_argument("--recordings", help="JSON file of recorded responses to replay")
+    parser.add_argument("--record-from", help="upstream base URL to record misses from")
+    args = parser.parse_args()
+
+    if args.record_from and not (args.recordings and os.getenv("GOOGLE_MAPS_API_KEY")):
+        sys.exit("--record-from needs --recordings and GOOGLE_MAPS_API_KEY")
+
+    config = StandinConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.over_quota_rate,
+                           args.token_delay_ms, args.site_latency_ms, args.site_error_rate,
+                           args.sites_port, args.recordings, args.record_from)
+    base_url, _ = start_standin(config, args.port)
+    print(f"Google stand-in on {base_url}, sites on port {config.sites_port}")
+    print(f"Run the app with GOOGLE_API_BASE={base_url}")
+    try:
+        while True:
+            time.sleep(10)
+            print("requests so far:", config.counts)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
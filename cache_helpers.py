@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Optional sqlite file shared by every gunicorn worker on the host.
+# Leave unset to keep caches in-process only.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH")
+
+_sqlite_lock = threading.Lock()
+_sqlite_conn = None
+
+# Every store created in this process, for /metrics
+_stores = []
+
+
+def _get_sqlite():
+    global _sqlite_conn
+    if _sqlite_conn is None:
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.commit()
+        _sqlite_conn = conn
+    return _sqlite_conn
+
+
+def _entry_size(value):
+    # Rough memory footprint of a cached value, used for the byte cap
+    return len(json.dumps(value, default=str))
+
+
+class _CountingTTLCache(TTLCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.evictions = 0
+
+    def popitem(self):
+        # Only called when the cache is full, i.e. an LRU eviction
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class TTLCacheStore:
+    """LRU + TTL cache with a byte cap, optionally backed by the shared sqlite file."""
+
+    def __init__(self, namespace, ttl, max_bytes, shared=True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.shared = shared and bool(CACHE_DB_PATH)
+        self._local = _CountingTTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=_entry_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        _stores.append(self)
+
+    def get(self, key):
+        with self._lock:
+            value = self._local.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+        value = self._shared_get(key) if self.shared else None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._local_set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._local_set(key, value)
+        if self.shared:
+            self._shared_set(key, value, ttl or self.ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        if self.shared:
+            with _sqlite_lock:
+                conn = _get_sqlite()
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace=? AND key=?",
+                    (self.namespace, key)
+                )
+                conn.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self._local.evictions,
+                "entries": len(self._local),
+                "bytes": self._local.currsize,
+                "max_bytes": self._local.maxsize,
+            }
+
+    def _local_set(self, key, value):
+        try:
+            self._local[key] = value
+        except ValueError:
+            # Single value bigger than the whole cache; don't keep it locally
+            pass
+
+    def _shared_get(self, key):
+        try:
+            with _sqlite_lock:
+                row = _get_sqlite().execute(
+                    "SELECT value, expires_at FROM cache_entries WHERE namespace=? AND key=?",
+                    (self.namespace, key)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print("Cache read error:", e)
+            return None
+
+        if not row:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return json.loads(value)
+
+    def _shared_set(self, key, value, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        try:
+            with _sqlite_lock:
+                conn = _get_sqlite()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, default=str), expires_at)
+                )
+                self._writes += 1
+                # Sweep expired rows every so often so the file doesn't grow forever
+                if self._writes % 500 == 0:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at < ?",
+                        (time.time(),)
+                    )
+                conn.commit()
+        except sqlite3.Error as e:
+            print("Cache write error:", e)
+
+
+def all_cache_stats():
+    return {store.namespace: store.stats() for store in _stores}
@@ -1,26 +1,132 @@
+import os
 import re
-import requests
+import json
+import time
+from urllib.parse import urlsplit, unquote
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
-from db_extentions import get_db_connection
+from db_extentions import db_connection
+from http_helpers import http_get
+from metrics_helpers import timed, SCRAPE_PAGES, SCRAPE_DURATION
 
 load_dotenv()
 
 
+BANNED_EMAIL_DOMAINS = frozenset([
+    "sentry.io",
+    "wixpress.com",
+    "sentry.wixpress.com",
+    "sentry-next.wixpress.com",
+    "oyorooms.com"
+])
+
+# "logo@2x.png" style matches from asset filenames
+ASSET_EXTENSIONS = frozenset(["png", "jpg", "jpeg", "gif", "svg", "webp", "css", "js"])
+
+LOCAL_PART_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._%+-")
+MAX_LOCAL_PART = 64
+
+EMAIL_RE = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+DOMAIN_RE = re.compile(r"[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+MAILTO_RE = re.compile(r"(?:mailto|MAILTO|Mailto):([^\"'<>?\s]+)")
+HEX_LOCAL_RE = re.compile(r"[a-f0-9]{20,}")
+
+# "info [at] shop [dot] com", "info(at)shop(dot)co(dot)uk", ... The match
+# starts at the bracket (a leading \s* would rescan every whitespace run
+# once per character); whitespace before it is skipped in the local-part walk
+OBFUSCATED_AT_RE = re.compile(r"\[\s*at\s*\]|\(\s*at\s*\)|\{\s*at\s*\}", re.IGNORECASE)
+OBFUSCATED_DOMAIN_RE = re.compile(
+    r"\s*([a-zA-Z0-9-]+(?:(?:\s*[\[\(\{]\s*dot\s*[\]\)\}]\s*|\.)[a-zA-Z0-9-]+)+)",
+    re.IGNORECASE
+)
+OBFUSCATED_DOT_RE = re.compile(r"\s*([\[\(\{])\s*dot\s*[\]\)\}]\s*", re.IGNORECASE)
+OBFUSCATED_MAX_GAP = 3   # spaces allowed between the local part and "[at]"
+# "open (at) 9am (dot) com" is opening hours, not an address
+CLOCK_TIME_RE = re.compile(r"\d{1,2}(?:am|pm)", re.IGNORECASE)
+
+# Entity-encoded "@" and "." that sites use to hide addresses from bots
+HTML_ENTITIES = [("&#64;", "@"), ("&#x40;", "@"), ("&commat;", "@"), ("&#46;", "."), ("&period;", ".")]
+
+
+def _local_part_start(text, end):
+    # Walk left from the "@" over local-part characters. Scanning from each
+    # "@" instead of regex-searching the whole page keeps this linear even on
+    # long alphanumeric runs (minified JS, base64) where a regex backtracks.
+    start = end
+    while start > 0 and end - start <= MAX_LOCAL_PART and text[start - 1] in LOCAL_PART_CHARS:
+        start -= 1
+    if start == end or end - start > MAX_LOCAL_PART:
+        return None
+    return start
+
+
+def extract_emails(text):
+    if "&" in text:
+        for entity, char in HTML_ENTITIES:
+            if entity in text:
+                text = text.replace(entity, char)
+
+    emails = set()
+
+    at = text.find("@")
+    while at != -1:
+        start = _local_part_start(text, at)
+        domain = DOMAIN_RE.match(text, at + 1)
+        if start is not None and domain:
+            emails.add(text[start:at] + "@" + domain.group())
+        at = text.find("@", at + 1)
+
+    if "ailto:" in text or "AILTO:" in text:
+        for match in MAILTO_RE.findall(text):
+            for address in unquote(match).split(","):
+                address = address.strip()
+                if EMAIL_RE.fullmatch(address):
+                    emails.add(address)
+
+    for at_match in OBFUSCATED_AT_RE.finditer(text):
+        address = _deobfuscate(text, at_match)
+        if address:
+            emails.add(address)
+
+    return emails
+
+
+def _deobfuscate(text, at_match):
+    end = at_match.start()
+    while end > 0 and at_match.start() - end < OBFUSCATED_MAX_GAP and text[end - 1].isspace():
+        end -= 1
+    start = _local_part_start(text, end)
+    domain = OBFUSCATED_DOMAIN_RE.match(text, at_match.end())
+    if start is None or not domain:
+        return None
+
+    # Real obfuscation uses one bracket style throughout; prose like
+    # "us {at} twitter (dot) com" mixes them
+    bracket = at_match.group()[0]
+    if any(dot.group(1) != bracket for dot in OBFUSCATED_DOT_RE.finditer(domain.group(1))):
+        return None
+
+    host = OBFUSCATED_DOT_RE.sub(".", domain.group(1))
+    if CLOCK_TIME_RE.fullmatch(host.partition(".")[0]):
+        return None
+
+    address = text[start:end] + "@" + host
+    return address if EMAIL_RE.fullmatch(address) else None
+
+
 def clean_email_list(emails):
     cleaned = []
-    banned_domains = [
-        "sentry.io",
-        "wixpress.com",
-        "sentry.wixpress.com",
-        "sentry-next.wixpress.com",
-        "oyorooms.com"
-    ]
 
     for email in emails:
         local, _, domain = email.lower().partition("@")
 
         # Skip banned domains
-        if domain in banned_domains:
+        if domain in BANNED_EMAIL_DOMAINS:
+            continue
+
+        # Skip image/asset filenames that look like emails
+        if domain.rpartition(".")[2] in ASSET_EXTENSIONS:
             continue
 
         # Skip emails with extremely long "local" part (usually noise)
@@ -32,7 +138,7 @@ def clean_email_list(emails):
             continue
 
         # Skip hex-like random strings
-        if re.fullmatch(r"[a-f0-9]{20,}", local):
+        if HEX_LOCAL_RE.fullmatch(local):
             continue
 
         cleaned.append(email)
@@ -40,88 +146,260 @@ def clean_email_list(emails):
     return cleaned
 
 
-def extract_emails_from_website(url):
-    print(f"Scraping homepage: {url}")
-
-    # Normalize URL (remove trailing slash)
-    if url.endswith("/"):
-        url = url[:-1]
-
-    all_emails = []
-
-    # 1️⃣ Scrape homepage first
+# Pages tried when the homepage has no usable emails
+EXTRA_PATHS = [
+    "/contact",
+    "/contact-us",
+    "/contactus",
+    "/about",
+    "/about-us",
+    "/support",
+    "/help"
+]
+
+SCRAPE_PAGE_TIMEOUT = float(os.getenv("SCRAPE_PAGE_TIMEOUT", 5))
+# Whole-batch time budget; whatever is found by then is returned
+SCRAPE_DEADLINE = float(os.getenv("SCRAPE_DEADLINE", 20))
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", 16))
+# Only this much of each page is downloaded and searched
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", 512*1024))
+
+_scrape_executor = ThreadPoolExecutor(
+    max_workers=SCRAPE_CONCURRENCY,
+    thread_name_prefix="email-scrape"
+)
+
+# How long a scrape result is reused, by outcome. "homepage" means the
+# homepage had emails, so the fallback pages were never fetched.
+SCRAPE_CACHE_TTL = {
+    "homepage": int(os.getenv("SCRAPE_CACHE_TTL", 60*60*24*7)),
+    "fallback": int(os.getenv("SCRAPE_CACHE_TTL", 60*60*24*7)),
+    "no_emails": int(os.getenv("SCRAPE_CACHE_NEGATIVE_TTL", 60*60*24)),
+    "unreachable": int(os.getenv("SCRAPE_CACHE_UNREACHABLE_TTL", 60*60)),
+}
+
+
+def _scrape_page(page_url):
+    print(f"Scraping page: {page_url}")
+    started = time.perf_counter()
+    result = "error"
     try:
-        response = requests.get(url, timeout=5, headers={"User-Agent": "Mozilla/5.0"})
-        html = response.text
+        with http_get(page_url, timeout=SCRAPE_PAGE_TIMEOUT, kind="scrape", stream=True) as response:
+            body = _read_capped(response, SCRAPE_MAX_BYTES)
+        emails = emails_in_page(body, response.encoding)
+        result = "emails" if emails else "no_emails"
+        return emails
+    except Exception as e:
+        print(f"Error scraping {page_url}: {e}")
+        return None
+    finally:
+        SCRAPE_DURATION.observe(time.perf_counter() - started)
+        SCRAPE_PAGES.inc(result=result)
+
+
+def emails_in_page(body, encoding):
+    text = body.decode(encoding or "utf-8", errors="replace")
+    return list(extract_emails(text))
+
+
+def _read_capped(response, max_bytes):
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64*1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            break
+    return b"".join(chunks)[:max_bytes]
+
+
+class ScrapeBatch:
+    """Bookkeeping for one extract_emails_from_websites call, whatever runs the fetches.
+
+    Homepages are scraped first; for sites with nothing usable there, all
+    fallback paths are probed at once and the site finishes as soon as any
+    of them yields a good email.
+    """
+
+    def __init__(self, urls, cached):
+        # Normalize URL (remove trailing slash)
+        self.sites = {}
+        for url in urls:
+            if url and url not in self.sites:
+                self.sites[url] = url[:-1] if url.endswith("/") else url
+
+        # Sites scraped recently (including ones with no emails) skip the network
+        self.results = {url: emails for url, emails in cached.items() if url in self.sites}
+        self.outcomes = {}                        # url -> outcome, for sites scraped now
+
+        self.found = {url: [] for url in self.sites}   # raw emails collected so far
+        self.failed_pages = {url: 0 for url in self.sites}
+        self.remaining_paths = {}
+
+    def homepages(self):
+        # [(url, page_url, is_homepage)] to start with
+        return [(url, base, True) for url, base in self.sites.items() if url not in self.results]
+
+    def page_done(self, url, is_homepage, page_emails):
+        # Records one page; returns the pages to fetch next, or None when
+        # the site is finished and its other pages can be dropped
+        if url in self.results:
+            return None
+
+        if page_emails is None:
+            self.failed_pages[url] += 1
+        else:
+            self.found[url].extend(page_emails)
+        cleaned = clean_email_list(list(set(self.found[url])))
+
+        if cleaned:
+            self.results[url] = cleaned
+            self.outcomes[url] = "homepage" if is_homepage else "fallback"
+            return None
+        if is_homepage:
+            self.remaining_paths[url] = len(EXTRA_PATHS)
+            return [(url, self.sites[url] + path, False) for path in EXTRA_PATHS]
+
+        self.remaining_paths[url] -= 1
+        if self.remaining_paths[url] == 0:
+            self.results[url] = []
+            every_page_failed = self.failed_pages[url] == len(EXTRA_PATHS) + 1
+            self.outcomes[url] = "unreachable" if every_page_failed else "no_emails"
+        return []
+
+    def finish(self):
+        # Deadline hit: hand back partial results. Partial results aren't
+        # cached since the site was never fully checked.
+        for url in self.sites:
+            if url not in self.results:
+                print("Scrape deadline reached for", url)
+                self.results[url] = clean_email_list(list(set(self.found[url])))
+        return {url: self.results[url] for url in self.sites}
+
+    def scrapes_to_store(self):
+        return {url: (self.results[url], outcome) for url, outcome in self.outcomes.items()}
 
-        homepage_emails = re.findall(
-            r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}",
-            html
-        )
 
-        all_emails.extend(homepage_emails)
+def extract_emails_from_website(url):
+    return extract_emails_from_websites([url]).get(url, [])
+
+
+def extract_emails_from_websites(urls, deadline=None):
+    # Returns {url: [emails]}, see ScrapeBatch
+    with timed("scrape"):
+        return _extract_emails_from_websites(urls, deadline)
+
+
+def _extract_emails_from_websites(urls, deadline):
+    deadline = SCRAPE_DEADLINE if deadline is None else deadline
+    stop_at = time.monotonic() + deadline
+
+    urls = [url for url in urls if url]
+    batch = ScrapeBatch(urls, get_cached_scrapes(list(dict.fromkeys(urls))))
+    pending = {}                         # future -> (url, is_homepage)
+
+    def submit(pages):
+        for url, page_url, is_homepage in pages:
+            pending[_scrape_executor.submit(_scrape_page, page_url)] = (url, is_homepage)
+
+    submit(batch.homepages())
+    while pending:
+        timeout = stop_at - time.monotonic()
+        if timeout <= 0:
+            break
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            # May already be dropped by _cancel_site earlier in this loop
+            if future not in pending:
+                continue
+            url, is_homepage = pending.pop(future)
+            next_pages = batch.page_done(url, is_homepage, future.result())
+            if next_pages is None:
+                _cancel_site(pending, url)
+            else:
+                submit(next_pages)
+
+    # Drop work that hasn't started
+    for future in pending:
+        future.cancel()
+    results = batch.finish()
+
+    store_scrapes(batch.scrapes_to_store())
+
+    return results
+
+
+def _cancel_site(pending, url):
+    # Site is done: stop waiting on its other pages (running ones just finish in the background)
+    for future, (site, _) in list(pending.items()):
+        if site == url:
+            future.cancel()
+            del pending[future]
+
+
+def website_cache_key(url):
+    # Host without www. plus path: facebook.com/joespizza and facebook.com/otherbiz
+    # are different businesses. Query and fragment are dropped (mostly utm tags)
+    if "//" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+    domain = parts.netloc.lower().split(":")[0]
+    domain = domain[4:] if domain.startswith("www.") else domain
+    path = re.sub(r"/{2,}", "/", parts.path).rstrip("/")
+    return domain + path
+
+
+def get_cached_scrapes(urls):
+    # {url: [emails]} for every url whose site has a fresh cached scrape
+    by_key = {}
+    for url in urls:
+        by_key.setdefault(website_cache_key(url), []).append(url)
+    if not by_key:
+        return {}
 
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT domain, emails FROM scrape_cache
+                WHERE domain = ANY(%s) AND expires_at > NOW()
+            """, (list(by_key),))
+            rows = cur.fetchall()
     except Exception as e:
-        print("Homepage scrape error:", e)
-
-    # Clean homepage emails
-    cleaned_home = clean_email_list(list(set(all_emails)))
-
-    # If homepage returns valid emails → return early
-    if cleaned_home:
-        print("Found good emails on homepage:", cleaned_home)
-        return cleaned_home
-
-    # 2️⃣ Otherwise, scrape extra pages
-    EXTRA_PATHS = [
-        "/contact",
-        "/contact-us",
-        "/contactus",
-        "/about",
-        "/about-us",
-        "/support",
-        "/help"
-    ]
-
-    for path in EXTRA_PATHS:
-        full_url = url + path
-        print(f"Scraping secondary page: {full_url}")
-
-        try:
-            resp = requests.get(full_url, timeout=5, headers={"User-Agent": "Mozilla/5.0"})
-            html = resp.text
-
-            extra_emails = re.findall(
-                r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}",
-                html
-            )
-
-            all_emails.extend(extra_emails)
-
-        except Exception as e:
-            print(f"Error scraping {full_url}: {e}")
-
-    # 3️⃣ Final cleaning
-    cleaned_final = clean_email_list(list(set(all_emails)))
-    print("Final cleaned emails:", cleaned_final)
-
-    return cleaned_final
-
-def update_user_credits(user_id, credits):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET credits=%s WHERE id=%s", (credits, user_id))
-    conn.commit()
-    cur.close()
-
-def get_user_by_id(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, email, credits FROM users WHERE id=%s", (user_id,))
-    row = cur.fetchone()
-    cur.close()
-
-    if not row:
-        return None
+        print("Scrape cache read error:", e)
+        return {}
+
+    cached = {}
+    for key, emails in rows:
+        for url in by_key[key]:
+            cached[url] = emails
+    return cached
+
+
+def store_scrapes(scrapes):
+    # scrapes: {url: (emails, outcome)}
+    rows = {}
+    for url, (emails, outcome) in scrapes.items():
+        ttl = SCRAPE_CACHE_TTL[outcome]
+        key = website_cache_key(url)
+        rows[key] = (key, json.dumps(emails), outcome, ttl)
+    if not rows:
+        return
 
-    return {"id": row[0], "email": row[1], "credits": row[2]}
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            execute_values(cur, """
+                INSERT INTO scrape_cache (domain, emails, outcome, scraped_at, expires_at)
+                VALUES %s
+                ON CONFLICT (domain) DO UPDATE
+                SET emails = EXCLUDED.emails,
+                    outcome = EXCLUDED.outcome,
+                    scraped_at = EXCLUDED.scraped_at,
+                    expires_at = EXCLUDED.expires_at
+            """, list(rows.values()),
+                template="(%s, %s::jsonb, %s, NOW(), NOW() + make_interval(secs => %s))")
+            conn.commit()
+    except Exception as e:
+        print("Scrape cache write error:", e)
@@ -0,0 +1,119 @@
+import threading
+import uuid
+from dotenv import load_dotenv
+from db_extentions import db_connection
+from auth_helpers import invalidate_user
+
+load_dotenv()
+
+
+# Conditional decrement + ledger row in one statement: no read-then-write race,
+# and the row lock is held only for this statement. previous_balance comes
+# from the statement's snapshot, i.e. before the update.
+_CHARGE_SQL = """
+    WITH debit AS (
+        UPDATE users SET credits = credits - %(amount)s
+        WHERE id = %(user_id)s AND credits >= %(amount)s
+        RETURNING id, credits
+    ), ledger AS (
+        INSERT INTO credit_ledger (user_id, delta, balance_after, reason, reference)
+        SELECT id, -%(amount)s, credits, %(reason)s, %(reference)s FROM debit
+    )
+    SELECT
+        (SELECT credits FROM debit) AS balance,
+        (SELECT credits FROM users WHERE id = %(user_id)s) AS previous_balance
+"""
+
+_CREDIT_SQL = """
+    WITH credit AS (
+        UPDATE users SET credits = credits + %(amount)s
+        WHERE id = %(user_id)s
+        RETURNING id, credits
+    ), ledger AS (
+        INSERT INTO credit_ledger (user_id, delta, balance_after, reason, reference)
+        SELECT id, %(amount)s, credits, %(reason)s, %(reference)s FROM credit
+    )
+    SELECT credits AS balance FROM credit
+"""
+
+
+def charge_credits(user_id, amount, reason, reference=None):
+    # Returns (charged, balance). balance is None when the user doesn't exist;
+    # when charged is False it's the (insufficient) current balance.
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(_CHARGE_SQL, {
+            "user_id": user_id, "amount": amount, "reason": reason, "reference": reference
+        })
+        balance, previous_balance = cur.fetchone()
+        conn.commit()
+
+    invalidate_user(user_id)
+    if balance is not None:
+        return True, balance
+    return False, previous_balance
+
+
+def add_credits(user_id, amount, reason, reference=None):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(_CREDIT_SQL, {
+            "user_id": user_id, "amount": amount, "reason": reason, "reference": reference
+        })
+        row = cur.fetchone()
+        conn.commit()
+
+    invalidate_user(user_id)
+    return row[0] if row else None
+
+
+_reservations_lock = threading.Lock()
+_reservations = {}
+
+
+class CreditReservation:
+    """Credits taken up front for a streamed response, refunded if the stream fails."""
+
+    def __init__(self, user_id, amount, reason):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.amount = amount
+        self.reason = reason
+        self.ok, self.balance = charge_credits(user_id, amount, reason, reference=self.id)
+        if self.ok:
+            with _reservations_lock:
+                _reservations[self.id] = self
+
+    def commit(self):
+        with _reservations_lock:
+            _reservations.pop(self.id, None)
+
+    def release(self):
+        with _reservations_lock:
+            if _reservations.pop(self.id, None) is None:
+                return
+        self.balance = add_credits(self.user_id, self.amount, self.reason + "_refund", reference=self.id)
+
+    def guard(self, chunks):
+        # Wraps a response generator: committed once fully sent, refunded on a
+        # server-side error. A client hanging up mid-download still pays.
+        try:
+            yield from chunks
+        except GeneratorExit:
+            self.commit()
+            raise
+        except Exception as e:
+            print(f"{self.reason} failed, refunding credits:", e)
+            self.release()
+            raise
+        else:
+            self.commit()
+
+
+def reserve_credits(user_id, amount, reason):
+    return CreditReservation(user_id, amount, reason)
+
+
+def pending_reservations():
+    with _reservations_lock:
+        return len(_reservations)
@@ -1,45 +1,158 @@
 import os
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from metrics_helpers import current_timings
 
 load_dotenv()
 
-host =  os.getenv('DB_HOST')
-user = os.getenv("DB_USER")
-password = os.getenv("DB_PASSWORD")
-database =  os.getenv("DB_NAME")
-port = os.getenv("DB_PORT")
+DATABASE_URL = os.getenv("DATABASE_URL")
 
-# DB_CONN = psycopg2.connect(
-#     host=host,
-#     database=database,
-#     user=user,
-#     password=password,
-#     port=port
-# )
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# How long a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Connections idle longer than this get a SELECT 1 before being handed out
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", 30))
 
-# def get_cursor():
-#     return DB_CONN.cursor(cursor_factory=RealDictCursor)
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}
 
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "waits": 0,
+    "wait_seconds": 0.0,
+    "timeouts": 0,
+    "broken_replaced": 0,
+    "in_use": 0,
+}
 
 
-def get_cursor():
+def _get_pool():
+    global _pool, _pool_pid, _pool_slots
+    # gunicorn forks workers; never share a pool's sockets across processes
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                try:
+                    _pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+                except Exception as e:
+                    # psycopg2 errors can echo the DSN, password included
+                    message = str(e).replace(DATABASE_URL, "<DATABASE_URL>") if DATABASE_URL else e
+                    print("Database connection error:", message)
+                    raise
+                _pool_pid = os.getpid()
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _last_used.clear()
+    return _pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    # Brand new or recently used connections are trusted as-is
+    if last_used is None or time.monotonic() - last_used < DB_POOL_CHECK_AFTER:
+        return True
     try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    db_pool = _get_pool()
 
-        conn = psycopg2.connect(os.getenv("DATABASE_URL"))
-        return conn.cursor(cursor_factory=RealDictCursor)
+    started = time.monotonic()
+    if not _pool_slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["waits"] += 1
+        if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            with _stats_lock:
+                _stats["timeouts"] += 1
+            raise pool.PoolError("Timed out waiting for a database connection")
 
-    except Exception as e:
-        print("Database connection error:", e)
+    try:
+        conn = db_pool.getconn()
+        if not _is_healthy(conn):
+            db_pool.putconn(conn, close=True)
+            with _stats_lock:
+                _stats["broken_replaced"] += 1
+            conn = db_pool.getconn()
+    except Exception:
+        _pool_slots.release()
         raise
 
-def get_db_connection():
+    waited = time.monotonic() - started
+    with _stats_lock:
+        _stats["checkouts"] += 1
+        _stats["wait_seconds"] += waited
+        _stats["in_use"] += 1
+    timings = current_timings()
+    if timings is not None:
+        timings.add("db_wait", waited)
+    return conn
+
+
+def _checkin(conn):
+    db_pool = _get_pool()
     try:
-        print("Db Connection string", os.getenv("DATABASE_URL"))
-        conn = psycopg2.connect(os.getenv("DATABASE_URL"))
-        return conn
+        broken = conn.closed
+        if not broken:
+            try:
+                # Never hand the next request a half-finished transaction
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        _last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn, close=broken)
+    finally:
+        _pool_slots.release()
+        with _stats_lock:
+            _stats["in_use"] -= 1
+
+
+@contextmanager
+def db_connection():
+    conn = _checkout()
+    # Time the connection is held, i.e. the queries run on it
+    held_from = time.monotonic()
+    try:
+        yield conn
+    finally:
+        _checkin(conn)
+        timings = current_timings()
+        if timings is not None:
+            timings.add("db", time.monotonic() - held_from)
+
+
+@contextmanager
+def db_cursor(commit=False):
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            yield cur
+            if commit:
+                conn.commit()
+        finally:
+            cur.close()
+
 
-    except Exception as e:
-        print("Database connection error:", e)
-        raise
\ No newline at end of file
+def get_pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["max_size"] = DB_POOL_MAX
+    stats["min_size"] = DB_POOL_MIN
+    stats["saturation"] = stats["in_use"] / DB_POOL_MAX if DB_POOL_MAX else 0
+    return stats
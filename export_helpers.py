@@ -0,0 +1,137 @@
+import csv
+import json
+import tempfile
+from db_extentions import db_cursor
+
+
+CSV_HEADER = [
+    "Name",
+    "Address",
+    "Phone",
+    "Rating",
+    "Reviews",
+    "Website",
+    "Google Maps URL",
+    "Emails"
+]
+
+# Rows buffered per chunk sent to the client
+CSV_CHUNK_ROWS = 200
+XLSX_CHUNK_BYTES = 64*1024
+
+# Rows fetched per query (and per pool checkout) by the saved_businesses export
+SAVED_EXPORT_BATCH_ROWS = 2000
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+
+class _LineBuffer:
+    # csv.writer target that just hands back what it was given
+    def write(self, value):
+        return value
+
+
+def business_csv_row(b):
+    emails_str = ", ".join(b.get("emails") or [])
+
+    return [
+        b.get("name", ""),
+        b.get("address", ""),
+        b.get("phone", ""),
+        b.get("rating", ""),
+        b.get("reviews_count", ""),
+        b.get("website", ""),
+        b.get("maps_url", ""),
+        emails_str
+    ]
+
+
+def stream_csv(businesses):
+    # Yields UTF-8 chunks of CSV; memory stays bounded by CSV_CHUNK_ROWS
+    writer = csv.writer(_LineBuffer())
+
+    chunk = [writer.writerow(CSV_HEADER)]
+    for b in businesses:
+        chunk.append(writer.writerow(business_csv_row(b)))
+        if len(chunk) >= CSV_CHUNK_ROWS:
+            yield "".join(chunk).encode("utf-8")
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk).encode("utf-8")
+
+
+def stream_ndjson(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, default=str) + "\n")
+        if len(chunk) >= CSV_CHUNK_ROWS:
+            yield "".join(chunk).encode("utf-8")
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk).encode("utf-8")
+
+
+def stream_xlsx(businesses):
+    # openpyxl is only needed for this format
+    from openpyxl import Workbook
+
+    # write_only keeps rows on disk instead of building the sheet in memory;
+    # the zip has to be finished before it can be sent, so spool it to a temp file
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Businesses")
+    ws.append(CSV_HEADER)
+    for b in businesses:
+        ws.append(business_csv_row(b))
+
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            data = tmp.read(XLSX_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+
+
+def iter_saved_businesses(user_id, status=None, saved_from=None, saved_to=None):
+    # Keyset batches on (saved_at, id): a pooled connection is only held for
+    # one batch query, not while the client downloads the whole export
+    conditions = ["user_id = %s"]
+    params = [user_id]
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if saved_from:
+        conditions.append("saved_at >= %s")
+        params.append(saved_from)
+    if saved_to:
+        conditions.append("saved_at < %s")
+        params.append(saved_to)
+
+    after = None
+    while True:
+        batch_conditions = conditions + ["(saved_at, id) < (%s, %s)"] if after else conditions
+        with db_cursor() as cur:
+            cur.execute(f"""
+                SELECT id, name, address, phone, website, emails, rating, reviews_count,
+                       maps_url, status, notes, saved_at
+                FROM saved_businesses
+                WHERE {" AND ".join(batch_conditions)}
+                ORDER BY saved_at DESC, id DESC
+                LIMIT %s
+            """, params + list(after or ()) + [SAVED_EXPORT_BATCH_ROWS])
+            rows = cur.fetchall()
+
+        for row in rows:
+            row["emails"] = row["emails"] or []
+            yield row
+
+        if len(rows) < SAVED_EXPORT_BATCH_ROWS:
+            return
+        after = (rows[-1]["saved_at"], rows[-1]["id"])
@@ -1,29 +1,230 @@
 import os
-import requests
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cache_helpers import TTLCacheStore
+from http_helpers import http_get
+from quota_helpers import TokenBucket, SingleFlight, QuotaExceeded
+from common_helpers import extract_emails_from_websites
+from metrics_helpers import timed, propagate, GOOGLE_REQUESTS, GOOGLE_DURATION
 
 
 GOOGLE_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY")
 
+# Max number of Place Details lookups in flight at once per process
+DETAILS_CONCURRENCY = int(os.getenv("PLACE_DETAILS_CONCURRENCY", 8))
+
+_details_executor = ThreadPoolExecutor(
+    max_workers=DETAILS_CONCURRENCY,
+    thread_name_prefix="place-details"
+)
+
+# Background Nearby Search page prefetches (multi-page requests)
+_page_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="nearby-pages")
+
+# Nearby Search allows at most 3 pages (60 results) per query
+MAX_NEARBY_PAGES = 3
+PAGE_TOKEN_DELAY = float(os.getenv("PAGE_TOKEN_DELAY", 1.5))
+PAGE_TOKEN_RETRY_DELAY = float(os.getenv("PAGE_TOKEN_RETRY_DELAY", 1))
+PAGE_TOKEN_RETRIES = 5
+
+# Point at bench/standin.py (or any recorded-response server) to run offline
+GOOGLE_API_BASE = os.getenv("GOOGLE_API_BASE", "https://maps.googleapis.com").rstrip("/")
+
+GOOGLE_ENDPOINTS = {
+    "geocode": GOOGLE_API_BASE + "/maps/api/geocode/json",
+    "autocomplete": GOOGLE_API_BASE + "/maps/api/place/autocomplete/json",
+    "nearby": GOOGLE_API_BASE + "/maps/api/place/nearbysearch/json",
+    "details": GOOGLE_API_BASE + "/maps/api/place/details/json",
+}
+
+# Outbound calls per second per endpoint for the whole deployment. Buckets
+# live in each process, so every worker enforces its share: set
+# GOOGLE_QUOTA_WORKERS to the total number of worker processes (gunicorn or
+# uvicorn --workers, summed over hosts). Calls over the limit queue for up
+# to GOOGLE_QUOTA_WAIT seconds.
+GOOGLE_QUOTA_WORKERS = max(int(os.getenv("GOOGLE_QUOTA_WORKERS", os.getenv("WEB_CONCURRENCY", 1))), 1)
+
+
+def _worker_qps(name, default):
+    return float(os.getenv(name, default)) / GOOGLE_QUOTA_WORKERS
+
+
+quota_buckets = {
+    "geocode": TokenBucket(_worker_qps("GOOGLE_QPS_GEOCODE", 20)),
+    "autocomplete": TokenBucket(_worker_qps("GOOGLE_QPS_AUTOCOMPLETE", 20)),
+    "nearby": TokenBucket(_worker_qps("GOOGLE_QPS_NEARBY", 10)),
+    "details": TokenBucket(_worker_qps("GOOGLE_QPS_DETAILS", 50)),
+}
+GOOGLE_QUOTA_WAIT = float(os.getenv("GOOGLE_QUOTA_WAIT", 10))
+# How long an endpoint stays paused after Google answers OVER_QUERY_LIMIT
+GOOGLE_QUOTA_BACKOFF = float(os.getenv("GOOGLE_QUOTA_BACKOFF", 2))
+
+# Identical requests already in flight are shared, not repeated
+_google_flights = SingleFlight()
+
+# Place Details field masks per response profile. Contact fields (phone,
+# website) and atmosphere fields (rating, reviews) are billed on top of
+# basic ones. "list" skips Details altogether: Nearby Search already has
+# what a result list shows, and the rest can be hydrated per place later.
+DETAILS_PROFILES = {
+    "list": None,
+    "contact": "name,formatted_address,formatted_phone_number,website,url",
+    "full": ("name,formatted_address,formatted_phone_number,website,"
+             "rating,user_ratings_total,url,types"),
+}
+DEFAULT_DETAILS_PROFILE = "full"
+
+# Place Details cache, keyed by place_id + requested fields
+details_cache = TTLCacheStore(
+    "place_details",
+    ttl=int(os.getenv("PLACE_DETAILS_CACHE_TTL", 60*60*6)),
+    max_bytes=int(os.getenv("PLACE_DETAILS_CACHE_MAX_BYTES", 32*1024*1024))
+)
+
+# City name -> (lat, lng). Cities don't move, so keep these for a long time.
+geocode_cache = TTLCacheStore(
+    "geocode",
+    ttl=int(os.getenv("GEOCODE_CACHE_TTL", 60*60*24*30)),
+    max_bytes=int(os.getenv("GEOCODE_CACHE_MAX_BYTES", 4*1024*1024))
+)
+
+# Autocomplete query -> list of city descriptions
+autocomplete_cache = TTLCacheStore(
+    "autocomplete",
+    ttl=int(os.getenv("AUTOCOMPLETE_CACHE_TTL", 60*60*24)),
+    max_bytes=int(os.getenv("AUTOCOMPLETE_CACHE_MAX_BYTES", 8*1024*1024)),
+    shared=False
+)
+
+# Google never returns more than this many autocomplete predictions
+AUTOCOMPLETE_MAX_PREDICTIONS = 5
+
 if not GOOGLE_API_KEY:
     raise RuntimeError("Environment variable GOOGLE_MAPS_API_KEY is not set.")
 
 
+def google_get(endpoint, params):
+    # Parsed JSON for a Maps API call, rate limited and coalesced. Callers
+    # share the returned dict, so they must not mutate it.
+    key = (endpoint, tuple(sorted(params.items())))
+    return _google_flights.do(key, lambda: _governed_get(endpoint, params))
+
+
+def _governed_get(endpoint, params):
+    bucket = quota_buckets[endpoint]
+    deadline = time.monotonic() + GOOGLE_QUOTA_WAIT
+    while True:
+        with timed("google_quota_wait"):
+            acquired = bucket.acquire(deadline)
+        if not acquired:
+            raise QuotaExceeded(f"Google {endpoint} quota exhausted, try again shortly")
+
+        status = "error"
+        started = time.perf_counter()
+        try:
+            with timed("google"):
+                data = http_get(GOOGLE_ENDPOINTS[endpoint], params=params).json()
+            status = data.get("status", "UNKNOWN")
+        finally:
+            GOOGLE_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+            GOOGLE_REQUESTS.inc(endpoint=endpoint, status=status)
+        if data.get("status") != "OVER_QUERY_LIMIT":
+            return data
+        bucket.pause(GOOGLE_QUOTA_BACKOFF)
+
+
+def get_quota_stats():
+    stats = {name: bucket.stats() for name, bucket in quota_buckets.items()}
+    stats["single_flight"] = _google_flights.stats()
+    return stats
+
+
+def normalize_query(text):
+    return " ".join(text.lower().split())
+
+
 def geocode_city(city: str):
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {"address": city, "key": GOOGLE_API_KEY}
+    cache_key = normalize_query(city)
+    cached = geocode_cache.get(cache_key)
+    if cached is not None:
+        return tuple(cached)
 
-    resp = requests.get(url, params=params)
-    data = resp.json()
+    params = {"address": city, "key": GOOGLE_API_KEY}
+    data = google_get("geocode", params)
 
     if data.get("status") != "OK":
         return None
 
     location = data["results"][0]["geometry"]["location"]
+    geocode_cache.set(cache_key, [location["lat"], location["lng"]])
     return location["lat"], location["lng"]
 
-def fetch_businesses(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None):
-    nearby_url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
 
+def autocomplete_cities(query: str):
+    cache_key = normalize_query(query)
+    if not cache_key:
+        return []
+
+    cached = autocomplete_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # User is still typing: narrow down what we got for an earlier prefix
+    reused = autocomplete_from_prefix(cache_key)
+    if reused is not None:
+        return reused
+
+    params = {
+        "input": query,
+        "types": "(cities)",
+        "key": GOOGLE_API_KEY
+    }
+
+    data = google_get("autocomplete", params)
+
+    predictions = data.get("predictions", [])
+    suggestions = [p["description"] for p in predictions]
+
+    if data.get("status") in ["OK", "ZERO_RESULTS"]:
+        autocomplete_cache.set(cache_key, suggestions)
+    return suggestions
+
+
+def autocomplete_from_prefix(query):
+    for end in range(len(query) - 1, 1, -1):
+        previous = autocomplete_cache.get(query[:end])
+        if previous is None:
+            continue
+
+        # A short list was Google's complete answer, so filtering it is exact
+        # (and the result is complete too). A full list may be truncated:
+        # whatever it's missing could match the longer query, so ask Google.
+        if len(previous) >= AUTOCOMPLETE_MAX_PREDICTIONS:
+            return None
+
+        # Google folds accents and matches aliases ("nyc" -> New York), so
+        # filtering by prefix is only exact if that's how this list matched
+        prefix = query[:end]
+        if not all(normalize_query(s).startswith(prefix) for s in previous):
+            return None
+
+        narrowed = [s for s in previous if normalize_query(s).startswith(query)]
+        # Nothing left could still be a match Google makes some other way
+        if not narrowed:
+            return None
+        autocomplete_cache.set(query, narrowed)
+        return narrowed
+
+    return None
+
+def nearby_search(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None):
+    data = google_get("nearby", nearby_params(lat, lng, place_type, radius, keyword, next_token))
+    return parse_nearby_page(data, next_token)
+
+
+def nearby_params(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None):
     params = {
         "location": f"{lat},{lng}",
         "radius": radius,
@@ -36,10 +237,14 @@ def fetch_businesses(lat, lng, place_type=None, radius=2000, keyword=None, next_
         params["keyword"] = keyword
     if next_token:
         params["pagetoken"]= next_token
+    return params
 
 
-    resp = requests.get(nearby_url, params=params)
-    data = resp.json()
+def parse_nearby_page(data, next_token=None):
+    # (places, next_page_token) from a Nearby Search response
+    # A fresh next_page_token isn't usable for a couple of seconds
+    if next_token and data.get("status") == "INVALID_REQUEST":
+        raise PageTokenNotReady("next_page_token is not active yet")
 
     if data.get("status") not in ["OK", "ZERO_RESULTS"]:
         raise RuntimeError(data.get("error_message", "Google API Error"))
@@ -50,43 +255,257 @@ def fetch_businesses(lat, lng, place_type=None, radius=2000, keyword=None, next_
     results = results[:25]  # Limit to avoid too many API calls
     next_page_token = data.get("next_page_token")  # ⭐ NEW
 
-    final_list = []
+    places = [place for place in results if place.get("place_id")]
+    return places, next_page_token
 
-    for place in results:
-        place_id = place.get("place_id")
-        if not place_id:
-            continue
 
-        details_url = "https://maps.googleapis.com/maps/api/place/details/json"
-        details_params = {
-            "place_id": place_id,
-            "fields": "name,formatted_address,formatted_phone_number,website,"
-                      "rating,user_ratings_total,url,types",
-            "key": GOOGLE_API_KEY,
-        }
+def resolve_businesses(places, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    # Email scraping needs the website, which only Details has
+    if with_emails and profile == "list":
+        profile = "contact"
+
+    # Details lookups run concurrently; map() keeps the Nearby Search order
+    final_list = list(_details_executor.map(propagate(partial(_build_business, profile=profile)), places))
 
-        details_resp = requests.get(details_url, params=details_params)
-        details = details_resp.json().get("result", {})
+    if with_emails:
+        websites = [b["website"] for b in final_list if b["website"]]
+        emails_by_site = extract_emails_from_websites(websites)
+        for b in final_list:
+            if b["website"]:
+                b["emails"] = emails_by_site.get(b["website"], [])
 
-        emails = []
-        # website = details.get("website")
-        # if website:
-        #     emails = extract_emails_from_website(website)
+    return final_list
 
 
-        final_list.append({
-            "name": details.get("name"),
-            "address": details.get("formatted_address"),
-            "phone": details.get("formatted_phone_number"),
-            "rating": details.get("rating"),
-            "reviews_count": details.get("user_ratings_total"),
-            "website": details.get("website"),
-            "maps_url": details.get("url"),
-            "emails":emails,
-            "types": details.get("types", [])
-        })
+def fetch_businesses(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None, with_emails=False,
+                     profile=DEFAULT_DETAILS_PROFILE):
+    places, next_page_token = first_page(lat, lng, place_type, radius, keyword, next_token)
 
     return {
-        "businesses": final_list,
+        "businesses": resolve_businesses(places, with_emails, profile),
         "next_page_token": next_page_token   # ⭐ RETURN IT
-    }
\ No newline at end of file
+    }
+
+
+class PageTokenNotReady(Exception):
+    pass
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def next_page_when_ready(lat, lng, place_type, radius, keyword, token, stop=None, delay=None):
+    # Google activates next_page_token a short while after issuing it. Setting
+    # `stop` while we wait gives up (returns None) without calling Google.
+    stop = stop or threading.Event()
+    if stop.wait(PAGE_TOKEN_DELAY if delay is None else delay):
+        return None
+    for attempt in range(PAGE_TOKEN_RETRIES):
+        try:
+            return nearby_search(lat, lng, place_type, radius, keyword, token)
+        except PageTokenNotReady:
+            if stop.wait(PAGE_TOKEN_RETRY_DELAY):
+                return None
+    raise InvalidPageToken("next_page_token is invalid or expired")
+
+
+def first_page(lat, lng, place_type, radius, keyword, next_token=None):
+    # A token the client brings back may not be active yet either: try it
+    # straight away, then retry it like one of our own
+    if not next_token:
+        return nearby_search(lat, lng, place_type, radius, keyword)
+    return next_page_when_ready(lat, lng, place_type, radius, keyword, next_token, delay=0)
+
+
+def nearby_search_all(lat, lng, place_type=None, radius=2000, keyword=None):
+    # Every page Google will give for one query (at most 60 places)
+    places, token = nearby_search(lat, lng, place_type, radius, keyword)
+    for _ in range(MAX_NEARBY_PAGES - 1):
+        if not token:
+            break
+        more, token = next_page_when_ready(lat, lng, place_type, radius, keyword, token)
+        places.extend(more)
+    return places
+
+
+def _iter_place_pages(lat, lng, place_type, radius, keyword, next_token, max_pages, target_count):
+    # Yields (places, next_page_token) per Nearby Search page. The next page
+    # is fetched in the background while the caller works on the current
+    # one. Places already seen on an earlier page are dropped.
+    seen = set()
+    count = 0
+    stop = threading.Event()
+
+    places, token = first_page(lat, lng, place_type, radius, keyword, next_token)
+
+    try:
+        for page in range(max_pages):
+            more = token and page + 1 < max_pages
+            prefetch = None
+            if more:
+                prefetch = _page_executor.submit(
+                    propagate(next_page_when_ready), lat, lng, place_type, radius, keyword, token, stop
+                )
+
+            places = [p for p in places if p["place_id"] not in seen]
+            seen.update(p["place_id"] for p in places)
+            if target_count is not None and len(places) > target_count - count:
+                # Google's token would skip the rest of this page: no token
+                # rather than one that silently loses places
+                places = places[:max(target_count - count, 0)]
+                token = None
+            count += len(places)
+
+            done = not more or (target_count is not None and count >= target_count)
+            if done:
+                stop.set()
+            yield places, token
+
+            if done:
+                return
+            places, token = prefetch.result()
+    finally:
+        # Also when the consumer closes us early (client went away)
+        stop.set()
+
+
+def iter_business_pages(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                        max_pages=3, target_count=None, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    # Yields {"businesses": [...], "next_page_token": ...} per page
+    for places, token in _iter_place_pages(lat, lng, place_type, radius, keyword, next_token,
+                                           max_pages, target_count):
+        yield {"businesses": resolve_businesses(places, with_emails, profile), "next_page_token": token}
+
+
+def iter_business_events(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                         max_pages=1, target_count=None, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    # Like iter_business_pages, but one event per business as soon as its
+    # Details resolve (in completion order; "index" is its position in the
+    # results). Emails follow per page, then a final "done" summary.
+    if with_emails and profile == "list":
+        profile = "contact"
+
+    index = 0
+    next_page_token = None
+    for places, token in _iter_place_pages(lat, lng, place_type, radius, keyword, next_token,
+                                           max_pages, target_count):
+        futures = {
+            _details_executor.submit(propagate(_build_business), place, profile): index + i
+            for i, place in enumerate(places)
+        }
+        index += len(places)
+        next_page_token = token
+
+        websites = {}
+        try:
+            for future in as_completed(futures):
+                business = future.result()
+                if business["website"]:
+                    websites.setdefault(business["website"], []).append(business["place_id"])
+                yield {"event": "business", "index": futures[future], "business": business}
+        finally:
+            # Client went away: don't resolve Details nobody will see
+            for future in futures:
+                future.cancel()
+
+        if with_emails and websites:
+            emails_by_site = extract_emails_from_websites(list(websites))
+            for website, place_ids in websites.items():
+                for place_id in place_ids:
+                    yield {"event": "emails", "place_id": place_id, "emails": emails_by_site.get(website, [])}
+
+    yield {"event": "done", "count": index, "next_page_token": next_page_token}
+
+
+def fetch_business_pages(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                         max_pages=3, target_count=None, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    merged = []
+    next_page_token = None
+    for page in iter_business_pages(lat, lng, place_type, radius, keyword, next_token,
+                                    max_pages, target_count, with_emails, profile):
+        merged.extend(page["businesses"])
+        next_page_token = page["next_page_token"]
+
+    return {
+        "businesses": merged,
+        "next_page_token": next_page_token
+    }
+
+
+def fetch_place_details(place_id, fields=DETAILS_PROFILES["full"]):
+    cached = cached_place_details(place_id, fields)
+    if cached is not None:
+        return cached
+
+    details_params = {
+        "place_id": place_id,
+        "fields": fields,
+        "key": GOOGLE_API_KEY,
+    }
+
+    details = google_get("details", details_params).get("result", {})
+
+    # Don't cache empty/failed lookups
+    if details:
+        details_cache.set(f"{place_id}|{fields}", details)
+    return details
+
+
+def cached_place_details(place_id, fields):
+    cached = details_cache.get(f"{place_id}|{fields}")
+    if cached is not None:
+        return cached
+
+    # A cached full record answers any narrower request too
+    if fields != DETAILS_PROFILES["full"]:
+        return details_cache.get(f"{place_id}|{DETAILS_PROFILES['full']}")
+    return None
+
+
+def _build_business(place, profile=DEFAULT_DETAILS_PROFILE):
+    fields = DETAILS_PROFILES[profile]
+    details = {}
+    if fields:
+        try:
+            details = fetch_place_details(place["place_id"], fields)
+        except Exception as e:
+            # Only this entry degrades: keep what Nearby Search gave us
+            print("Place details error:", place["place_id"], e)
+    return business_from_details(place, details, profile)
+
+
+def business_from_details(place, place_details, profile):
+    # What Nearby Search gave us; Details fields take precedence
+    details = {
+        "name": place.get("name"),
+        "formatted_address": place.get("vicinity"),
+        "rating": place.get("rating"),
+        "user_ratings_total": place.get("user_ratings_total"),
+        "types": place.get("types", []),
+        "url": f"https://www.google.com/maps/place/?q=place_id:{place['place_id']}",
+    }
+
+    details.update(place_details)
+
+    location = place.get("geometry", {}).get("location", {})
+    return {
+        "place_id": place["place_id"],
+        "name": details.get("name"),
+        "address": details.get("formatted_address"),
+        "phone": details.get("formatted_phone_number"),
+        "rating": details.get("rating"),
+        "reviews_count": details.get("user_ratings_total"),
+        "website": details.get("website"),
+        "maps_url": details.get("url"),
+        "emails": [],
+        "types": details.get("types", []),
+        "lat": location.get("lat"),
+        "lng": location.get("lng"),
+        "profile": profile
+    }
+
+
+def hydrate_businesses(place_ids, profile="full", with_emails=False):
+    # Fill in a list-view result later, only for the places the client opens
+    return resolve_businesses([{"place_id": pid} for pid in place_ids], with_emails, profile)
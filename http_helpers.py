@@ -0,0 +1,74 @@
+import os
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# (connect, read) seconds, used when a caller doesn't pass its own timeout
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+
+# Keep-alive connections kept per host, and max requests in flight per host
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", 16))
+
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.3))
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+
+def _build_session(retries):
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "HEAD"],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+
+# Google APIs are worth retrying; random business websites mostly aren't
+_sessions = {
+    "api": _build_session(HTTP_RETRIES),
+    "scrape": _build_session(0),
+}
+
+_host_limits_lock = threading.Lock()
+_host_limits = {}
+
+
+def _host_semaphore(url):
+    host = urlsplit(url).netloc.lower()
+    with _host_limits_lock:
+        sem = _host_limits.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+            _host_limits[host] = sem
+    return sem
+
+
+def http_get(url, params=None, timeout=None, kind="api", **kwargs):
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+    with _host_semaphore(url):
+        return _sessions[kind].get(url, params=params, timeout=timeout, **kwargs)
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from db_extentions import db_connection, db_cursor
+from common_helpers import extract_emails_from_websites
+
+load_dotenv()
+
+# Jobs running at once per process; each one scrapes a batch of sites at a time
+JOB_WORKERS = int(os.getenv("SCRAPE_JOB_WORKERS", 4))
+JOB_BATCH_SIZE = int(os.getenv("SCRAPE_JOB_BATCH_SIZE", 8))
+JOB_MAX_WEBSITES = int(os.getenv("SCRAPE_JOB_MAX_WEBSITES", 500))
+
+# Live jobs (queued or running) get their updated_at touched every
+# JOB_HEARTBEAT seconds; one untouched for JOB_STALE_AFTER lost its process
+# and the next sweep (in any process) takes it over
+JOB_HEARTBEAT = float(os.getenv("SCRAPE_JOB_HEARTBEAT", 30))
+JOB_STALE_AFTER = float(os.getenv("SCRAPE_JOB_STALE_AFTER", 120))
+
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="scrape-job")
+
+_active_lock = threading.Lock()
+_active_jobs = set()
+_sweeper_started = False
+
+
+def submit_scrape_job(websites, user_id=None):
+    # Dedupe but keep the order the client sent
+    websites = list(dict.fromkeys(w for w in websites if w))
+    if not websites:
+        raise ValueError("No websites provided")
+    if len(websites) > JOB_MAX_WEBSITES:
+        raise ValueError(f"At most {JOB_MAX_WEBSITES} websites per job")
+
+    job_id = uuid.uuid4().hex
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO scrape_jobs (id, user_id, status, websites, total)
+            VALUES (%s, %s, 'queued', %s, %s)
+        """, (job_id, user_id, json.dumps(websites), len(websites)))
+        conn.commit()
+
+    _start_job(job_id, websites)
+    return job_id
+
+
+def get_scrape_job(job_id):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT id, user_id, status, total, completed, results, error, created_at, updated_at
+            FROM scrape_jobs WHERE id = %s
+        """, (job_id,))
+        return cur.fetchone()
+
+
+def start_scrape_job_sweeper():
+    global _sweeper_started
+    with _active_lock:
+        if _sweeper_started:
+            return
+        _sweeper_started = True
+
+    threading.Thread(target=_sweep_loop, name="scrape-job-sweeper", daemon=True).start()
+
+
+def recover_scrape_jobs():
+    # Take over jobs whose process is gone and finish the sites they hadn't
+    # done yet. Each job is claimed by one process only.
+    try:
+        with db_cursor(commit=True) as cur:
+            cur.execute("""
+                UPDATE scrape_jobs SET status = 'queued', updated_at = NOW()
+                WHERE status IN ('queued', 'running')
+                  AND updated_at < NOW() - make_interval(secs => %s)
+                RETURNING id, websites, results
+            """, (JOB_STALE_AFTER,))
+            jobs = cur.fetchall()
+    except Exception as e:
+        print("Scrape job recovery error:", e)
+        return
+
+    for job in jobs:
+        print("Resuming scrape job:", job["id"])
+        _start_job(job["id"], [w for w in job["websites"] if w not in job["results"]])
+
+
+def _start_job(job_id, websites):
+    with _active_lock:
+        _active_jobs.add(job_id)
+    start_scrape_job_sweeper()
+    _job_executor.submit(_run_scrape_job, job_id, websites)
+
+
+def _sweep_loop():
+    while True:
+        _touch_active_jobs()
+        recover_scrape_jobs()
+        time.sleep(JOB_HEARTBEAT)
+
+
+def _touch_active_jobs():
+    with _active_lock:
+        job_ids = list(_active_jobs)
+    if not job_ids:
+        return
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE scrape_jobs SET updated_at = NOW()
+                WHERE id = ANY(%s) AND status IN ('queued', 'running')
+            """, (job_ids,))
+            conn.commit()
+    except Exception as e:
+        print("Scrape job heartbeat error:", e)
+
+
+def _run_scrape_job(job_id, websites):
+    try:
+        # Deleted (or finished elsewhere) while it sat in the queue
+        if not _update_job(job_id, "running"):
+            return
+
+        for i in range(0, len(websites), JOB_BATCH_SIZE):
+            batch = websites[i:i + JOB_BATCH_SIZE]
+            results = extract_emails_from_websites(batch)
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    UPDATE scrape_jobs
+                    SET results = results || %s::jsonb,
+                        completed = completed + %s,
+                        updated_at = NOW()
+                    WHERE id = %s AND status = 'running'
+                """, (json.dumps(results), len(batch), job_id))
+                conn.commit()
+                if not cur.rowcount:
+                    return
+
+        _update_job(job_id, "done")
+
+    except Exception as e:
+        print("Scrape job error:", job_id, e)
+        _update_job(job_id, "failed", str(e))
+
+    finally:
+        with _active_lock:
+            _active_jobs.discard(job_id)
+
+
+def _update_job(job_id, status, error=None):
+    # Only moves jobs that are still live; False if the job was already
+    # finished, failed or deleted
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE scrape_jobs SET status = %s, error = %s, updated_at = NOW()
+            WHERE id = %s AND status IN ('queued', 'running')
+        """, (status, error, job_id))
+        conn.commit()
+        return cur.rowcount > 0
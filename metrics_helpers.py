@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One JSON line per request with its phase breakdown
+REQUEST_LOG = os.getenv("REQUEST_LOG", "1") not in ("0", "false")
+# Bearer token required on /metrics; leave unset to keep it open (e.g. behind a private port)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Sampling profiler, per request with ?_profile=1 or an X-Profile: 1 header
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") not in ("0", "false")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Phases a request's time is broken into. Work done on executor threads
+# (Details lookups, page prefetches) counts towards the request that
+# submitted it, and phases nest (a scrape reads the cache from the db), so
+# they can add up to more than the wall time.
+PHASES = ("db_wait", "db", "google", "google_quota_wait", "scrape", "serialize")
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}   # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+_registry = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "Requests handled, by endpoint and status")
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Request wall time including streaming")
+PHASE_DURATION = Histogram("http_request_phase_seconds", "Time per request spent in each phase")
+GOOGLE_REQUESTS = Counter("google_requests_total", "Outbound Maps API calls, by endpoint and status")
+GOOGLE_DURATION = Histogram("google_request_duration_seconds", "Outbound Maps API call latency")
+SCRAPE_PAGES = Counter("scrape_pages_total", "Website pages fetched for email scraping, by result")
+SCRAPE_DURATION = Histogram("scrape_page_duration_seconds", "Website page fetch + parse time")
+
+
+def render_metrics(gauges=()):
+    # Prometheus text format. gauges: [(name, description, [(labels_dict, value)])]
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, description, samples in gauges:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+
+_current_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(phase):
+    # Adds the block's duration to the current request's phase (if any)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(phase, time.perf_counter() - started)
+
+
+def propagate(fn):
+    # Executor threads don't inherit the request's context: carry the
+    # timings over so their work is counted against the right request
+    timings = _current_timings.get()
+    if timings is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current_timings.set(timings)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_timings.reset(token)
+    return run
+
+
+def finish_request(timings, method, endpoint, status):
+    elapsed = time.perf_counter() - timings.started
+    HTTP_REQUESTS.inc(method=method, endpoint=endpoint, status=status)
+    HTTP_DURATION.observe(elapsed, endpoint=endpoint)
+    for phase, seconds in timings.phases.items():
+        PHASE_DURATION.observe(seconds, endpoint=endpoint, phase=phase)
+
+    if REQUEST_LOG:
+        print(json.dumps({
+            "method": method,
+            "endpoint": endpoint,
+            "status": status,
+            "ms": round(elapsed * 1000, 1),
+            "phases_ms": {p: round(s * 1000, 1) for p, s in timings.phases.items()},
+        }), flush=True)
+
+
+def server_timing_header(timings):
+    parts = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.phases.items()]
+    parts.append(f"total;dur={(time.perf_counter() - timings.started) * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack every `interval` seconds; collapsed-stack output."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, name):
+        # flamegraph.pl / speedscope compatible "stack count" lines
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{self.thread_id}.folded")
+        with open(path, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def instrument_app(app):
+    # Per-request timings, Server-Timing header, request metrics and the
+    # opt-in profiler for a Flask app
+    from flask import g, request
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            with timed("serialize"):
+                return super().dumps(obj, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timings():
+        g.request_timings = start_request_timings()
+        g.profiler = None
+        if PROFILING_ENABLED and (request.args.get("_profile") == "1" or request.headers.get("X-Profile") == "1"):
+            g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+    @app.after_request
+    def _finish_timings(response):
+        timings = g.get("request_timings")
+        if timings is None:
+            return response
+        # Streamed bodies are still to come; for those the header only covers setup
+        response.headers["Server-Timing"] = server_timing_header(timings)
+
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        method = request.method
+        status = response.status_code
+        profiler = g.get("profiler")
+
+        def on_close():
+            finish_request(timings, method, endpoint, status)
+            if profiler is not None:
+                profiler.stop()
+                print("Profile written to", profiler.write(endpoint.strip("/").replace("/", "_") or "root"))
+
+        response.call_on_close(on_close)
+        return response
@@ -0,0 +1,44 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+# bcrypt is slow on purpose; run it in worker processes so a burst of
+# signups/logins doesn't hold the GIL and stall every other request
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", os.cpu_count() or 2))
+PASSWORD_TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", 10))
+
+_pool = None
+_pool_pid = None
+
+
+def _hash(password):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    # One pool per gunicorn worker; "spawn" so children don't inherit our threads/sockets
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def hash_password(password):
+    return _get_pool().submit(_hash, password).result(timeout=PASSWORD_TIMEOUT)
+
+
+def verify_password(password, hashed):
+    try:
+        return _get_pool().submit(_check, password, hashed).result(timeout=PASSWORD_TIMEOUT)
+    except ValueError:
+        # Stored value isn't a bcrypt hash
+        return False
@@ -0,0 +1,468 @@
+import os
+import json
+import math
+import base64
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from db_extentions import db_connection, db_cursor
+from common_helpers import extract_emails_from_websites
+from google_helpers import nearby_search_all, resolve_businesses, normalize_query
+from google_helpers import fetch_businesses, fetch_business_pages, DEFAULT_DETAILS_PROFILE
+from scan_helpers import distance_m, TILE_RESULT_CAP, NEARBY_PAGE_SIZE
+
+load_dotenv()
+
+# Businesses we've already paid Google for, kept in Postgres (places /
+# place_tiles tables). A tile is one geohash cell searched for one
+# type + keyword; while it's fresh, queries inside it never go to Google.
+PLACE_INDEX_ENABLED = os.getenv("PLACE_INDEX_ENABLED", "1") not in ("0", "false")
+PLACE_INDEX_TTL = int(os.getenv("PLACE_INDEX_TTL", 60*60*24*7))
+# A query touching more tiles than this, or needing more refreshed, goes straight to Google
+PLACE_INDEX_MAX_TILES = int(os.getenv("PLACE_INDEX_MAX_TILES", 12))
+PLACE_INDEX_MAX_STALE = int(os.getenv("PLACE_INDEX_MAX_STALE", 4))
+# Missing tiles are searched in the background, after the request that found
+# them missing has been answered from Google
+PLACE_INDEX_REFRESH_WORKERS = int(os.getenv("PLACE_INDEX_REFRESH_WORKERS", 2))
+# A saturated tile (Google's 60 result cap) is split into its geohash children
+# down to TILE_PRECISION_MAX, like a scan splits a full tile. A query reads at
+# most this many tiles after splitting, and one refresh searches at most this many.
+PLACE_INDEX_MAX_SPLIT_TILES = int(os.getenv("PLACE_INDEX_MAX_SPLIT_TILES", 48))
+
+# Precision 5 cells are ~4.9km wide, precision 6 ~1.2 x 0.6km, precision 7 ~150m
+TILE_PRECISION_LARGE = 5
+TILE_PRECISION_SMALL = 6
+TILE_PRECISION_MAX = 7
+PLACE_GEOHASH_PRECISION = 9
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+LOCAL_TOKEN_PREFIX = "local:"
+
+PLACE_COLUMNS = ["place_id", "name", "address", "phone", "rating", "reviews_count",
+                 "website", "maps_url", "types", "lat", "lng"]
+
+_refresh_executor = ThreadPoolExecutor(max_workers=PLACE_INDEX_REFRESH_WORKERS, thread_name_prefix="place-tiles")
+_refreshing_lock = threading.Lock()
+_refreshing = set()   # (geohash, place_type, keyword) queued or being searched
+
+
+def geohash_encode(lat, lng, precision):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def _cell_size(precision):
+    # (height, width) of a geohash cell in degrees
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_cells(lat, lng, radius, precision):
+    # Geohash cells that intersect the circle, as
+    # [(geohash, centre_lat, centre_lng, search_radius)]
+    cell_h, cell_w = _cell_size(precision)
+    dlat = radius / 111320
+    dlng = radius / (111320 * max(math.cos(math.radians(lat)), 1e-6))
+
+    cells = []
+    row = math.floor((lat - dlat + 90) / cell_h)
+    while row * cell_h - 90 <= lat + dlat:
+        south = row * cell_h - 90
+        col = math.floor((lng - dlng + 180) / cell_w)
+        while col * cell_w - 180 <= lng + dlng:
+            west = col * cell_w - 180
+            # Closest point of the cell to the centre decides whether it's needed
+            near_lat = min(max(lat, south), south + cell_h)
+            near_lng = min(max(lng, west), west + cell_w)
+            if distance_m(lat, lng, near_lat, near_lng) <= radius:
+                c_lat, c_lng = south + cell_h / 2, west + cell_w / 2
+                cells.append((
+                    geohash_encode(c_lat, c_lng, precision),
+                    c_lat,
+                    c_lng,
+                    math.ceil(distance_m(c_lat, c_lng, south, west)),
+                ))
+            col += 1
+        row += 1
+    return cells
+
+
+def tile_precision(radius):
+    return TILE_PRECISION_SMALL if radius <= 600 else TILE_PRECISION_LARGE
+
+
+def split_cell(cell, lat, lng, radius):
+    # Children (one precision finer) of a cell that intersect the circle
+    geohash = cell[0]
+    return [c for c in covering_cells(lat, lng, radius, len(geohash) + 1) if c[0].startswith(geohash)]
+
+
+def cell_inside_circle(cell, lat, lng, radius):
+    # Every corner of the cell within the circle
+    geohash, c_lat, c_lng, _ = cell
+    cell_h, cell_w = _cell_size(len(geohash))
+    return all(
+        distance_m(lat, lng, c_lat + dy * cell_h / 2, c_lng + dx * cell_w / 2) <= radius
+        for dy in (-1, 1) for dx in (-1, 1)
+    )
+
+
+def is_complete_answer(result, limit):
+    # Everything Google has for the circle: no more pages, under the 60 cap,
+    # not cut short by the caller's limit, and with Details (list-profile
+    # results would be served later without contact fields)
+    businesses = result["businesses"]
+    return (not result["next_page_token"] and len(businesses) < TILE_RESULT_CAP
+            and (limit is None or len(businesses) < limit)
+            and all(b.get("profile") != "list" for b in businesses))
+
+
+def split_saturated(cells, tiles, lat, lng, radius):
+    # One level of walking the tiles of a circle: (tiles that answer, cells
+    # not searched yet, children of saturated tiles to look at next), or None
+    # when a tile is saturated even at TILE_PRECISION_MAX
+    found, stale, children = [], [], []
+    for cell in cells:
+        tile = tiles.get(cell[0])
+        if tile is None:
+            stale.append(cell)
+        elif not tile["saturated"]:
+            found.append(tile)
+        elif len(cell[0]) >= TILE_PRECISION_MAX:
+            return None
+        else:
+            children.extend(split_cell(cell, lat, lng, radius))
+    return found, stale, children
+
+
+def stale_parents(stale, radius):
+    # Tiles of the circle's own precision that need refreshing; the children
+    # of a split tile count as their parent
+    return {c[0][:tile_precision(radius)] for c in stale}
+
+
+def tiles_from_results(cells, lat, lng, radius, businesses):
+    # Tiles we can fill from a complete circle search: any cell wholly inside
+    # the circle holds exactly the results that fall in it
+    tiles = []
+    for cell in cells:
+        if not cell_inside_circle(cell, lat, lng, radius):
+            continue
+        geohash = cell[0]
+        place_ids = [
+            b["place_id"] for b in businesses
+            if b.get("lat") is not None and b.get("lng") is not None
+            and geohash_encode(b["lat"], b["lng"], len(geohash)) == geohash
+        ]
+        tiles.append((cell, place_ids))
+    return tiles
+
+
+def _get_tiles(cells, place_type, keyword):
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT geohash, place_ids, saturated
+            FROM place_tiles
+            WHERE geohash = ANY(%s) AND place_type = %s AND keyword = %s
+              AND searched_at > NOW() - make_interval(secs => %s)
+        """, ([c[0] for c in cells], place_type, keyword, PLACE_INDEX_TTL))
+        return {row["geohash"]: row for row in cur.fetchall()}
+
+
+def _resolve_tiles(cells, place_type, keyword, lat, lng, radius):
+    # (tiles that answer the circle, cells not searched yet), following
+    # saturated tiles down into their children; None if it can't be answered
+    found, stale = [], []
+    while cells:
+        level = split_saturated(cells, _get_tiles(cells, place_type, keyword), lat, lng, radius)
+        if level is None:
+            return None
+        found += level[0]
+        stale += level[1]
+        cells = level[2]
+        if len(found) + len(stale) + len(cells) > PLACE_INDEX_MAX_SPLIT_TILES:
+            return None
+    return found, stale
+
+
+def _fresh_place_ids(place_ids):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT place_id FROM places
+            WHERE place_id = ANY(%s) AND hydrated AND updated_at > NOW() - make_interval(secs => %s)
+        """, (list(place_ids), PLACE_INDEX_TTL))
+        return {row[0] for row in cur.fetchall()}
+
+
+def place_rows(businesses):
+    # places table rows (PLACE_COLUMNS, geohash, hydrated) for resolved
+    # businesses with place_id and coordinates. A list-profile result never
+    # had Details fetched, so its missing phone/website mean "unknown".
+    return [
+        [b.get(col) for col in PLACE_COLUMNS]
+        + [geohash_encode(b["lat"], b["lng"], PLACE_GEOHASH_PRECISION), b.get("profile") != "list"]
+        for b in businesses
+        if b.get("place_id") and b.get("lat") is not None and b.get("lng") is not None
+    ]
+
+
+# A list-profile result has no phone/website; keep what we know
+PLACE_UPSERT_CONFLICT = f"""
+    ON CONFLICT (place_id) DO UPDATE SET
+        {", ".join(f"{col} = COALESCE(EXCLUDED.{col}, places.{col})" for col in PLACE_COLUMNS[1:])},
+        geohash = EXCLUDED.geohash,
+        hydrated = places.hydrated OR EXCLUDED.hydrated,
+        updated_at = NOW()
+"""
+
+
+def store_places(businesses):
+    # Upsert resolved businesses into the index
+    rows = place_rows(businesses)
+    if not rows:
+        return
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        execute_values(cur, f"""
+            INSERT INTO places ({", ".join(PLACE_COLUMNS)}, geohash, hydrated)
+            VALUES %s
+        """ + PLACE_UPSERT_CONFLICT, rows)
+        conn.commit()
+
+
+def _store_tile(geohash, place_type, keyword, place_ids, saturated):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO place_tiles (geohash, place_type, keyword, place_ids, saturated, searched_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (geohash, place_type, keyword) DO UPDATE SET
+                place_ids = EXCLUDED.place_ids,
+                saturated = EXCLUDED.saturated,
+                searched_at = NOW()
+        """, (geohash, place_type, keyword, place_ids, saturated))
+        conn.commit()
+
+
+def _refresh_tile(cell, place_type, keyword):
+    geohash, c_lat, c_lng, search_radius = cell
+    places = nearby_search_all(c_lat, c_lng, place_type or None, search_radius, keyword or None)
+
+    place_ids = list(dict.fromkeys(p["place_id"] for p in places))
+    saturated = len(places) >= TILE_RESULT_CAP
+    if not saturated:
+        # Only pay for Details on places we don't already know. A saturated
+        # tile is answered by its children, so its places aren't worth resolving.
+        known = _fresh_place_ids(place_ids)
+        store_places(resolve_businesses([p for p in places if p["place_id"] not in known]))
+
+    _store_tile(geohash, place_type, keyword, place_ids, saturated)
+    return {"geohash": geohash, "place_ids": place_ids, "saturated": saturated}
+
+
+def schedule_tile_refresh(cells, place_type, keyword, lat, lng, radius):
+    # Search missing tiles of the circle in the background, skipping ones already queued
+    with _refreshing_lock:
+        cells = [c for c in cells if (c[0], place_type, keyword) not in _refreshing]
+        _refreshing.update((c[0], place_type, keyword) for c in cells)
+    if cells:
+        _refresh_executor.submit(_refresh_tiles, cells, place_type, keyword, lat, lng, radius)
+
+
+def _refresh_tiles(cells, place_type, keyword, lat, lng, radius):
+    try:
+        queue = deque(cells)
+        searched = 0
+        while queue and searched < PLACE_INDEX_MAX_SPLIT_TILES:
+            cell = queue.popleft()
+            searched += 1
+            if not _refresh_tile(cell, place_type, keyword)["saturated"]:
+                continue
+            # Saturated at the finest precision: the query can't be answered
+            # locally, so don't pay for the rest of its tiles
+            if len(cell[0]) >= TILE_PRECISION_MAX:
+                break
+            queue.extend(split_cell(cell, lat, lng, radius))
+    except Exception as e:
+        print("Place tile refresh error:", e)
+    finally:
+        with _refreshing_lock:
+            _refreshing.difference_update((c[0], place_type, keyword) for c in cells)
+
+
+def _load_places(place_ids, cells, lat, lng, radius):
+    # Tiles overhang the circle: the geohash prefixes narrow it to the
+    # covering cells, the distance check does the rest
+    with db_cursor() as cur:
+        cur.execute(f"""
+            SELECT {", ".join(PLACE_COLUMNS)}, hydrated FROM places
+            WHERE place_id = ANY(%s) AND geohash LIKE ANY(%s)
+            ORDER BY reviews_count DESC NULLS LAST, place_id
+        """, (list(place_ids), [c[0] + "%" for c in cells]))
+        rows = cur.fetchall()
+    return places_in_radius(rows, lat, lng, radius)
+
+
+def places_in_radius(rows, lat, lng, radius):
+    # places rows -> businesses, dropping the ones outside the circle
+    businesses = []
+    for row in rows:
+        if distance_m(lat, lng, row["lat"], row["lng"]) > radius:
+            continue
+        row["emails"] = []
+        row["types"] = row["types"] or []
+        row["profile"] = "full" if row.pop("hydrated") else "list"
+        businesses.append(row)
+    return businesses
+
+
+def local_page_slice(businesses, query, offset, count):
+    # (page, next_page_token) of an index answer
+    page = businesses[offset:offset + count]
+    next_page_token = None
+    if offset + count < len(businesses):
+        next_page_token = encode_local_token(dict(query, offset=offset + count, count=count))
+    return page, next_page_token
+
+
+def _local_page(businesses, query, offset, count, with_emails):
+    page, next_page_token = local_page_slice(businesses, query, offset, count)
+
+    if with_emails:
+        websites = [b["website"] for b in page if b["website"]]
+        emails_by_site = extract_emails_from_websites(websites)
+        for b in page:
+            if b["website"]:
+                b["emails"] = emails_by_site.get(b["website"], [])
+
+    return {"businesses": page, "next_page_token": next_page_token}
+
+
+def encode_local_token(query):
+    raw = json.dumps(query, separators=(",", ":")).encode("utf-8")
+    return LOCAL_TOKEN_PREFIX + base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_local_token(token):
+    # (query, offset, count)
+    query = json.loads(base64.urlsafe_b64decode(token[len(LOCAL_TOKEN_PREFIX):]))
+    return query, query.pop("offset"), query.pop("count")
+
+
+def is_local_token(token):
+    return bool(token) and token.startswith(LOCAL_TOKEN_PREFIX)
+
+
+def search_index(lat, lng, place_type=None, radius=2000, keyword=None, count=NEARBY_PAGE_SIZE,
+                 with_emails=False):
+    # Same shape as fetch_businesses, answered from the index, as
+    # (result, stale cells). result is None when the area can't be answered
+    # locally: too big, saturated even when split finely (the tiles would hide
+    # places Google returns for the exact circle), or tiles not searched yet
+    # (the stale cells).
+    place_type = place_type or ""
+    keyword = normalize_query(keyword or "")
+
+    cells = covering_cells(lat, lng, radius, tile_precision(radius))
+    if not cells or len(cells) > PLACE_INDEX_MAX_TILES:
+        return None, []
+
+    resolved = _resolve_tiles(cells, place_type, keyword, lat, lng, radius)
+    if resolved is None:
+        return None, []
+
+    tiles, stale = resolved
+    if stale:
+        return None, stale
+
+    place_ids = {pid for t in tiles for pid in t["place_ids"]}
+    businesses = _load_places(place_ids, cells, lat, lng, radius)
+
+    query = {"lat": lat, "lng": lng, "type": place_type, "radius": radius, "keyword": keyword}
+    return _local_page(businesses, query, 0, count, with_emails), []
+
+
+def search_index_page(token, with_emails=False):
+    # Next page of an earlier search_index answer
+    query, offset, count = decode_local_token(token)
+
+    cells = covering_cells(query["lat"], query["lng"], query["radius"], tile_precision(query["radius"]))
+    tiles, _ = _resolve_tiles(cells, query["type"], query["keyword"],
+                              query["lat"], query["lng"], query["radius"]) or ([], [])
+    place_ids = {pid for t in tiles for pid in t["place_ids"]}
+    businesses = _load_places(place_ids, cells, query["lat"], query["lng"], query["radius"])
+
+    return _local_page(businesses, query, offset, count, with_emails)
+
+
+def fetch_businesses_indexed(lat, lng, place_type=None, radius=2000, keyword=None, next_token=None,
+                             pages=1, limit=None, with_emails=False, profile=DEFAULT_DETAILS_PROFILE):
+    # /api/businesses: the index when it can answer, Google otherwise (and
+    # whatever Google returns goes into the index for next time)
+    if is_local_token(next_token):
+        return search_index_page(next_token, with_emails)
+
+    stale = []
+    if PLACE_INDEX_ENABLED and not next_token:
+        try:
+            result, stale = search_index(lat, lng, place_type, radius, keyword,
+                                         limit or pages * NEARBY_PAGE_SIZE, with_emails)
+        except Exception as e:
+            print("Place index error:", e)
+            result = None
+        if result is not None:
+            return result
+
+    if pages > 1:
+        result = fetch_business_pages(lat, lng, place_type, radius, keyword, next_token,
+                                      pages, limit, with_emails, profile)
+    else:
+        result = fetch_businesses(lat, lng, place_type, radius, keyword, next_token, with_emails, profile)
+
+    if PLACE_INDEX_ENABLED:
+        try:
+            store_places(result["businesses"])
+            stale = _fill_tiles(stale, lat, lng, radius, place_type, keyword, limit, result)
+            if len(stale_parents(stale, radius)) <= PLACE_INDEX_MAX_STALE:
+                schedule_tile_refresh(stale, place_type or "", normalize_query(keyword or ""), lat, lng, radius)
+        except Exception as e:
+            print("Place index error:", e)
+    return result
+
+
+def _fill_tiles(stale, lat, lng, radius, place_type, keyword, limit, result):
+    # Store the stale tiles this answer covers completely; returns the rest
+    if not stale or not is_complete_answer(result, limit):
+        return stale
+
+    filled = set()
+    for cell, place_ids in tiles_from_results(stale, lat, lng, radius, result["businesses"]):
+        _store_tile(cell[0], place_type or "", normalize_query(keyword or ""), place_ids, False)
+        filled.add(cell[0])
+    return [c for c in stale if c[0] not in filled]
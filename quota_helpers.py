@@ -0,0 +1,149 @@
+import time
+import asyncio
+import threading
+
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    """Allows `rate` calls a second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.timeouts = 0
+
+    def acquire(self, deadline):
+        # Blocks until a token is free; False if that would be past the
+        # (time.monotonic()) deadline
+        waited = False
+        while True:
+            wait = self._try_take(deadline, waited)
+            if wait is None or wait is False:
+                return wait is None
+            waited = True
+            time.sleep(wait)
+
+    async def acquire_async(self, deadline):
+        # acquire() for the event loop: waits without blocking it
+        waited = False
+        while True:
+            wait = self._try_take(deadline, waited)
+            if wait is None or wait is False:
+                return wait is None
+            waited = True
+            await asyncio.sleep(wait)
+
+    def _try_take(self, deadline, waited):
+        # None: got a token. False: can't get one before the deadline.
+        # Otherwise the seconds to wait before trying again.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return None
+
+            wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if not waited:
+                self.waits += 1
+            if now + wait > deadline:
+                self.timeouts += 1
+                return False
+            return wait
+
+    def pause(self, seconds):
+        # Upstream said we're over quota: nobody goes until it has cooled off
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def stats(self):
+        with self._lock:
+            return {"rate": self.rate, "burst": self.burst, "waits": self.waits, "timeouts": self.timeouts}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution and its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines; one per event loop."""
+
+    def __init__(self):
+        self._flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            # shield: a follower giving up must not cancel the leader's call
+            return await asyncio.shield(flight)
+
+        self.calls += 1
+        flight = self._flights[key] = asyncio.ensure_future(fn())
+        try:
+            return await asyncio.shield(flight)
+        finally:
+            if flight.done():
+                del self._flights[key]
+            else:
+                # Leader went away mid-call; whoever is left still gets the result
+                flight.add_done_callback(lambda _: self._flights.pop(key, None))
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
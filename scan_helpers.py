@@ -0,0 +1,155 @@
+import os
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from metrics_helpers import propagate
+from google_helpers import nearby_search_all, resolve_businesses, MAX_NEARBY_PAGES, DEFAULT_DETAILS_PROFILE
+
+load_dotenv()
+
+# Nearby Search gives at most 20 results a page, 60 a query. A tile that
+# comes back full probably had more, so it gets split into smaller tiles.
+NEARBY_PAGE_SIZE = 20
+TILE_RESULT_CAP = NEARBY_PAGE_SIZE * MAX_NEARBY_PAGES
+
+# Tiles searched at once per process, across all scans
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", 6))
+# Hard caps so a single scan can't burn unbounded API quota
+SCAN_MAX_TILES = int(os.getenv("SCAN_MAX_TILES", 150))
+SCAN_MAX_PLACES = int(os.getenv("SCAN_MAX_PLACES", 1000))
+SCAN_MAX_RADIUS = 50000   # Nearby Search's own limit
+SCAN_MIN_TILE_RADIUS = int(os.getenv("SCAN_MIN_TILE_RADIUS", 250))
+SCAN_MAX_DEPTH = int(os.getenv("SCAN_MAX_DEPTH", 3))
+
+METERS_PER_DEGREE = 111320
+
+_scan_executor = ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="area-scan")
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    # Haversine, good enough at city scale
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def hex_tiles(lat, lng, radius, tile_radius):
+    # Centres of circles of tile_radius on a hex lattice that together cover
+    # the circle (lat, lng, radius). Returns [(lat, lng, tile_radius)].
+    if tile_radius >= radius:
+        return [(lat, lng, radius)]
+
+    col_step = tile_radius * math.sqrt(3)
+    row_step = tile_radius * 1.5
+    reach = radius + tile_radius
+    rows = int(math.ceil(reach / row_step))
+    cols = int(math.ceil(reach / col_step)) + 1
+    lng_scale = METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6)
+
+    tiles = []
+    for row in range(-rows, rows + 1):
+        dy = row * row_step
+        offset = col_step / 2 if row % 2 else 0
+        for col in range(-cols, cols + 1):
+            dx = col * col_step + offset
+            # Every point of the circle is within tile_radius of its nearest
+            # lattice centre, so centres further out than this are never needed
+            if math.hypot(dx, dy) < reach:
+                tiles.append((lat + dy / METERS_PER_DEGREE, lng + dx / lng_scale, tile_radius))
+    return tiles
+
+
+def iter_area_scan(lat, lng, radius, place_type=None, keyword=None, limit=None, with_emails=False,
+                   profile=DEFAULT_DETAILS_PROFILE):
+    # Yields {"event": "progress", ...} as tiles finish, then one
+    # {"event": "done", "businesses": [...], ...} with the deduped result.
+    radius = min(radius, SCAN_MAX_RADIUS)
+    limit = min(limit or SCAN_MAX_PLACES, SCAN_MAX_PLACES)
+
+    # Start coarse and only go finer where a tile turns out to be saturated
+    tile_radius = max(radius / 2, SCAN_MIN_TILE_RADIUS)
+    queue = deque((tile, 0) for tile in hex_tiles(lat, lng, radius, tile_radius))
+
+    found = {}          # place_id -> Nearby Search result
+    pending = {}        # future -> (tile, depth)
+    scheduled = len(queue)
+    done = 0
+    failed = 0
+    truncated = False
+
+    try:
+        while queue or pending:
+            while queue and len(pending) < SCAN_CONCURRENCY:
+                tile, depth = queue.popleft()
+                future = _scan_executor.submit(propagate(nearby_search_all), *tile, place_type, keyword)
+                pending[future] = (tile, depth)
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tile, depth = pending.pop(future)
+                done += 1
+                try:
+                    places = future.result()
+                except Exception as e:
+                    print("Scan tile error:", tile, e)
+                    failed += 1
+                    continue
+
+                for place in places:
+                    if place["place_id"] in found:
+                        continue
+                    location = place.get("geometry", {}).get("location")
+                    # Tiles overhang the scan circle; drop what falls outside it
+                    if location and distance_m(lat, lng, location["lat"], location["lng"]) > radius:
+                        continue
+                    found[place["place_id"]] = place
+
+                if len(places) >= TILE_RESULT_CAP:
+                    child_radius = tile[2] / 2
+                    if depth >= SCAN_MAX_DEPTH or child_radius < SCAN_MIN_TILE_RADIUS:
+                        truncated = True
+                        continue
+                    children = hex_tiles(tile[0], tile[1], tile[2], child_radius)
+                    if scheduled + len(children) > SCAN_MAX_TILES:
+                        truncated = True
+                        continue
+                    scheduled += len(children)
+                    queue.extend((child, depth + 1) for child in children)
+
+            yield {
+                "event": "progress",
+                "tiles_done": done,
+                "tiles_total": scheduled,
+                "tiles_failed": failed,
+                "places_found": len(found),
+            }
+    finally:
+        # Client went away (or we blew up): don't keep searching for nobody
+        for future in pending:
+            future.cancel()
+
+    places = list(found.values())
+    if len(places) > limit:
+        places = places[:limit]
+        truncated = True
+
+    yield {
+        "event": "done",
+        "businesses": resolve_businesses(places, with_emails, profile),
+        "tiles_scanned": done,
+        "tiles_failed": failed,
+        "truncated": truncated,
+    }
+
+
+def scan_area(lat, lng, radius, place_type=None, keyword=None, limit=None, with_emails=False,
+              profile=DEFAULT_DETAILS_PROFILE, on_progress=None):
+    for event in iter_area_scan(lat, lng, radius, place_type, keyword, limit, with_emails, profile):
+        if event["event"] == "done":
+            del event["event"]
+            return event
+        if on_progress:
+            on_progress(event)
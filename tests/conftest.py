@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read at import time by the helpers; no database, no shared cache file
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "test")
+os.environ["DATABASE_URL"] = ""
+os.environ.pop("CACHE_DB_PATH", None)
+os.environ["PAGE_TOKEN_DELAY"] = "0"
+os.environ["PAGE_TOKEN_RETRY_DELAY"] = "0"
+os.environ["REQUEST_LOG"] = "0"
+
+import google_helpers
+from cache_helpers import _stores
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    for store in _stores:
+        store._local.clear()
+    yield
+
+
+class FakeGoogle:
+    """Stands in for google_get; records every call by endpoint."""
+
+    def __init__(self):
+        self.calls = []
+        self.handlers = {}
+
+    def __call__(self, endpoint, params):
+        self.calls.append((endpoint, dict(params)))
+        return self.handlers[endpoint](params)
+
+    def count(self, endpoint):
+        return sum(1 for name, _ in self.calls if name == endpoint)
+
+
+@pytest.fixture
+def fake_google(monkeypatch):
+    fake = FakeGoogle()
+    monkeypatch.setattr(google_helpers, "google_get", fake)
+    return fake
+
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
@@ -0,0 +1,65 @@
+from google_helpers import autocomplete_cities
+
+CITIES = [
+    "San Francisco, CA, USA",
+    "San Diego, CA, USA",
+    "San Jose, CA, USA",
+    "San Antonio, TX, USA",
+    "Santa Monica, CA, USA",
+    "San Juan, Puerto Rico",
+]
+
+
+def predictions(params):
+    query = params["input"].lower()
+    matches = [c for c in CITIES if c.lower().startswith(query)][:5]
+    return {"status": "OK" if matches else "ZERO_RESULTS",
+            "predictions": [{"description": c} for c in matches]}
+
+
+def test_full_list_is_not_narrowed(fake_google):
+    fake_google.handlers["autocomplete"] = predictions
+
+    assert len(autocomplete_cities("san")) == 5
+    # "san"'s 5 results were truncated: San Juan wasn't among them
+    assert autocomplete_cities("san j") == ["San Jose, CA, USA", "San Juan, Puerto Rico"]
+    assert autocomplete_cities("san ju") == ["San Juan, Puerto Rico"]
+    assert fake_google.count("autocomplete") == 2
+
+
+def test_short_list_is_narrowed_without_google(fake_google):
+    fake_google.handlers["autocomplete"] = predictions
+
+    assert autocomplete_cities("santa") == ["Santa Monica, CA, USA"]
+    assert autocomplete_cities("santa m") == ["Santa Monica, CA, USA"]
+    assert autocomplete_cities("santa mo") == ["Santa Monica, CA, USA"]
+    assert fake_google.count("autocomplete") == 1
+
+
+def test_empty_narrowing_asks_google(fake_google):
+    fake_google.handlers["autocomplete"] = predictions
+
+    assert autocomplete_cities("santa") == ["Santa Monica, CA, USA"]
+    assert autocomplete_cities("santa x") == []
+    assert autocomplete_cities("santa xy") == []
+    assert fake_google.count("autocomplete") == 3
+
+
+def test_non_prefix_matches_are_not_narrowed(fake_google):
+    # Google folds accents and knows aliases; a literal prefix filter doesn't
+    answers = {
+        "sao": ["São Paulo, State of São Paulo, Brazil", "São Luís, State of Maranhão, Brazil"],
+        "sao p": ["São Paulo, State of São Paulo, Brazil"],
+        "nyc": ["New York, NY, USA"],
+        "nyc n": ["New York, NY, USA"],
+    }
+    fake_google.handlers["autocomplete"] = lambda params: {
+        "status": "OK",
+        "predictions": [{"description": d} for d in answers[params["input"]]],
+    }
+
+    assert autocomplete_cities("sao") == answers["sao"]
+    assert autocomplete_cities("sao p") == answers["sao p"]
+    assert autocomplete_cities("nyc") == answers["nyc"]
+    assert autocomplete_cities("nyc n") == answers["nyc n"]
+    assert fake_google.count("autocomplete") == 4
@@ -0,0 +1,79 @@
+import threading
+
+import google_helpers
+from google_helpers import fetch_business_pages, iter_business_pages
+
+
+def place(n):
+    return {"place_id": f"p{n}", "name": f"Place {n}", "vicinity": "Main St",
+            "geometry": {"location": {"lat": 30.27, "lng": -97.74}}}
+
+
+def nearby_pages(params):
+    # Three pages of 20; tokens "1" and "2" lead to the next ones
+    page = int(params.get("pagetoken", 0))
+    data = {"status": "OK", "results": [place(page * 20 + i) for i in range(20)]}
+    if page < 2:
+        data["next_page_token"] = str(page + 1)
+    return data
+
+
+def test_limit_on_a_page_boundary_keeps_the_token(fake_google):
+    fake_google.handlers["nearby"] = nearby_pages
+
+    result = fetch_business_pages(30.27, -97.74, max_pages=3, target_count=20, profile="list")
+
+    assert len(result["businesses"]) == 20
+    assert result["next_page_token"] == "1"
+
+
+def test_limit_inside_a_page_returns_no_token(fake_google):
+    fake_google.handlers["nearby"] = nearby_pages
+
+    result = fetch_business_pages(30.27, -97.74, max_pages=3, target_count=25, profile="list")
+
+    # Page "2" would skip p25-p39
+    assert [b["place_id"] for b in result["businesses"]] == [f"p{i}" for i in range(25)]
+    assert result["next_page_token"] is None
+
+
+def test_closing_early_stops_the_prefetch(fake_google, monkeypatch):
+    fake_google.handlers["nearby"] = nearby_pages
+    monkeypatch.setattr(google_helpers, "PAGE_TOKEN_DELAY", 30)
+
+    prefetched = []
+    finished = threading.Event()
+    next_page_when_ready = google_helpers.next_page_when_ready
+
+    def recorded(*args):
+        prefetched.append(next_page_when_ready(*args))
+        finished.set()
+    monkeypatch.setattr(google_helpers, "next_page_when_ready", recorded)
+
+    pages = iter_business_pages(30.27, -97.74, max_pages=3, profile="list")
+    next(pages)
+    pages.close()
+
+    # The prefetch gives up during its wait instead of calling Google
+    assert finished.wait(5)
+    assert prefetched == [None]
+    assert fake_google.count("nearby") == 1
+
+
+def test_client_token_is_retried_until_active(fake_google):
+    answers = [{"status": "INVALID_REQUEST"}, nearby_pages({"pagetoken": "1"})]
+    fake_google.handlers["nearby"] = lambda params: answers.pop(0)
+
+    result = google_helpers.fetch_businesses(30.27, -97.74, next_token="1", profile="list")
+
+    assert [b["place_id"] for b in result["businesses"]] == [f"p{i}" for i in range(20, 40)]
+    assert fake_google.count("nearby") == 2
+
+
+def test_dead_client_token_is_a_bad_request(client, fake_google):
+    fake_google.handlers["nearby"] = lambda params: {"status": "INVALID_REQUEST"}
+
+    response = client.get("/api/businesses?lat=30.27&lng=-97.74&next_page_token=stale")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "next_page_token is invalid or expired"}
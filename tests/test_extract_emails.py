@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from common_helpers import extract_emails, clean_email_list, website_cache_key
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('<a href="mailto:Info@Shop.com?subject=Hi">Write to us</a>', {"Info@Shop.com"}),
+    ('<a href="mailto:a%40shop.com,b@shop.com">', {"a@shop.com", "b@shop.com"}),
+    ("hello&#64;bakery&#46;com", {"hello@bakery.com"}),
+    ("hello&#x40;bakery.com", {"hello@bakery.com"}),
+    ("info [at] shop [dot] co [dot] uk", {"info@shop.co.uk"}),
+    ("sales(at)shop.com", {"sales@shop.com"}),
+    ("Mail jo {at} bakery {dot} com.", {"jo@bakery.com"}),
+    ("plain owner@cafe.example.org here", {"owner@cafe.example.org"}),
+])
+def test_finds_addresses(text, expected):
+    assert extract_emails(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "We open (at) 9am (dot) com",
+    "Follow us {at} twitter (dot) com",
+    "meet me (at) the corner",
+    "price: 10 (at) 5 each",
+])
+def test_ignores_prose(text):
+    assert extract_emails(text) == set()
+
+
+def test_clean_email_list_drops_noise():
+    emails = [
+        "logo@2x.png",
+        "bg@3x.webp",
+        "errors@sentry.io",
+        "12345@shop.com",
+        "0123456789abcdef0123456789@shop.com",
+        "averyveryverylonglocalpartindeed@shop.com",
+        "Info@Shop.com",
+    ]
+    assert clean_email_list(emails) == ["Info@Shop.com"]
+
+
+@pytest.mark.parametrize("page", [
+    " " * 512 * 1024 + "x",
+    ("a" * 70 + " ") * 7000,
+    "a (at) " * 70000,
+    "(at)" + " " * 512 * 1024,
+])
+def test_scan_stays_linear(page):
+    started = time.perf_counter()
+    extract_emails(page)
+    assert time.perf_counter() - started < 1
+
+
+def test_cache_key_keeps_the_path_on_shared_hosts():
+    assert website_cache_key("https://www.facebook.com/joespizza") == "facebook.com/joespizza"
+    assert website_cache_key("https://facebook.com/otherbiz/") == "facebook.com/otherbiz"
+    assert website_cache_key("http://Example.com:8080/?utm_source=gmb") == "example.com"
+    assert website_cache_key("example.com") == "example.com"
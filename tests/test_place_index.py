@@ -0,0 +1,216 @@
+import pytest
+
+import place_helpers
+from place_helpers import PLACE_COLUMNS, fetch_businesses_indexed, place_rows, places_in_radius
+from scan_helpers import distance_m
+
+LAT, LNG = 30.2672, -97.7431
+
+
+class FakeIndex:
+    """places / place_tiles in memory, in place of the Postgres queries."""
+
+    def __init__(self):
+        self.places = {}
+        self.tiles = {}
+
+    def get_tiles(self, cells, place_type, keyword):
+        return {c[0]: self.tiles[(c[0], place_type, keyword)]
+                for c in cells if (c[0], place_type, keyword) in self.tiles}
+
+    def store_tile(self, geohash, place_type, keyword, place_ids, saturated):
+        self.tiles[(geohash, place_type, keyword)] = {
+            "geohash": geohash, "place_ids": list(place_ids), "saturated": saturated
+        }
+
+    def store_places(self, businesses):
+        for row in place_rows(businesses):
+            new = dict(zip(PLACE_COLUMNS + ["geohash", "hydrated"], row))
+            old = self.places.get(new["place_id"], {})
+            # COALESCE(EXCLUDED.col, places.col), hydrated sticks once set
+            merged = {k: v if v is not None else old.get(k) for k, v in new.items()}
+            merged["hydrated"] = new["hydrated"] or old.get("hydrated", False)
+            self.places[new["place_id"]] = merged
+
+    def fresh_place_ids(self, place_ids):
+        return {pid for pid in place_ids if pid in self.places and self.places[pid]["hydrated"]}
+
+    def load_places(self, place_ids, cells, lat, lng, radius):
+        rows = [
+            {k: v for k, v in self.places[pid].items() if k != "geohash"}
+            for pid in place_ids
+            if pid in self.places and any(self.places[pid]["geohash"].startswith(c[0]) for c in cells)
+        ]
+        rows.sort(key=lambda r: (-(r["reviews_count"] or 0), r["place_id"]))
+        return places_in_radius(rows, lat, lng, radius)
+
+
+class FakeExecutor:
+    """Holds background tile refreshes until the test runs them."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for fn, args in jobs:
+            fn(*args)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    fake = FakeIndex()
+    monkeypatch.setattr(place_helpers, "PLACE_INDEX_ENABLED", True)
+    monkeypatch.setattr(place_helpers, "_get_tiles", fake.get_tiles)
+    monkeypatch.setattr(place_helpers, "_store_tile", fake.store_tile)
+    monkeypatch.setattr(place_helpers, "store_places", fake.store_places)
+    monkeypatch.setattr(place_helpers, "_fresh_place_ids", fake.fresh_place_ids)
+    monkeypatch.setattr(place_helpers, "_load_places", fake.load_places)
+    return fake
+
+
+@pytest.fixture
+def background(monkeypatch):
+    executor = FakeExecutor()
+    monkeypatch.setattr(place_helpers, "_refresh_executor", executor)
+    monkeypatch.setattr(place_helpers, "_refreshing", set())
+    return executor
+
+
+def make_world(fake_google, count, spread=0.001):
+    # `count` places clustered around LAT, LNG, served by a fake Nearby
+    # Search (20 per page, 60 at most) and Place Details
+    world = {
+        f"p{i}": {"place_id": f"p{i}", "name": f"Place {i}", "vicinity": "Congress Ave",
+                  "user_ratings_total": i,
+                  "geometry": {"location": {"lat": LAT + spread * (i % 10) / 10,
+                                            "lng": LNG + spread * (i // 10) / 10}}}
+        for i in range(count)
+    }
+
+    def nearby(params):
+        if "pagetoken" in params:
+            lat, lng, radius, offset = params["pagetoken"].split(",")
+            offset = int(offset)
+        else:
+            lat, lng = params["location"].split(",")
+            radius, offset = params["radius"], 0
+        found = sorted(
+            (p for p in world.values()
+             if distance_m(float(lat), float(lng), p["geometry"]["location"]["lat"],
+                           p["geometry"]["location"]["lng"]) <= float(radius)),
+            key=lambda p: int(p["place_id"][1:])
+        )[:60]
+        data = {"status": "OK", "results": found[offset:offset + 20]}
+        if offset + 20 < len(found):
+            data["next_page_token"] = f"{lat},{lng},{radius},{offset + 20}"
+        return data
+
+    def details(params):
+        pid = params["place_id"]
+        return {"result": {"name": world[pid]["name"], "formatted_phone_number": "555-0100",
+                           "website": f"https://{pid}.example"}}
+
+    fake_google.handlers["nearby"] = nearby
+    fake_google.handlers["details"] = details
+    return world
+
+
+def search(radius=2000, **kwargs):
+    return fetch_businesses_indexed(LAT, LNG, "cafe", radius, **kwargs)
+
+
+def test_cold_area_costs_only_the_request(fake_google, index, background):
+    make_world(fake_google, 10)
+
+    result = search()
+
+    assert len(result["businesses"]) == 10
+    assert fake_google.count("nearby") == 1
+    assert fake_google.count("details") == 10
+    # The area's tiles are searched later, not while the client waits
+    assert len(background.jobs) == 1
+
+    background.run()
+    # One page per tile, and no Details for places the request already resolved
+    assert fake_google.count("nearby") == 1 + 4
+    assert fake_google.count("details") == 10
+
+
+def test_warm_area_is_answered_without_google(fake_google, index, background):
+    make_world(fake_google, 10)
+    search()
+    background.run()
+    calls = len(fake_google.calls)
+
+    result = search()
+
+    assert [b["place_id"] for b in result["businesses"]] == [f"p{i}" for i in range(9, -1, -1)]
+    assert all(b["phone"] == "555-0100" for b in result["businesses"])
+    assert len(fake_google.calls) == calls
+    assert background.jobs == []
+
+
+def test_saturated_tiles_are_split(fake_google, index, background):
+    world = make_world(fake_google, 80, spread=-0.02)
+
+    search()
+    assert fake_google.count("nearby") == 1
+
+    background.run()
+    saturated = [g for (g, _, _), t in index.tiles.items() if t["saturated"]]
+    assert [len(g) for g in saturated] == [5]
+    assert any(len(g) == 6 and g.startswith(saturated[0]) for g, _, _ in index.tiles)
+    calls = len(fake_google.calls)
+
+    # The saturated tile's children answer for it
+    result = search(limit=100)
+    assert len(fake_google.calls) == calls
+    in_radius = {pid for pid, p in world.items()
+                 if distance_m(LAT, LNG, p["geometry"]["location"]["lat"], p["geometry"]["location"]["lng"]) <= 2000}
+    assert len(in_radius) > 60
+    assert {b["place_id"] for b in result["businesses"]} == in_radius
+
+
+def test_saturated_at_the_finest_tiles_goes_to_google(fake_google, index, background):
+    make_world(fake_google, 80, spread=0.0002)
+
+    search()
+    background.run()
+    assert max(len(g) for g, _, _ in index.tiles) == place_helpers.TILE_PRECISION_MAX
+    nearby = fake_google.count("nearby")
+
+    # Straight to Google, and nothing more to refresh
+    search()
+    assert fake_google.count("nearby") == nearby + 1
+    assert background.jobs == []
+
+
+def test_complete_answer_fills_the_tiles_it_covers(fake_google, index, background):
+    make_world(fake_google, 10)
+
+    search(radius=5000)
+
+    # The one tile wholly inside the circle came from the answer itself; the
+    # other eight are too many to search in the background
+    assert fake_google.count("nearby") == 1
+    assert [t["place_ids"] for t in index.tiles.values()] == [[f"p{i}" for i in range(10)]]
+    assert background.jobs == []
+
+
+def test_list_results_are_not_taken_as_known(fake_google, index, background):
+    make_world(fake_google, 10)
+
+    search(profile="list")
+    assert fake_google.count("details") == 0
+    assert index.tiles == {}
+
+    # The tile refresh resolves them instead of trusting the contact-less rows
+    background.run()
+    assert fake_google.count("details") == 10
+
+    result = search(profile="list")
+    assert all(b["profile"] == "full" and b["phone"] == "555-0100" for b in result["businesses"])
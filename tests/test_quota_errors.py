@@ -0,0 +1,20 @@
+import pytest
+
+from quota_helpers import QuotaExceeded
+
+
+def over_quota(params):
+    raise QuotaExceeded("Google quota exhausted, try again shortly")
+
+
+@pytest.mark.parametrize("path, endpoint", [
+    ("/api/geocode?city=Austin", "geocode"),
+    ("/api/autocomplete?query=aus", "autocomplete"),
+])
+def test_quota_exceeded_is_a_json_503(client, fake_google, path, endpoint):
+    fake_google.handlers[endpoint] = over_quota
+
+    response = client.get(path)
+
+    assert response.status_code == 503
+    assert response.get_json() == {"error": "Google quota exhausted, try again shortly"}
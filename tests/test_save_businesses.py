@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+
+import app as app_module
+from test_scrape_jobs import auth_header
+
+
+def fake_saved_table(monkeypatch, existing=()):
+    # saved_businesses as a set of (name, address); NULL addresses never conflict
+    keys = set(existing)
+    next_id = [100]
+
+    @contextmanager
+    def db_cursor(commit=False):
+        yield None
+
+    def execute_values(cur, sql, rows, template=None, page_size=100, fetch=False):
+        returned = []
+        for row in rows:
+            ord, name, address = row[0], row[2], row[3]
+            next_id[0] += 1
+            if address is not None and (name, address) in keys:
+                continue
+            keys.add((name, address))
+            returned.append({"ord": ord, "id": next_id[0]})
+        return returned
+
+    monkeypatch.setattr(app_module, "db_cursor", db_cursor)
+    monkeypatch.setattr(app_module, "execute_values", execute_values)
+    monkeypatch.setattr(app_module, "get_cached_scrapes", lambda urls: {})
+
+
+def test_rows_are_matched_by_position(client, monkeypatch):
+    fake_saved_table(monkeypatch, existing={("Cafe", "1 Main St")})
+
+    response = client.post("/api/save-businesses", headers=auth_header(7), json={"businesses": [
+        {"name": "Taco Stand"},
+        {"name": "Taco Stand"},
+        {"name": "Cafe", "address": "1 Main St"},
+        {"address": "nowhere"},
+    ]})
+
+    assert response.get_json()["results"] == [
+        {"index": 0, "result": "saved", "id": 101},
+        {"index": 1, "result": "saved", "id": 102},
+        {"index": 2, "result": "already_saved"},
+        {"index": 3, "result": "invalid", "error": "name is required"},
+    ]
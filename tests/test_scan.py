@@ -0,0 +1,49 @@
+import app as app_module
+
+
+class FakeReservation:
+    def __init__(self, ok, balance):
+        self.ok = ok
+        self.balance = balance
+        self.committed = self.released = False
+
+    def commit(self):
+        self.committed = True
+
+    def release(self):
+        self.released = True
+
+
+def auth_header():
+    return {"Authorization": "Bearer " + app_module.generate_jwt({"id": 1, "email": "a@example.com"})}
+
+
+def test_scan_requires_sign_in(client, fake_google):
+    response = client.get("/api/businesses/scan?lat=30.27&lng=-97.74")
+
+    assert response.status_code == 401
+    assert fake_google.calls == []
+
+
+def test_scan_without_credits_does_not_search(client, fake_google, monkeypatch):
+    monkeypatch.setattr(app_module, "reserve_credits", lambda *args: FakeReservation(False, 3))
+
+    response = client.get("/api/businesses/scan?lat=30.27&lng=-97.74", headers=auth_header())
+
+    assert response.status_code == 402
+    assert response.get_json()["required"] == app_module.SCAN_COST
+    assert fake_google.calls == []
+
+
+def test_failed_scan_is_refunded(client, monkeypatch):
+    reservation = FakeReservation(True, 90)
+    monkeypatch.setattr(app_module, "reserve_credits", lambda *args: reservation)
+
+    def broken_scan(*args):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(app_module, "scan_area", broken_scan)
+
+    response = client.get("/api/businesses/scan?lat=30.27&lng=-97.74", headers=auth_header())
+
+    assert response.status_code == 500
+    assert reservation.released and not reservation.committed
@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+
+import app as app_module
+import job_helpers
+
+
+def job_row(user_id, status="running"):
+    return {"id": "abc", "user_id": user_id, "status": status, "total": 2, "completed": 1,
+            "results": {"https://a.example": ["hi@a.example"]}, "error": None,
+            "created_at": None, "updated_at": None}
+
+
+def auth_header(user_id):
+    return {"Authorization": "Bearer " + app_module.generate_jwt({"id": user_id, "email": "a@example.com"})}
+
+
+def test_signed_in_job_is_only_visible_to_its_owner(client, monkeypatch):
+    monkeypatch.setattr(app_module, "get_scrape_job", lambda job_id: job_row(7))
+
+    assert client.get("/api/scrape-jobs/abc").status_code == 404
+    assert client.get("/api/scrape-jobs/abc", headers=auth_header(8)).status_code == 404
+    assert client.get("/api/scrape-jobs/abc/stream", headers=auth_header(8)).status_code == 404
+
+    response = client.get("/api/scrape-jobs/abc", headers=auth_header(7))
+    assert response.status_code == 200
+    assert "user_id" not in response.get_json()
+
+
+def test_anonymous_job_is_visible_by_id(client, monkeypatch):
+    monkeypatch.setattr(app_module, "get_scrape_job", lambda job_id: job_row(None))
+
+    assert client.get("/api/scrape-jobs/abc").status_code == 200
+
+
+def test_stream_ends_when_the_job_is_deleted(client, monkeypatch):
+    rows = [job_row(None), job_row(None), None]
+    monkeypatch.setattr(app_module, "get_scrape_job", lambda job_id: rows.pop(0))
+    monkeypatch.setattr(app_module.time, "sleep", lambda seconds: None)
+
+    body = client.get("/api/scrape-jobs/abc/stream").get_data(as_text=True)
+
+    assert body.count("data: ") == 2
+    assert body.endswith('event: error\ndata: {"error": "Job not found"}\n\n')
+
+
+def test_stream_times_out(client, monkeypatch):
+    monkeypatch.setattr(app_module, "get_scrape_job", lambda job_id: job_row(None))
+    monkeypatch.setattr(app_module, "JOB_STREAM_TIMEOUT", 0)
+
+    body = client.get("/api/scrape-jobs/abc/stream").get_data(as_text=True)
+
+    assert body.endswith("event: timeout\ndata: {}\n\n")
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def fake_db_cursor(cursor):
+    @contextmanager
+    def db_cursor(commit=False):
+        yield cursor
+    return db_cursor
+
+
+def test_reading_a_job_never_writes(monkeypatch):
+    cursor = FakeCursor([job_row(None)])
+    monkeypatch.setattr(job_helpers, "db_cursor", fake_db_cursor(cursor))
+
+    assert job_helpers.get_scrape_job("abc")["status"] == "running"
+    assert all(sql.startswith("SELECT") for sql in cursor.statements)
+
+
+def test_recovery_resumes_the_sites_left_to_do(monkeypatch):
+    cursor = FakeCursor([{"id": "abc", "websites": ["https://a.example", "https://b.example"],
+                          "results": {"https://a.example": []}}])
+    started = []
+    monkeypatch.setattr(job_helpers, "db_cursor", fake_db_cursor(cursor))
+    monkeypatch.setattr(job_helpers, "_start_job", lambda job_id, websites: started.append((job_id, websites)))
+
+    job_helpers.recover_scrape_jobs()
+
+    assert started == [("abc", ["https://b.example"])]
+    assert cursor.statements[0].startswith("UPDATE scrape_jobs SET status = 'queued'")
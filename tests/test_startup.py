@@ -0,0 +1,53 @@
+import os
+import runpy
+from contextlib import contextmanager
+
+import app as app_module
+import auth_helpers
+import job_helpers
+
+APP_PATH = os.path.join(os.path.dirname(app_module.__file__), "app.py")
+
+
+def test_bcrypt_workers_start_no_background_threads(monkeypatch):
+    started = []
+    monkeypatch.setattr(auth_helpers, "start_google_certs_refresher", lambda: started.append("certs"))
+    monkeypatch.setattr(job_helpers, "start_scrape_job_sweeper", lambda: started.append("jobs"))
+
+    # What a "spawn" child does with the script `python app.py` ran
+    runpy.run_path(APP_PATH, run_name="__mp_main__")
+    assert started == []
+
+    runpy.run_path(APP_PATH, run_name="app")
+    assert "jobs" in started
+
+
+def test_register_hashes_without_holding_a_connection(client, monkeypatch):
+    held = []
+    rows = [None, {"id": 1, "credits": 5}]
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            pass
+
+        def fetchone(self):
+            return rows.pop(0)
+
+    @contextmanager
+    def db_cursor(commit=False):
+        held.append(True)
+        try:
+            yield Cursor()
+        finally:
+            held.pop()
+
+    def hash_password(password):
+        assert not held
+        return "hashed"
+
+    monkeypatch.setattr(app_module, "db_cursor", db_cursor)
+    monkeypatch.setattr(app_module, "hash_password", hash_password)
+
+    response = client.post("/api/register", json={"name": "A", "email": "a@example.com", "password": "pw"})
+    assert response.status_code == 200
+    assert response.get_json()["credits"] == 5